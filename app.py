@@ -1,29 +1,177 @@
-from flask import Flask, flash, render_template, request, redirect, url_for, session, jsonify, make_response
+from flask import Flask, g, has_app_context, has_request_context, flash, render_template, request, redirect, url_for, session, jsonify, make_response, Response, stream_with_context, send_file
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField, TextAreaField, EmailField, DateField
+from flask_wtf.csrf import generate_csrf
+from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField, TextAreaField, EmailField, DateField, HiddenField
 from wtforms.validators import DataRequired, Length, NumberRange, Email, ValidationError
 from datetime import datetime, timedelta
-from sqlalchemy import and_, case, or_, func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, case, or_, func, tuple_, text, bindparam, cast, literal, select, update, insert, delete, exists, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import aliased, joinedload, make_transient_to_detached, Session
 from werkzeug.security import generate_password_hash, check_password_hash
-from reportlab.lib.pagesizes import letter
+from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
+import click
+import csv
+import itertools
 import threading
 import time
+import random
+import signal
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from collections import namedtuple, OrderedDict
+from markupsafe import Markup
+from urllib.parse import urlencode
 import io
+import math
+import zlib
+import hashlib
 import os
+import json
+import base64
+import re
+import sqlite3
 from datetime import date
 
+def env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+def env_bool(name, default):
+    value = os.getenv(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value not in (None, '') else default
+
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///library.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///library.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool of server databases (PostgreSQL, MySQL)
+app.config['DB_POOL_SIZE'] = env_int('DB_POOL_SIZE', 10)
+app.config['DB_MAX_OVERFLOW'] = env_int('DB_MAX_OVERFLOW', 20)
+app.config['DB_POOL_TIMEOUT'] = env_int('DB_POOL_TIMEOUT', 30)  # seconds to wait for a connection
+app.config['DB_POOL_RECYCLE'] = env_int('DB_POOL_RECYCLE', 1800)  # seconds before a connection is replaced
+app.config['DB_POOL_PRE_PING'] = env_bool('DB_POOL_PRE_PING', True)
+# Read replicas: comma-separated URLs; views marked @replica_read are served from them
+app.config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+app.config['REPLICA_MAX_LAG_SECONDS'] = env_int('REPLICA_MAX_LAG_SECONDS', 30)
+app.config['REPLICA_CHECK_SECONDS'] = 5  # how long a measured replica lag is trusted
+app.config['REPLICA_STICKY_SECONDS'] = 30  # reads stay on the primary this long after a user's write
+# SQLite connection pragmas
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'wal')  # wal lets readers run beside the writer
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'normal')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+app.config['SQLITE_MMAP_SIZE'] = env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
 app.config['SECRET_KEY'] = 'library_secret_key_2025'
-db = SQLAlchemy(app)
+app.config['BOOKS_PER_PAGE'] = 24
+app.config['MAX_PAGE_SIZE'] = 100
+app.config['SEARCH_BACKEND'] = None  # None picks the backend for the database dialect
+app.config['SEARCH_RESULT_LIMIT'] = 50
+app.config['LOOKUP_RESULT_LIMIT'] = 10  # typeahead suggestions
+app.config['JOB_TICK_SECONDS'] = 15
+app.config['JOB_JITTER_SECONDS'] = 5
+app.config['JOB_LEASE_SECONDS'] = 60
+app.config['JOB_INTERVALS'] = {}  # job name -> seconds, overrides the registered interval
+# Set to false when jobs run in a separate 'flask jobs run' process
+app.config['RUN_BACKGROUND_JOBS'] = os.getenv('RUN_BACKGROUND_JOBS', 'true').lower() == 'true'
+app.config['FINE_PER_DAY'] = 1.0
+# Per-membership overrides of FINE_PER_DAY
+app.config['FINE_PER_DAY_BY_MEMBERSHIP'] = {'standard': 1.0, 'premium': 1.0}
+app.config['FINE_ACCRUAL_CHUNK_SIZE'] = 50000
+app.config['NOTIFICATION_TRANSPORT'] = 'console'  # console, file
+app.config['NOTIFICATION_OUTBOX'] = os.path.join(app.instance_path, 'outbox.jsonl')
+app.config['NOTIFICATION_BATCH_SIZE'] = 500
+app.config['NOTIFICATION_WORKERS'] = 8
+app.config['NOTIFICATION_LEASE_SECONDS'] = 300  # a claim older than this was abandoned, e.g. by a crash
+app.config['NOTIFICATION_RETRY_SECONDS'] = 300  # wait before retrying a failed delivery
+app.config['NOTIFICATION_COUNT_CACHE_SECONDS'] = 30
+app.config['NOTIFICATION_STREAM_POLL_SECONDS'] = 15
+app.config['NOTIFICATION_STREAM_MAX_SECONDS'] = 300  # clients reconnect after this
+# Open streams per process; keep it below the worker's threads so page requests still get one
+app.config['NOTIFICATION_STREAM_LIMIT'] = env_int('NOTIFICATION_STREAM_LIMIT', 16)
+app.config['STATS_CACHE_SECONDS'] = 30
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')  # memory, disk, none
+app.config['RESPONSE_CACHE_DIR'] = os.path.join(app.instance_path, 'response_cache')
+app.config['RESPONSE_CACHE_SIZE'] = 256  # pages kept by either backend
+app.config['RESPONSE_CACHE_SECONDS'] = 60  # bounds how stale live counts such as available copies get
+app.config['IDENTITY_CACHE_SECONDS'] = 30  # how long another process's profile or role edit can go unseen
+app.config['IDENTITY_CACHE_SIZE'] = 10000
+app.config['ID_BLOCK_SIZE'] = 20  # IDs reserved per process per round trip
+app.config['CATALOG_IMPORT_BATCH_SIZE'] = 1000
+app.config['EXPORT_BATCH_SIZE'] = 1000  # rows fetched per round trip and written per chunk
+app.config['REPORT_CACHE_DIR'] = os.path.join(app.instance_path, 'reports')
+app.config['REPORT_CACHE_SECONDS'] = 900  # rendered PDFs are reused for this long
+app.config['REPORT_WORKERS'] = 2
+app.config['REPORT_CHUNK_ROWS'] = 40  # rows per table, roughly one page
+app.config['REPORT_DEFAULT_DAYS'] = 30
+app.config['BORROW_MAX_RETRIES'] = 5
+app.config['BORROW_RETRY_BACKOFF_SECONDS'] = 0.05
+app.config['CARRELL_OPEN_HOUR'] = 9
+app.config['CARRELL_CLOSE_HOUR'] = 17
+app.config['CARRELL_SLOT_MINUTES'] = 60
+app.config['CARRELL_BOOKING_HOURS'] = [2, 3]
+app.config['CARRELL_DAILY_LIMIT'] = 2  # bookings per member per day
+app.config['CARRELL_CANCEL_CUTOFF_MINUTES'] = 60
+app.config['CARRELL_KEY_FINE'] = 10.0
+app.config['CARRELL_SWEEP_BATCH_SIZE'] = 500
+
+def database_engine_options(url):
+    """SQLAlchemy engine options for a database URL, from the DB_* settings"""
+    if url.startswith('sqlite'):
+        # pysqlite waits this long for the write lock before raising "database is locked"
+        return {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLITE_* pragmas to every new SQLite connection"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if app.config['SQLITE_JOURNAL_MODE']:
+        cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    if app.config['SQLITE_SYNCHRONOUS']:
+        cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}")
+    cursor.close()
+
+class RoutingSession(FlaskSession):
+    """Session that sends plain SELECTs to the replica chosen for the request.
+
+    Flushes, DML, raw SQL and SELECT ... FOR UPDATE always use the primary,
+    and a request that writes is remembered so the user reads their own writes.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if has_request_context() and (self._flushing or (clause is not None and clause.is_dml)):
+            g.db_wrote = True
+        replica = g.get('db_replica') if has_app_context() else None
+        if (replica is not None and bind is None and not self._flushing and clause is not None
+                and clause.is_select and getattr(clause, '_for_update_arg', None) is None):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica{number}': dict(database_engine_options(url), url=url)
+    for number, url in enumerate(app.config['DATABASE_REPLICA_URLS'], 1)
+}
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 
 @app.context_processor
 def inject_now():
@@ -60,20 +208,46 @@ class Member(db.Model):
     loans = db.relationship('Loan', backref='member', lazy=True)
     fines = db.relationship('Fine', backref='member', lazy=True)
     
+    # Typeahead lookups match name and email prefixes case-insensitively;
+    # every member page resolves the logged-in user's member row by user_id
+    __table_args__ = (
+        db.Index('ix_member_user_id', 'user_id'),
+        db.Index('ix_member_lower_first_name', func.lower(first_name)),
+        db.Index('ix_member_lower_last_name', func.lower(last_name)),
+        db.Index('ix_member_lower_email', func.lower(email)),
+    )
+    
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
     
     @property
     def current_loans_count(self):
+        stats = getattr(self, '_stats', None)
+        if stats is not None:
+            return stats['current_loans']
         return Loan.query.filter_by(member_id=self.id, return_date=None).count()
     
     @property
     def total_fines_due(self):
+        stats = getattr(self, '_stats', None)
+        if stats is not None:
+            return stats['fines_due']
         return db.session.query(func.sum(Fine.amount)).filter(
             Fine.member_id == self.id,
             Fine.paid_date == None
         ).scalar() or 0.0
+    
+    @property
+    def overdue_loans_count(self):
+        stats = getattr(self, '_stats', None)
+        if stats is not None:
+            return stats['overdue_loans']
+        return Loan.query.filter(
+            Loan.member_id == self.id,
+            Loan.return_date == None,
+            Loan.due_date < datetime.utcnow()
+        ).count()
 
 class Author(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -101,10 +275,23 @@ class Category(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     parent_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    # Materialized path of ids from the root, e.g. '/1/12/'; a subtree shares its root's prefix
+    path = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     parent = db.relationship('Category', remote_side=[id], backref='subcategories')
     books = db.relationship('Book', backref='category', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_category_path', 'path'),
+    )
+    
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to this category, itself included"""
+        if not self.path:
+            return [self.id]
+        return [int(part) for part in self.path.strip('/').split('/')]
 
 class Book(db.Model):
     id = db.Column(db.String(10), primary_key=True)
@@ -131,6 +318,12 @@ class Book(db.Model):
     
     loans = db.relationship('Loan', backref='book', lazy=True)
     
+    # Keyset pagination walks the catalog, or one category's books, in (title, id) order
+    __table_args__ = (
+        db.Index('ix_book_title_id', 'title', 'id'),
+        db.Index('ix_book_category_title', 'category_id', 'title', 'id'),
+    )
+    
     @property
     def is_available(self):
         return self.available_copies > 0
@@ -163,6 +356,13 @@ class Loan(db.Model):
     
     fine = db.relationship('Fine', backref='loan', uselist=False, lazy=True)
     
+    # A member's open loans, overdue detection, and open loans of a book
+    __table_args__ = (
+        db.Index('ix_loan_member_return', 'member_id', 'return_date'),
+        db.Index('ix_loan_status_due', 'status', 'due_date'),
+        db.Index('ix_loan_book_member_return', 'book_id', 'member_id', 'return_date'),
+    )
+    
     @property
     def is_overdue(self):
         if self.return_date:
@@ -177,7 +377,8 @@ class Loan(db.Model):
 
 class Fine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    loan_id = db.Column(db.Integer, db.ForeignKey('loan.id'), nullable=False)
+    loan_id = db.Column(db.Integer, db.ForeignKey('loan.id'))  # None for carrell fines
+    rental_id = db.Column(db.Integer, db.ForeignKey('carrell_rental.id'))  # set on carrell key fines
     member_id = db.Column(db.String(10), db.ForeignKey('member.id'), nullable=False)
     
     amount = db.Column(db.Float, nullable=False, default=0.0)
@@ -189,6 +390,16 @@ class Fine(db.Model):
     status = db.Column(db.String(20), nullable=False, default='pending')
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Fine accrual looks fines up by loan (at most one fine of each reason per loan)
+    # and key returns by rental; amount makes a member's unpaid total an index-only
+    # read; fine lists filter by status in issue order
+    __table_args__ = (
+        db.Index('ux_fine_loan_reason', 'loan_id', 'reason', unique=True),
+        db.Index('ix_fine_rental_id', 'rental_id'),
+        db.Index('ix_fine_member_paid', 'member_id', 'paid_date', 'amount'),
+        db.Index('ix_fine_status_issued', 'status', 'issued_date'),
+    )
 
 # Add to models section
 
@@ -200,14 +411,31 @@ class Notification(db.Model):
     notification_type = db.Column(db.String(50), nullable=False)  # carrell_reminder, carrell_fine, etc.
     is_read = db.Column(db.Boolean, nullable=False, default=False)
     scheduled_time = db.Column(db.DateTime, nullable=False)
-    sent_time = db.Column(db.DateTime)
+    sent_time = db.Column(db.DateTime)  # set once the transport accepted it
+    # A dispatcher claims a row by stamping its token and lease; failures push the lease out
+    claim_token = db.Column(db.String(32))
+    claimed_until = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     member = db.relationship('Member', backref='notifications')
+    
+    # The dispatcher claims unsent (sent_time IS NULL) rows in scheduled_time order;
+    # unread counts filter by member
+    __table_args__ = (
+        db.Index('ix_notification_sent_scheduled', 'sent_time', 'scheduled_time'),
+        db.Index('ix_notification_member_read', 'member_id', 'is_read'),
+    )
+
 
 
 
 
+class NotificationCounter(db.Model):
+    """Denormalized unread-notification count per member"""
+    member_id = db.Column(db.String(10), db.ForeignKey('member.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
 
 class Carrell(db.Model):
     id = db.Column(db.String(10), primary_key=True)
@@ -252,6 +480,86 @@ class CarrellRental(db.Model):
     member = db.relationship('Member', 
                            foreign_keys=[member_id],
                            backref=db.backref('carrell_rentals', lazy=True))
+    
+    # The expiry sweeper scans active rentals in scheduled_end_time order;
+    # noise fines look up a member's active rental
+    __table_args__ = (
+        db.Index('ix_carrell_rental_status_end', 'status', 'scheduled_end_time'),
+        db.Index('ix_carrell_rental_member_status', 'member_id', 'status'),
+    )
+
+class CarrellBooking(db.Model):
+    """A future carrell reservation, stored as a [start_time, end_time) interval"""
+    id = db.Column(db.Integer, primary_key=True)
+    carrell_id = db.Column(db.String(10), db.ForeignKey('carrell.id'), nullable=False)
+    member_id = db.Column(db.String(10), db.ForeignKey('member.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+
+    # Status: booked, cancelled
+    status = db.Column(db.String(20), nullable=False, default='booked')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    carrell = db.relationship('Carrell', backref=db.backref('bookings', lazy=True))
+    member = db.relationship('Member', backref=db.backref('carrell_bookings', lazy=True))
+
+    # Conflict checks are overlap range scans per carrell; the daily limit scans per member
+    __table_args__ = (
+        db.Index('ix_carrell_booking_slot', 'carrell_id', 'start_time', 'end_time'),
+        db.Index('ix_carrell_booking_member_start', 'member_id', 'start_time'),
+    )
+
+class LibraryStat(db.Model):
+    """Denormalized library-wide counter shown on the staff dashboards"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReferenceVersion(db.Model):
+    """Version tag of a cached choice list, bumped whenever its source rows change"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class JobState(db.Model):
+    """Persisted bookkeeping for a periodic job"""
+    name = db.Column(db.String(50), primary_key=True)
+    # High-water mark of the data already processed (job specific meaning)
+    watermark = db.Column(db.DateTime)
+    last_run_at = db.Column(db.DateTime)
+    last_result = db.Column(db.String(200))
+    last_error = db.Column(db.Text)
+
+class IdSequence(db.Model):
+    """Next unreserved value of a generated primary key sequence"""
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+
+class ImportCheckpoint(db.Model):
+    """Progress of a resumable catalog import, keyed by source file"""
+    source = db.Column(db.String(500), primary_key=True)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class SchemaMigration(db.Model):
+    """A schema migration that has been applied to this database"""
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class JobLease(db.Model):
+    """Time-limited lease electing the single process that runs periodic jobs"""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class ReplicationHeartbeat(db.Model):
+    """Single row the primary keeps touching; its age on a replica is that replica's lag"""
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
 
 # Update the Fine model to include new fine types
 # Add to the existing Fine model (modify the reason choices comment)
@@ -359,15 +667,31 @@ class CategoryForm(FlaskForm):
 # Add these form definitions to the forms section (after the existing forms)
 
 
+def normalize_id(value):
+    """Form filter for typed-in record IDs: ' m000012 ' -> 'M000012'"""
+    return value.strip().upper() if value else value
+
+def validate_active_member_id(form, field):
+    member = db.session.get(Member, field.data)
+    if member is None:
+        raise ValidationError('No member with that ID.')
+    if member.membership_status != 'active':
+        raise ValidationError('That member is not active.')
+
 class LoanForm(FlaskForm):
-    book_id = SelectField('Book', coerce=str, validators=[DataRequired()],
-                        render_kw={"class": "form-control"})
-    member_id = SelectField('Member', coerce=str, validators=[DataRequired()],
-                          render_kw={"class": "form-control"})
+    book_id = StringField('Book', validators=[DataRequired(), Length(max=10)], filters=[normalize_id],
+                        render_kw={"class": "form-control", "placeholder": "Search by title, ISBN or book ID"})
+    member_id = StringField('Member', validators=[DataRequired(), Length(max=10), validate_active_member_id],
+                          filters=[normalize_id],
+                          render_kw={"class": "form-control", "placeholder": "Search by name, email or member ID"})
     due_date = DateField('Due Date', validators=[DataRequired()], format='%Y-%m-%d',
                        render_kw={"class": "form-control", "type": "date"})
     submit = SubmitField('Create Loan', render_kw={"class": "btn btn-success"})
     
+    def validate_book_id(self, field):
+        if db.session.get(Book, field.data) is None:
+            raise ValidationError('No book with that ID.')
+    
     def validate_due_date(self, field):
         if field.data and field.data < date.today():
             raise ValidationError('Due date cannot be in the past.')
@@ -375,12 +699,25 @@ class LoanForm(FlaskForm):
 class CarrellRentalForm(FlaskForm):
     carrell_id = SelectField('Carrell', coerce=str, validators=[DataRequired()],
                            render_kw={"class": "form-control"})
-    member_id = SelectField('Member', coerce=str, validators=[DataRequired()],
-                          render_kw={"class": "form-control"})
+    member_id = StringField('Member', validators=[DataRequired(), Length(max=10), validate_active_member_id],
+                          filters=[normalize_id],
+                          render_kw={"class": "form-control", "placeholder": "Search by name, email or member ID"})
     duration_hours = SelectField('Duration', choices=[(3, '3 Hours')], coerce=int,
                                render_kw={"class": "form-control"})
     submit = SubmitField('Create Rental', render_kw={"class": "btn btn-success"})
 
+class CarrellBookingForm(FlaskForm):
+    carrell_id = HiddenField('Carrell', validators=[DataRequired()])
+    start_time = HiddenField('Start', validators=[DataRequired()])
+    hours = SelectField('Duration', coerce=int, render_kw={"class": "form-control"})
+    submit = SubmitField('Confirm Booking', render_kw={"class": "btn btn-success"})
+
+    def validate_start_time(self, field):
+        try:
+            field.data = datetime.strptime(field.data, '%Y-%m-%dT%H:%M')
+        except (TypeError, ValueError):
+            raise ValidationError('Invalid start time.')
+
 class CarrellForm(FlaskForm):
     name = StringField('Carrell Name', validators=[DataRequired(), Length(max=100)],
                       render_kw={"placeholder": "Enter carrell name", "class": "form-control"})
@@ -413,18 +750,109 @@ with app.app_context():
         db.session.add(librarian_user)
         db.session.commit()
 
+# Identity cache
+def row_values(instance):
+    """Column values of a loaded instance, keyed by attribute name"""
+    return {column.key: getattr(instance, column.key) for column in inspect(type(instance)).column_attrs}
+
+def cached_instance(model, values):
+    """Attach a cached row to the session as a clean persistent instance, without a query"""
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+class IdentityCache:
+    """Process-local TTL cache of each user's User and Member rows.
+
+    Entries are dropped as soon as a User or Member row changes in this
+    process; edits made by other processes show up within
+    IDENTITY_CACHE_SECONDS.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generation = 0
+    
+    def get(self, user_id):
+        """(user, member) for a user id; member is None for staff, both are None if unknown"""
+        with self.lock:
+            cached = self.entries.get(user_id)
+            generation = self.generation
+        if cached and time.time() - cached[2] < app.config['IDENTITY_CACHE_SECONDS']:
+            user = cached_instance(User, cached[0])
+            return user, cached[1] and cached_instance(Member, cached[1])
+        
+        row = db.session.query(User, Member).outerjoin(Member, Member.user_id == User.id).filter(
+            User.id == user_id
+        ).first()
+        if row is None:
+            return None, None
+        user, member = row
+        cached = (row_values(user), member and row_values(member), time.time())
+        with self.lock:
+            # An invalidation during the load means the row may already be stale
+            if generation == self.generation:
+                if len(self.entries) >= app.config['IDENTITY_CACHE_SIZE']:
+                    self.prune()
+                self.entries[user_id] = cached
+        return user, member
+    
+    def prune(self):
+        """Drop expired entries, or everything if none have expired (lock held)"""
+        cutoff = time.time() - app.config['IDENTITY_CACHE_SECONDS']
+        self.entries = {user_id: entry for user_id, entry in self.entries.items() if entry[2] >= cutoff}
+        if len(self.entries) >= app.config['IDENTITY_CACHE_SIZE']:
+            self.entries = {}
+    
+    def invalidate(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+            self.generation += 1
+
+identity_cache = IdentityCache()
+
+@event.listens_for(Session, 'after_flush')
+def collect_identity_changes(session, flush_context):
+    changed = set()
+    for instance in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, User):
+            changed.add(instance.id)
+        elif isinstance(instance, Member):
+            changed.add(instance.user_id)
+    if changed:
+        session.info.setdefault('identity_changed', set()).update(changed)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_identities(session):
+    changed = session.info.pop('identity_changed', None)
+    if changed:
+        identity_cache.invalidate(changed)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_identity_changes(session):
+    session.info.pop('identity_changed', None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """Resolve the session's user and, for members, their Member row as g.member"""
+    user, g.member = identity_cache.get(int(user_id))
+    return user
 
 # Helper Functions
+def fine_rate(membership_type):
+    """Daily overdue fine for a membership type"""
+    rates = app.config['FINE_PER_DAY_BY_MEMBERSHIP'] or {}
+    return float(rates.get(membership_type, app.config['FINE_PER_DAY']))
+
 def calculate_fine(loan):
     """Calculate fine for an overdue loan"""
     if not loan.is_overdue or loan.return_date:
         return 0.0
     
     days_overdue = loan.days_overdue
-    fine_per_day = 1.0  # $1 per day
+    fine_per_day = fine_rate(loan.member.membership_type)
     return round(days_overdue * fine_per_day, 2)
 
 
@@ -456,7 +884,7 @@ def schedule_carrell_notifications(rental):
             {
                 'time': at_due_time,
                 'title': 'Carrell Rental Expired - Fine Incurred',
-                'message': f'Your carrell rental for {rental.carrell.name} has expired. A $10 fine has been applied for late key return.',
+                'message': f"Your carrell rental for {rental.carrell.name} has expired. A ${app.config['CARRELL_KEY_FINE']:.2f} fine has been applied for late key return.",
                 'type': 'carrell_fine_notice'
             }
         ]
@@ -472,6 +900,7 @@ def schedule_carrell_notifications(rental):
             )
             db.session.add(notification)
         
+        adjust_unread_counts({rental.member_id: len(notifications)})
         db.session.commit()
         return True
         
@@ -480,82 +909,2989 @@ def schedule_carrell_notifications(rental):
         print(f"Error scheduling notifications: {str(e)}")
         return False
 
-def send_notification(notification):
-    """Send a notification (simulate email/SMS)"""
+# Notification delivery
+class NotificationTransport:
+    """Delivers one notification message; raise to report a failed delivery.
+
+    Messages are plain dicts (see notification_message()) so transports can run
+    on worker threads without touching the database session.
+    """
+    name = 'base'
+    
+    def send(self, message):
+        raise NotImplementedError
+
+class ConsoleTransport(NotificationTransport):
+    """Print notifications to the console"""
+    name = 'console'
+    
+    def send(self, message):
+        print(f"Notification sent to {message['member_name']}: {message['title']}")
+
+class FileTransport(NotificationTransport):
+    """Append notifications as JSON lines to a local outbox file, for testing"""
+    name = 'file'
+    
+    def __init__(self, path=None):
+        self.path = path or app.config['NOTIFICATION_OUTBOX']
+        self.lock = threading.Lock()
+    
+    def send(self, message):
+        line = json.dumps(message, default=str)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as outbox:
+                outbox.write(line + '\n')
+
+NOTIFICATION_TRANSPORTS = {
+    'console': ConsoleTransport,
+    'file': FileTransport,
+}
+
+def get_notification_transport():
+    """Instantiate the transport named by NOTIFICATION_TRANSPORT"""
+    return NOTIFICATION_TRANSPORTS[app.config['NOTIFICATION_TRANSPORT']]()
+
+def notification_message(notification):
+    """Detach what a transport needs from a notification and its member"""
+    member = notification.member
+    return {
+        'id': notification.id,
+        'member_id': notification.member_id,
+        'member_name': member.full_name if member else None,
+        'email': member.email if member else None,
+        'phone': member.phone if member else None,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'scheduled_time': notification.scheduled_time.isoformat(),
+    }
+
+def send_notification(notification, transport=None):
+    """Send a single notification now and mark it as sent"""
+    try:
+        (transport or get_notification_transport()).send(notification_message(notification))
+        notification.sent_time = datetime.utcnow()
+        db.session.commit()
+        return True
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error sending notification: {str(e)}")
+        return False
+
+def claimable_notifications(now):
+    """Filter of unsent notifications that are due and not leased to a dispatcher at `now`"""
+    return [
+        Notification.sent_time == None,
+        Notification.scheduled_time <= now,
+        or_(Notification.claimed_until == None, Notification.claimed_until <= now),
+    ]
+
+def claim_due_notifications(now, batch_size):
+    """Claim up to batch_size due notifications and return (token, notifications).
+
+    Candidates are read through the (sent_time, scheduled_time) index and
+    claimed with a single UPDATE that stamps a fresh claim token and a lease
+    of NOTIFICATION_LEASE_SECONDS. The claimable guard means a row claimed by
+    another dispatcher is skipped, not sent twice, and the claimed rows are
+    read back by their token. sent_time is only set after delivery, so a
+    dispatcher that dies mid-batch leaves rows that are retried once their
+    lease runs out.
+    """
+    candidates = db.session.query(Notification.id).filter(
+        *claimable_notifications(now)
+    ).order_by(Notification.scheduled_time).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    candidate_ids = [row.id for row in candidates.all()]
+    if not candidate_ids:
+        db.session.rollback()
+        return None, []
+    
+    token = uuid.uuid4().hex
+    lease = datetime.utcnow() + timedelta(seconds=app.config['NOTIFICATION_LEASE_SECONDS'])
+    db.session.execute(
+        update(Notification).where(
+            Notification.id.in_(candidate_ids),
+            *claimable_notifications(now)
+        ).values(claim_token=token, claimed_until=lease).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    
+    return token, Notification.query.options(joinedload(Notification.member)).filter(
+        Notification.claim_token == token
+    ).order_by(Notification.scheduled_time).all()
+
+def dispatch_notification_batch(transport, executor, now=None, batch_size=None):
+    """Claim one batch of due notifications and deliver it on the worker pool.
+
+    Delivered rows get their sent_time. Failed ones have their attempt count
+    raised and their lease moved NOTIFICATION_RETRY_SECONDS ahead, so later
+    batches of the same run (which claim as of `now`) skip them instead of
+    retrying the same rows first. Returns counts and throughput for the batch.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or app.config['NOTIFICATION_BATCH_SIZE']
+    started = time.time()
+    
+    token, claimed = claim_due_notifications(now, batch_size)
+    messages = [notification_message(n) for n in claimed]
+    if not messages:
+        return {'claimed': 0, 'sent': 0, 'failed': 0, 'seconds': 0.0, 'per_second': 0.0}
+    
+    def deliver(message):
+        try:
+            transport.send(message)
+            return None
+        except Exception as e:
+            print(f"Error sending notification {message['id']}: {str(e)}")
+            return message['id']
+    
+    failed_ids = [notification_id for notification_id in executor.map(deliver, messages) if notification_id]
+    sent_ids = [message['id'] for message in messages if message['id'] not in failed_ids]
+    finished = datetime.utcnow()
+    if sent_ids:
+        db.session.execute(
+            update(Notification).where(Notification.id.in_(sent_ids), Notification.claim_token == token)
+            .values(sent_time=finished, claim_token=None, claimed_until=None)
+            .execution_options(synchronize_session=False)
+        )
+    if failed_ids:
+        db.session.execute(
+            update(Notification).where(Notification.id.in_(failed_ids), Notification.claim_token == token)
+            .values(attempts=Notification.attempts + 1, claim_token=None,
+                    claimed_until=finished + timedelta(seconds=app.config['NOTIFICATION_RETRY_SECONDS']))
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    
+    seconds = time.time() - started
+    sent = len(messages) - len(failed_ids)
+    return {
+        'claimed': len(messages),
+        'sent': sent,
+        'failed': len(failed_ids),
+        'seconds': round(seconds, 3),
+        'per_second': round(sent / seconds, 1) if seconds else float(sent),
+    }
+
+def check_pending_notifications(max_batches=100):
+    """Check and send pending notifications (to be called periodically)"""
+    try:
+        now = datetime.utcnow()
+        transport = get_notification_transport()
+        total_sent = 0
+        with ThreadPoolExecutor(max_workers=app.config['NOTIFICATION_WORKERS']) as executor:
+            for _ in range(max_batches):
+                renew_job_lease()
+                report = dispatch_notification_batch(transport, executor, now)
+                if not report['claimed']:
+                    break
+                total_sent += report['sent']
+                print(f"Notification batch: {report['sent']}/{report['claimed']} sent "
+                      f"in {report['seconds']}s ({report['per_second']}/s)")
+                if report['sent'] == 0:
+                    # Every delivery failed, so the transport is likely down; the failed
+                    # rows wait out NOTIFICATION_RETRY_SECONDS before any run retries them
+                    break
+        return total_sent
+        
+    except LeaseLost:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error checking pending notifications: {str(e)}")
+        return 0
+
+# Unread notification counts
+def count_unread_notifications(member_id):
+    """Authoritative unread count, straight from the notification table"""
+    return Notification.query.filter_by(member_id=member_id, is_read=False).count()
+
+class UnreadCountCache:
+    """In-process cache of unread counts that also wakes up waiting SSE streams.
+
+    Entries expire after NOTIFICATION_COUNT_CACHE_SECONDS so changes made by
+    other processes are picked up; changes made here are published
+    immediately after their transaction commits.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.counts = {}
+        self.versions = {}
+    
+    def get(self, member_id):
+        with self.condition:
+            cached = self.counts.get(member_id)
+        if cached and time.time() - cached[1] < app.config['NOTIFICATION_COUNT_CACHE_SECONDS']:
+            return cached[0]
+        
+        count = load_unread_count(member_id)
+        with self.condition:
+            self.counts[member_id] = (count, time.time())
+        return count
+    
+    def version(self, member_id):
+        with self.condition:
+            return self.versions.get(member_id, 0)
+    
+    def publish(self, member_ids):
+        """Drop cached counts for these members and wake their streams"""
+        with self.condition:
+            for member_id in member_ids:
+                self.counts.pop(member_id, None)
+                self.versions[member_id] = self.versions.get(member_id, 0) + 1
+            self.condition.notify_all()
+    
+    def wait(self, member_id, version, timeout):
+        """Block until the member's count changes here or the timeout passes"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.versions.get(member_id, 0) != version, timeout)
+
+unread_counts = UnreadCountCache()
+
+def load_unread_count(member_id):
+    """Read a member's counter row, initialising it from the table if missing"""
+    counter = db.session.get(NotificationCounter, member_id)
+    if counter is not None:
+        return counter.unread_count
+    
+    count = count_unread_notifications(member_id)
+    try:
+        db.session.add(NotificationCounter(member_id=member_id, unread_count=count))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    return count
+
+def adjust_unread_counts(deltas):
+    """Apply {member_id: delta} to the unread counters in the current transaction.
+
+    Listeners are notified once the transaction commits. A member without a
+    counter row gets one initialised from the (already flushed) table instead.
+    """
+    changed = set()
+    for member_id, delta in deltas.items():
+        if not delta:
+            continue
+        updated = db.session.execute(
+            update(NotificationCounter).where(NotificationCounter.member_id == member_id)
+            .values(unread_count=NotificationCounter.unread_count + delta)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db.session.flush()
+            db.session.add(NotificationCounter(
+                member_id=member_id, unread_count=count_unread_notifications(member_id)
+            ))
+        changed.add(member_id)
+    db.session.info.setdefault('unread_changed', set()).update(changed)
+
+@event.listens_for(Session, 'after_commit')
+def publish_unread_changes(session):
+    changed = session.info.pop('unread_changed', None)
+    if changed:
+        unread_counts.publish(changed)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_unread_changes(session):
+    session.info.pop('unread_changed', None)
+
+def rebuild_unread_counters():
+    """Recompute every member's unread counter with one grouped query"""
+    db.session.execute(update(NotificationCounter).values(unread_count=0))
+    rows = db.session.query(Notification.member_id, func.count(Notification.id)).filter(
+        Notification.is_read == False
+    ).group_by(Notification.member_id).all()
+    existing = {member_id for (member_id,) in db.session.query(NotificationCounter.member_id)}
+    
+    db.session.bulk_update_mappings(NotificationCounter, [
+        {'member_id': member_id, 'unread_count': count} for member_id, count in rows if member_id in existing
+    ])
+    db.session.bulk_insert_mappings(NotificationCounter, [
+        {'member_id': member_id, 'unread_count': count} for member_id, count in rows if member_id not in existing
+    ])
+    db.session.info.setdefault('unread_changed', set()).update(existing | {member_id for member_id, _ in rows})
+    return len(rows)
+
+# Dashboard statistics
+def library_stat_queries():
+    """Authoritative COUNT query for every dashboard counter"""
+    return {
+        'total_books': db.session.query(func.count(Book.id)),
+        'total_members': db.session.query(func.count(Member.id)),
+        'total_authors': db.session.query(func.count(Author.id)),
+        'total_publishers': db.session.query(func.count(Publisher.id)),
+        'active_loans': db.session.query(func.count(Loan.id)).filter(Loan.return_date == None),
+        'overdue_loans': db.session.query(func.count(Loan.id)).filter(Loan.status == 'overdue'),
+        'pending_fines': db.session.query(func.count(Fine.id)).filter(Fine.status == 'pending'),
+    }
+
+class StatsCache:
+    """Process-local TTL cache of the library_stat table"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+        self.loaded_at = 0.0
+    
+    def get(self):
+        with self.lock:
+            if self.stats is not None and time.time() - self.loaded_at < app.config['STATS_CACHE_SECONDS']:
+                return self.stats
+        
+        stats = dict(db.session.query(LibraryStat.name, LibraryStat.value).all())
+        if set(stats) != set(library_stat_queries()):
+            rebuild_library_stats()
+            db.session.commit()
+            stats = dict(db.session.query(LibraryStat.name, LibraryStat.value).all())
+        
+        with self.lock:
+            self.stats = stats
+            self.loaded_at = time.time()
+        return stats
+    
+    def invalidate(self):
+        with self.lock:
+            self.stats = None
+
+library_stats = StatsCache()
+
+def adjust_stats(**deltas):
+    """Apply counter deltas in the current transaction, e.g. adjust_stats(active_loans=1)"""
+    for name, delta in deltas.items():
+        if delta:
+            db.session.execute(
+                update(LibraryStat).where(LibraryStat.name == name)
+                .values(value=LibraryStat.value + delta, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+    db.session.info['stats_changed'] = True
+
+def rebuild_library_stats():
+    """Recompute every counter from the source tables with a single query"""
+    queries = library_stat_queries()
+    row = db.session.query(*[query.label(name) for name, query in queries.items()]).one()
+    existing = {name for (name,) in db.session.query(LibraryStat.name)}
+    now = datetime.utcnow()
+    
+    for name in queries:
+        values = {'name': name, 'value': getattr(row, name), 'updated_at': now}
+        if name in existing:
+            db.session.bulk_update_mappings(LibraryStat, [values])
+        else:
+            db.session.bulk_insert_mappings(LibraryStat, [values])
+    db.session.info['stats_changed'] = True
+    return row._asdict()
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_library_stats(session):
+    if session.info.pop('stats_changed', False):
+        library_stats.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_library_stats_changes(session):
+    session.info.pop('stats_changed', None)
+
+# Reference data choices
+# Doubles as a SelectField (value, label) pair and an object with .id/.name for templates
+Choice = namedtuple('Choice', ['id', 'name'])
+
+def author_choices():
+    return [Choice(*row) for row in db.session.query(Author.id, Author.name).order_by(Author.name)]
+
+def publisher_choices():
+    return [Choice(*row) for row in db.session.query(Publisher.id, Publisher.name).order_by(Publisher.name)]
+
+def category_choices():
+    return [Choice(*row) for row in db.session.query(Category.id, Category.name).order_by(Category.name)]
+
+def available_carrell_choices():
+    rows = db.session.query(Carrell.id, Carrell.name, Carrell.location).filter(
+        Carrell.is_available == True
+    ).order_by(Carrell.id)
+    return [Choice(id, f"{name} - {location}") for id, name, location in rows]
+
+# Choice list name -> loader
+REFERENCE_CHOICES = {
+    'authors': author_choices,
+    'publishers': publisher_choices,
+    'categories': category_choices,
+    'available_carrells': available_carrell_choices,
+}
+
+class ChoiceCache:
+    """Process-local cache of choice lists, tagged with their reference_version.
+
+    Every read checks the version tags (one small primary-key query), so a
+    list changed by any worker is reloaded everywhere on the next request.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+    
+    def get_many(self, names):
+        versions = dict(db.session.query(ReferenceVersion.name, ReferenceVersion.version).filter(
+            ReferenceVersion.name.in_(names)
+        ))
+        
+        choices = []
+        for name in names:
+            version = versions.get(name, 0)
+            with self.lock:
+                cached = self.entries.get(name)
+            if cached is None or cached[0] != version:
+                # Tag with the version read *before* loading: a concurrent change
+                # can only make the entry look older than it is, never newer
+                cached = (version, REFERENCE_CHOICES[name]())
+                with self.lock:
+                    self.entries[name] = cached
+            choices.append(cached[1])
+        return choices
+    
+    def get(self, name):
+        return self.get_many([name])[0]
+
+choice_cache = ChoiceCache()
+
+def invalidate_tags(*names):
+    """Bump version tags in the current transaction, expiring the choice lists and cached pages using them"""
+    db.session.execute(
+        update(ReferenceVersion).where(ReferenceVersion.name.in_(names))
+        .values(version=ReferenceVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def init_reference_versions():
+    """Create the version rows of every choice list that does not have one yet"""
+    existing = {name for (name,) in db.session.query(ReferenceVersion.name)}
+    for name in itertools.chain(REFERENCE_CHOICES, PAGE_TAGS):
+        if name not in existing:
+            db.session.add(ReferenceVersion(name=name, version=0))
+    db.session.commit()
+
+# Response cache
+# Version tags of cached pages that have no choice list of their own
+PAGE_TAGS = ['books']
+# Blocks of a page template that are cached; the base layout is rendered per user
+PAGE_BLOCKS = ('content', 'scripts')
+# Stands in for the per-session CSRF token inside cached blocks
+CSRF_PLACEHOLDER = '\x00csrf-token\x00'
+
+class ResponseCache:
+    """Storage of rendered pages: {'title', 'blocks', 'etag', 'stored_at'} dicts by key"""
+    name = 'base'
+    
+    def get(self, key):
+        raise NotImplementedError
+    
+    def set(self, key, entry):
+        raise NotImplementedError
+
+class MemoryResponseCache(ResponseCache):
+    """Process-local LRU of the RESPONSE_CACHE_SIZE most recently used pages"""
+    name = 'memory'
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+    
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > app.config['RESPONSE_CACHE_SIZE']:
+                self.entries.popitem(last=False)
+
+class DiskResponseCache(ResponseCache):
+    """JSON files under RESPONSE_CACHE_DIR, shared by every process on the host.
+
+    Reads touch a file's mtime, and the least recently used files are removed
+    once there are more than RESPONSE_CACHE_SIZE.
+    """
+    name = 'disk'
+    
+    def __init__(self, path=None):
+        self.path = path or app.config['RESPONSE_CACHE_DIR']
+        os.makedirs(self.path, exist_ok=True)
+    
+    def file_path(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+    
+    def get(self, key):
+        path = self.file_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('key') == key else None
+    
+    def set(self, key, entry):
+        path = self.file_path(key)
+        # Write then rename, so concurrent readers never see a partial file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(entry, key=key), f)
+        os.replace(temp_path, path)
+        self.evict()
+    
+    def evict(self):
+        files = [entry for entry in os.scandir(self.path) if entry.name.endswith('.json')]
+        excess = len(files) - app.config['RESPONSE_CACHE_SIZE']
+        if excess <= 0:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:excess]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+RESPONSE_CACHES = {
+    'memory': MemoryResponseCache,
+    'disk': DiskResponseCache,
+}
+
+_response_cache = None
+
+def get_response_cache():
+    """Return the cache named by RESPONSE_CACHE_BACKEND, or None when caching is off"""
+    global _response_cache
+    backend = RESPONSE_CACHES.get(app.config['RESPONSE_CACHE_BACKEND'])
+    if backend is None:
+        return None
+    if not isinstance(_response_cache, backend):
+        _response_cache = backend()
+    return _response_cache
+
+def response_cache_key(tags):
+    """Cache key of the current page: path, query args, role, date and the tags' versions"""
+    versions = dict(db.session.query(ReferenceVersion.name, ReferenceVersion.version).filter(
+        ReferenceVersion.name.in_(tags)
+    ))
+    args = urlencode(sorted(request.args.items(multi=True)))
+    tag_versions = ','.join(f'{tag}={versions.get(tag, 0)}' for tag in sorted(tags))
+    return f'{request.path}?{args}|{current_user.role}|{date.today().isoformat()}|{tag_versions}'
+
+def render_page_blocks(template_name, context):
+    """Render the PAGE_BLOCKS of a page template without the base layout"""
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    template_context = template.new_context(context)
+    return {name: ''.join(template.blocks[name](template_context)) if name in template.blocks else ''
+            for name in PAGE_BLOCKS}
+
+def page_etag(entry):
+    """ETag of a cached page for the current user, whose layout and CSRF token differ"""
+    # Roll over every half CSRF lifetime so a revalidated page never holds an expired token
+    limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time.time() // (limit / 2)) if limit else 0
+    return hashlib.sha1(f"{entry['etag']}|{current_user.get_id()}|{window}".encode('utf-8')).hexdigest()
+
+def render_cached_page(template_name, tags, load_context):
+    """Render a page through the response cache.
+
+    `load_context` runs the page's queries and is only called on a miss. Entries
+    are keyed by the versions of `tags`, so invalidate_tags() in a write route
+    expires them in every process. Browsers revalidate with If-None-Match and
+    get a 304 while the page is unchanged.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return render_template(template_name, **load_context())
+    
+    key = response_cache_key(tags)
+    entry = cache.get(key)
+    if entry is None or time.time() - entry['stored_at'] >= app.config['RESPONSE_CACHE_SECONDS']:
+        context = load_context()
+        csrf_token = generate_csrf()
+        blocks = {name: html.replace(csrf_token, CSRF_PLACEHOLDER)
+                  for name, html in render_page_blocks(template_name, context).items()}
+        entry = {
+            'title': context.get('title'),
+            'blocks': blocks,
+            'etag': hashlib.sha1(json.dumps(blocks, sort_keys=True).encode('utf-8')).hexdigest(),
+            'stored_at': time.time(),
+        }
+        cache.set(key, entry)
+    
+    etag = page_etag(entry)
+    # Pending flash messages are only shown by a full render
+    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+        response = make_response('', 304)
+    else:
+        csrf_token = generate_csrf()
+        blocks = {name: Markup(html.replace(CSRF_PLACEHOLDER, csrf_token)) for name, html in entry['blocks'].items()}
+        response = make_response(render_template('cached_page.html', title=entry['title'], **blocks))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Periodic jobs
+# Registered jobs, keyed by name: {'func': callable(state, now), 'interval': timedelta}
+PERIODIC_JOBS = {}
+
+def periodic_job(name, interval):
+    """Register a function as a periodic job run every `interval`"""
+    def decorator(func):
+        PERIODIC_JOBS[name] = {'func': func, 'interval': interval}
+        return func
+    return decorator
+
+def get_job_state(name):
+    """Fetch the persisted state row for a job, creating it on first use"""
+    state = db.session.get(JobState, name)
+    if state is None:
+        state = JobState(name=name)
+        db.session.add(state)
+    return state
+
+def run_job(name, now=None):
+    """Run one job and record its outcome. Returns the job's result or None on error"""
+    job = PERIODIC_JOBS[name]
+    now = now or datetime.utcnow()
+    state = get_job_state(name)
+    try:
+        result = job['func'](state, now)
+        state.last_run_at = now
+        state.last_result = str(result)[:200]
+        state.last_error = None
+        db.session.commit()
+        return result
+    except LeaseLost:
+        # Another runner owns the jobs now; leave the state for it to record
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        state = get_job_state(name)
+        state.last_run_at = now
+        state.last_error = str(e)
+        db.session.commit()
+        print(f"Error running job {name}: {str(e)}")
+        return None
+
+def job_interval(name):
+    """A job's run interval, honouring any JOB_INTERVALS override"""
+    seconds = app.config['JOB_INTERVALS'].get(name)
+    return timedelta(seconds=seconds) if seconds is not None else PERIODIC_JOBS[name]['interval']
+
+def run_due_jobs(now=None):
+    """Run every registered job whose interval has elapsed since its last run"""
+    now = now or datetime.utcnow()
+    results = {}
+    for name in PERIODIC_JOBS:
+        renew_job_lease()
+        state = get_job_state(name)
+        if state.last_run_at is None or now - state.last_run_at >= job_interval(name):
+            results[name] = run_job(name, now)
+    db.session.commit()
+    return results
+
+def acquire_lease(name, holder, ttl):
+    """Take or renew the named lease for `holder`. Returns True while it is held.
+
+    The conditional UPDATE only succeeds for the current holder or once the
+    previous holder's lease has expired, so at most one holder wins.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    try:
+        renewed = db.session.execute(
+            update(JobLease).where(
+                JobLease.name == name,
+                or_(JobLease.holder == holder, JobLease.expires_at < now)
+            ).values(
+                holder=holder,
+                expires_at=expires_at,
+                acquired_at=case((JobLease.holder == holder, JobLease.acquired_at), else_=now)
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        if not renewed:
+            if db.session.get(JobLease, name) is not None:
+                db.session.rollback()
+                return False
+            db.session.add(JobLease(name=name, holder=holder, acquired_at=now, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        # Another process created the lease row first
+        db.session.rollback()
+        return False
+
+def release_lease(name, holder):
+    """Give up the lease if `holder` still owns it"""
+    db.session.execute(
+        update(JobLease).where(JobLease.name == name, JobLease.holder == holder)
+        .values(expires_at=datetime.utcnow()).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+class LeaseLost(Exception):
+    """Raised when a job runner finds that another runner has taken its lease"""
+
+def renew_job_lease():
+    """Renew the running job runner's lease, raising LeaseLost if it has been taken over.
+
+    Jobs call this before each unit of work (each job, chunk or batch), so a
+    long job keeps its lease alive and stops at the next boundary once another
+    runner has taken over. Outside a runner, e.g. `flask jobs run-once`, there
+    is no lease and this does nothing. Commits the current transaction.
+    """
+    lease = g.get('job_lease')
+    if lease is None:
+        return
+    name, holder = lease
+    if not acquire_lease(name, holder, app.config['JOB_LEASE_SECONDS']):
+        raise LeaseLost(f"Lease {name} is no longer held by {holder}")
+
+class JobRunner:
+    """Runs periodic jobs in whichever process holds the scheduler lease.
+
+    Every process may start a runner; they all compete for the same lease row
+    and only the holder runs jobs, renewing the lease on each tick and between
+    units of work inside long jobs. If the leader dies, another runner takes
+    over once the lease expires, and a leader that finds its lease taken stops.
+    """
+    lease_name = 'scheduler'
+    
+    def __init__(self):
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stop_event = threading.Event()
+        self.is_leader = False
+    
+    def tick(self):
+        """Renew or acquire the lease and run due jobs if we are the leader"""
+        with app.app_context():
+            was_leader = self.is_leader
+            self.is_leader = acquire_lease(self.lease_name, self.holder, app.config['JOB_LEASE_SECONDS'])
+            if self.is_leader != was_leader:
+                print(f"Job runner {self.holder} {'became' if self.is_leader else 'is no longer'} leader")
+            if not self.is_leader:
+                return {}
+            g.job_lease = (self.lease_name, self.holder)
+            try:
+                return run_due_jobs()
+            except LeaseLost as e:
+                self.is_leader = False
+                print(f"Job runner {self.holder} stopped: {str(e)}")
+                return {}
+    
+    def run(self):
+        """Tick until stop() is called, then hand the lease back"""
+        while not self.stop_event.is_set():
+            try:
+                for name, result in self.tick().items():
+                    print(f"Job {name}: {result}")
+            except Exception as e:
+                print(f"Error in job runner: {str(e)}")
+            # Jitter keeps runners started together from polling in lockstep
+            delay = app.config['JOB_TICK_SECONDS'] + random.uniform(0, app.config['JOB_JITTER_SECONDS'])
+            self.stop_event.wait(delay)
+        
+        if self.is_leader:
+            with app.app_context():
+                release_lease(self.lease_name, self.holder)
+            self.is_leader = False
+    
+    def stop(self, *args):
+        self.stop_event.set()
+
+# Read replicas
+def replica_keys():
+    """Bind keys of the configured read replicas"""
+    return [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica')]
+
+def write_replication_heartbeat(now=None):
+    """Record `now` in the heartbeat row on the primary (current transaction)"""
+    now = now or datetime.utcnow()
+    heartbeat = db.session.get(ReplicationHeartbeat, 1)
+    if heartbeat is None:
+        db.session.add(ReplicationHeartbeat(id=1, beat_at=now))
+    else:
+        heartbeat.beat_at = now
+    return now
+
+def measure_replica_lag(key):
+    """Seconds the replica's heartbeat trails the primary's, or None if it cannot be known.
+
+    Lag is only measurable while the heartbeat job keeps writing: once the
+    primary's heartbeat is older than REPLICA_MAX_LAG_SECONDS both rows are
+    frozen and would read as no lag, so the lag is reported as unknown.
+    """
+    query = select(ReplicationHeartbeat.beat_at).where(ReplicationHeartbeat.id == 1)
+    try:
+        with db.engine.connect() as connection:
+            primary = connection.execute(query).scalar()
+        with db.engines[key].connect() as connection:
+            replica = connection.execute(query).scalar()
+    except SQLAlchemyError as e:
+        print(f"Replica {key} is unavailable: {str(e)}")
+        return None
+    if primary is None or replica is None:
+        return None
+    if (datetime.utcnow() - primary).total_seconds() > app.config['REPLICA_MAX_LAG_SECONDS']:
+        print("Replication heartbeat is stale; is the job runner running? Reading from the primary")
+        return None
+    return max((primary - replica).total_seconds(), 0.0)
+
+class ReplicaMonitor:
+    """Process-local view of replica lag, re-measured every REPLICA_CHECK_SECONDS"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lags = {}
+    
+    def lag(self, key):
+        with self.lock:
+            cached = self.lags.get(key)
+        if cached and time.time() - cached[1] < app.config['REPLICA_CHECK_SECONDS']:
+            return cached[0]
+        
+        lag = measure_replica_lag(key)
+        with self.lock:
+            self.lags[key] = (lag, time.time())
+        return lag
+    
+    def healthy(self):
+        """Replicas whose lag is known and within REPLICA_MAX_LAG_SECONDS"""
+        limit = app.config['REPLICA_MAX_LAG_SECONDS']
+        lags = {key: self.lag(key) for key in replica_keys()}
+        return [key for key, lag in lags.items() if lag is not None and lag <= limit]
+
+replica_monitor = ReplicaMonitor()
+
+def choose_replica():
+    """Bind key of a replica to serve this request's reads from, or None for the primary"""
+    if not replica_keys() or request.method not in ('GET', 'HEAD'):
+        return None
+    # Read-your-writes: a user who just changed something keeps reading the primary
+    if session.get('primary_until', 0) > time.time():
+        return None
+    healthy = replica_monitor.healthy()
+    return random.choice(healthy) if healthy else None
+
+def replica_read(view):
+    """Serve a read-only view from a healthy replica when one is configured"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_replica = choose_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.after_request
+def stick_to_primary_after_write(response):
+    if replica_keys() and g.get('db_wrote'):
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+@periodic_job('replication_heartbeat', interval=timedelta(seconds=0))
+def replication_heartbeat_job(state, now):
+    # Runs on every scheduler tick, so lag is measured in JOB_TICK_SECONDS steps
+    if not replica_keys():
+        return 'no replicas'
+    return write_replication_heartbeat(now).isoformat()
+
+# Set-based fine accrual
+def fine_rate_expression():
+    """SQL expression for the daily fine rate of a loan's member (needs Member joined)"""
+    rates = app.config['FINE_PER_DAY_BY_MEMBERSHIP'] or {}
+    default = float(app.config['FINE_PER_DAY'])
+    if not rates:
+        return literal(default)
+    return case(
+        *[(Member.membership_type == membership_type, float(rate)) for membership_type, rate in rates.items()],
+        else_=default
+    )
+
+def days_overdue_expression(now):
+    """SQL expression for whole days between Loan.due_date and `now`, like timedelta.days"""
+    now_param = literal(now, db.DateTime)
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return cast(func.julianday(now_param) - func.julianday(Loan.due_date), db.Integer)
+    if dialect == 'postgresql':
+        return cast(func.floor(func.extract('epoch', now_param - Loan.due_date) / 86400), db.Integer)
+    if dialect in ('mysql', 'mariadb'):
+        return func.timestampdiff(text('DAY'), Loan.due_date, now_param)
+    raise NotImplementedError(f'Fine accrual does not support the {dialect} dialect')
+
+def accrue_overdue_fines(now=None, criteria=(), nightly=False, dry_run=False, chunk_size=None):
+    """Bring overdue loans and their fines up to date with set-based SQL.
+
+    Each chunk of loan ids is handled by three statements: refresh the amount
+    of pending overdue fines, insert fines for overdue loans that have none,
+    and flip active loans past their due date to 'overdue'. Amounts only ever
+    grow, and only rows whose value changes are written, so re-running with
+    the same `now` is a no-op. In nightly mode `now` is truncated to midnight,
+    which makes every run on the same day produce identical amounts without
+    undoing the extra day a later-in-the-day run may already have charged.
+    `criteria` narrows the loans considered; dry_run reports what would
+    change without writing.
+    """
+    now = now or datetime.utcnow()
+    if nightly:
+        now = datetime.combine(now.date(), datetime.min.time())
+    chunk_size = chunk_size or app.config['FINE_ACCRUAL_CHUNK_SIZE']
+    
+    days = days_overdue_expression(now)
+    amount = func.round(days * fine_rate_expression(), 2)
+    open_overdue = [
+        Loan.return_date == None,
+        Loan.status.in_(['active', 'overdue']),
+        Loan.due_date < now,
+        *criteria,
+    ]
+    
+    if dry_run:
+        return fine_accrual_report(now, open_overdue, days, amount)
+    
+    totals = {'as_of': now.isoformat(), 'loans_marked': 0, 'fines_created': 0, 'fines_updated': 0}
+    low, high = db.session.query(func.min(Loan.id), func.max(Loan.id)).filter(*open_overdue).one()
+    if low is None:
+        return totals
+    
+    for chunk_start in range(low, high + 1, chunk_size):
+        renew_job_lease()
+        in_chunk = Loan.id.between(chunk_start, chunk_start + chunk_size - 1)
+        
+        new_amount = select(amount).select_from(Loan).join(
+            Member, Member.id == Loan.member_id
+        ).where(Loan.id == Fine.loan_id).scalar_subquery()
+        totals['fines_updated'] += db.session.execute(
+            update(Fine).where(
+                Fine.loan_id.between(chunk_start, chunk_start + chunk_size - 1),
+                Fine.loan_id.in_(select(Loan.id).where(in_chunk, *open_overdue)),
+                Fine.status == 'pending',
+                Fine.reason == 'overdue',
+                Fine.amount < new_amount
+            ).values(amount=new_amount).execution_options(synchronize_session=False)
+        ).rowcount
+        
+        new_fines = select(
+            Loan.id, Loan.member_id, amount, literal('overdue'), literal(now, db.DateTime),
+            literal('pending'), literal(now, db.DateTime)
+        ).select_from(Loan).join(Member, Member.id == Loan.member_id).where(
+            in_chunk, *open_overdue, days >= 1, ~exists().where(Fine.loan_id == Loan.id)
+        )
+        created = db.session.execute(
+            insert(Fine).from_select(
+                ['loan_id', 'member_id', 'amount', 'reason', 'issued_date', 'status', 'created_at'],
+                new_fines
+            )
+        ).rowcount
+        totals['fines_created'] += created
+        
+        marked = db.session.execute(
+            update(Loan).where(
+                in_chunk, *open_overdue, Loan.status == 'active'
+            ).values(status='overdue').execution_options(synchronize_session=False)
+        ).rowcount
+        totals['loans_marked'] += marked
+        
+        adjust_stats(overdue_loans=marked, pending_fines=created)
+        db.session.commit()
+    
+    return totals
+
+def fine_accrual_report(now, open_overdue, days, amount):
+    """Summarize what accrue_overdue_fines() would change, without writing anything"""
+    loans_to_mark = db.session.query(func.count(Loan.id)).filter(
+        *open_overdue, Loan.status == 'active'
+    ).scalar()
+    
+    fines_to_create, new_fine_total = db.session.query(
+        func.count(Loan.id), func.coalesce(func.sum(amount), 0.0)
+    ).join(Member, Member.id == Loan.member_id).filter(
+        *open_overdue, days >= 1, ~exists().where(Fine.loan_id == Loan.id)
+    ).one()
+    
+    fines_to_update, amount_change = db.session.query(
+        func.count(Fine.id), func.coalesce(func.sum(amount - Fine.amount), 0.0)
+    ).join(Loan, Loan.id == Fine.loan_id).join(Member, Member.id == Loan.member_id).filter(
+        *open_overdue, Fine.status == 'pending', Fine.reason == 'overdue', Fine.amount < amount
+    ).one()
+    
+    return {
+        'as_of': now.isoformat(),
+        'dry_run': True,
+        'loans_to_mark': loans_to_mark,
+        'fines_to_create': fines_to_create,
+        'new_fine_total': round(new_fine_total, 2),
+        'fines_to_update': fines_to_update,
+        'amount_change': round(amount_change, 2),
+    }
+
+@periodic_job('overdue_loans', interval=timedelta(minutes=5))
+def mark_newly_overdue_loans(state, now):
+    """Process only the loans that fell due since the previous run.
+
+    The watermark is the `now` of the last successful run, so each run scans the
+    (watermark, now] slice of due dates instead of every open loan.
+    """
+    criteria = [Loan.status == 'active']
+    if state.watermark is not None:
+        criteria.append(Loan.due_date >= state.watermark)
+    
+    result = accrue_overdue_fines(now, criteria=criteria)
+    state.watermark = now
+    return result
+
+@periodic_job('fine_accrual', interval=timedelta(days=1))
+def nightly_fine_accrual(state, now):
+    """Daily pass over every open overdue loan to bring fine amounts up to date"""
+    return accrue_overdue_fines(now, nightly=True)
+
+@periodic_job('notification_counters', interval=timedelta(days=1))
+def rebuild_unread_counters_job(state, now):
+    """Correct any drift in the denormalized unread counters"""
+    return {'members': rebuild_unread_counters()}
+
+@periodic_job('library_stats', interval=timedelta(hours=1))
+def rebuild_library_stats_job(state, now):
+    """Recount the dashboard counters to correct any drift"""
+    return rebuild_library_stats()
+
+@periodic_job('notifications', interval=timedelta(minutes=1))
+def send_pending_notifications_job(state, now):
+    count = check_pending_notifications()
+    return {'notifications_sent': count}
+
+def expire_carrell_rentals(now=None, batch_size=None):
+    """End carrell rentals that ran past their scheduled end time.
+
+    Expired rentals are taken in batches off the (status, scheduled_end_time)
+    index. Each batch is one transaction of set-based statements: flip the
+    rentals to 'overdue', release their carrells and insert a key fine for
+    every rental that was flipped. Only 'active' rentals are flipped, so a
+    rental ended by staff meanwhile is left alone and none is fined twice.
+    The fine records its rental, so it is waived if the key comes back.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or app.config['CARRELL_SWEEP_BATCH_SIZE']
+    totals = {'rentals_expired': 0, 'carrells_released': 0, 'fines_created': 0}
+    
+    while True:
+        renew_job_lease()
+        rental_ids = [rental_id for (rental_id,) in db.session.query(CarrellRental.id).filter(
+            CarrellRental.status == 'active',
+            CarrellRental.scheduled_end_time <= now
+        ).order_by(CarrellRental.scheduled_end_time).limit(batch_size)]
+        if not rental_ids:
+            break
+        
+        expired = db.session.execute(
+            update(CarrellRental).where(
+                CarrellRental.id.in_(rental_ids), CarrellRental.status == 'active'
+            ).values(status='overdue').execution_options(synchronize_session=False)
+        ).rowcount
+        
+        released = db.session.execute(
+            update(Carrell).where(
+                Carrell.current_rental_id.in_(rental_ids)
+            ).values(is_available=True, current_rental_id=None).execution_options(synchronize_session=False)
+        ).rowcount
+        
+        key_fines = select(
+            CarrellRental.id, CarrellRental.member_id, literal(app.config['CARRELL_KEY_FINE']),
+            literal('key_not_returned'), literal(now, db.DateTime), literal('pending'), literal(now, db.DateTime)
+        ).where(CarrellRental.id.in_(rental_ids), CarrellRental.status == 'overdue')
+        created = db.session.execute(
+            insert(Fine).from_select(
+                ['rental_id', 'member_id', 'amount', 'reason', 'issued_date', 'status', 'created_at'], key_fines
+            )
+        ).rowcount
+        
+        adjust_stats(pending_fines=created)
+        if released:
+            invalidate_tags('available_carrells')
+        db.session.commit()
+        
+        totals['rentals_expired'] += expired
+        totals['carrells_released'] += released
+        totals['fines_created'] += created
+    
+    return totals
+
+@periodic_job('carrell_expiry', interval=timedelta(minutes=1))
+def expire_carrell_rentals_job(state, now):
+    return expire_carrell_rentals(now)
+
+# Primary key allocation
+# Generated ID formats, keyed by sequence name: (prefix, digits, model)
+ID_FORMATS = {
+    'member': ('M', 6, Member),
+    'book': ('B', 6, Book),
+    'carrell': ('C', 4, Carrell),
+}
+
+def reserve_id_block(name, size):
+    """Reserve `size` consecutive values of a sequence and return the first.
+
+    Runs in its own short transaction on a separate connection, so a block
+    stays reserved even if the caller rolls back and never collides with a
+    block handed to another process. Call it before the caller's transaction
+    has written anything (SQLite allows a single writer). A missing sequence
+    is seeded once from the highest ID already in the table.
+    """
+    sequences = IdSequence.__table__
+    for attempt in range(5):
+        try:
+            with db.engine.begin() as conn:
+                reserved = conn.execute(
+                    sequences.update().where(sequences.c.name == name)
+                    .values(next_value=sequences.c.next_value + size)
+                ).rowcount
+                if reserved:
+                    return conn.execute(
+                        select(sequences.c.next_value).where(sequences.c.name == name)
+                    ).scalar() - size
+                
+                prefix, digits, model = ID_FORMATS[name]
+                start = 1 + max((int(row[0][len(prefix):]) for row in conn.execute(select(model.id))
+                                 if row[0].startswith(prefix) and row[0][len(prefix):].isdigit()), default=0)
+                conn.execute(sequences.insert().values(name=name, next_value=start + size))
+                return start
+        
+        except (IntegrityError, OperationalError):
+            # Another process seeded the sequence or held the lock: try again
+            time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+    
+    raise RuntimeError(f'Could not reserve IDs for sequence "{name}"')
+
+class IdAllocator:
+    """Hands out IDs from blocks reserved in the id_sequence table.
+
+    Each process keeps its current block in memory, so most IDs cost no
+    database round trip; a forked worker discards the parent's blocks.
+    Unused values of a block are skipped when the process exits.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+        self.pid = os.getpid()
+    
+    def next_value(self, name):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.blocks, self.pid = {}, os.getpid()
+            
+            value, end = self.blocks.get(name, (0, 0))
+            if value >= end:
+                size = app.config['ID_BLOCK_SIZE']
+                value = reserve_id_block(name, size)
+                end = value + size
+            self.blocks[name] = (value + 1, end)
+            return value
+
+id_allocator = IdAllocator()
+
+def format_id(name, value):
+    """Format a sequence value as a primary key, e.g. 123 -> M000123"""
+    prefix, digits, model = ID_FORMATS[name]
+    return f'{prefix}{value:0{digits}d}'
+
+def next_id(name):
+    """Return the next formatted primary key for a sequence"""
+    return format_id(name, id_allocator.next_value(name))
+
+def get_loan_period(member):
+    """Get loan period based on membership type"""
+    if member.membership_type == 'premium':
+        return 28  # 4 weeks
+    return 14  # 2 weeks
+
+def checkout_book(member_id, book_id, due_date=None):
+    """Lend one copy of a book to a member in a single race-free transaction.
+
+    The copy is taken with a conditional UPDATE (available_copies > 0), so two
+    concurrent borrowers can never both get the last copy. The member row is
+    then locked (FOR UPDATE where supported; SQLite already holds the write
+    lock) and the loan limit and fines are checked inside the same
+    transaction. Lock contention is retried with jittered backoff.
+
+    Returns (loan, None) on success or (None, reason) where reason is one of
+    'book_not_found', 'member_not_found', 'unavailable', 'limit', 'fines' or
+    'busy'.
+    """
+    retries = app.config['BORROW_MAX_RETRIES']
+    for attempt in range(retries):
+        try:
+            taken = db.session.execute(
+                update(Book).where(Book.id == book_id, Book.available_copies > 0)
+                .values(available_copies=Book.available_copies - 1)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not taken:
+                db.session.rollback()
+                if db.session.get(Book, book_id) is None:
+                    return None, 'book_not_found'
+                return None, 'unavailable'
+            
+            member = Member.query.filter_by(id=member_id).with_for_update().first()
+            if member is None:
+                db.session.rollback()
+                return None, 'member_not_found'
+            
+            # Check member's current loans
+            if member.current_loans_count >= member.max_books:
+                db.session.rollback()
+                return None, 'limit'
+            
+            # Check if member has pending fines
+            if member.total_fines_due > 0:
+                db.session.rollback()
+                return None, 'fines'
+            
+            if due_date is None:
+                due_date = datetime.utcnow() + timedelta(days=get_loan_period(member))
+            
+            loan = Loan(book_id=book_id, member_id=member_id, due_date=due_date)
+            db.session.add(loan)
+            adjust_stats(active_loans=1)
+            db.session.commit()
+            return loan, None
+        
+        except OperationalError:
+            # Lock timeout, deadlock or serialization failure: back off and retry
+            db.session.rollback()
+            backoff = app.config['BORROW_RETRY_BACKOFF_SECONDS'] * (2 ** attempt)
+            time.sleep(random.uniform(0, backoff))
+    
+    return None, 'busy'
+
+def booking_week(day=None):
+    """Return the Monday-Friday dates of the week containing `day` (default today)"""
+    day = day or datetime.utcnow().date()
+    monday = day - timedelta(days=day.weekday())
+    return [monday + timedelta(days=offset) for offset in range(5)]
+
+def carrell_slot_times(day):
+    """Return the start times of the bookable slots on a day"""
+    opens = datetime.combine(day, datetime.min.time()) + timedelta(hours=app.config['CARRELL_OPEN_HOUR'])
+    slot = timedelta(minutes=app.config['CARRELL_SLOT_MINUTES'])
+    count = (app.config['CARRELL_CLOSE_HOUR'] - app.config['CARRELL_OPEN_HOUR']) * 60 // app.config['CARRELL_SLOT_MINUTES']
+    return [opens + slot * index for index in range(count)]
+
+def carrell_busy_intervals(start, end, carrell_id=None):
+    """Query (carrell_id, start, end) of bookings and active rentals overlapping [start, end).
+
+    Rows come back sorted by carrell and start time. Two intervals overlap when
+    each starts before the other ends, which the (carrell_id, start_time,
+    end_time) index answers as a range scan.
+    """
+    bookings = select(
+        CarrellBooking.carrell_id.label('carrell_id'),
+        CarrellBooking.start_time.label('start_time'),
+        CarrellBooking.end_time.label('end_time')
+    ).where(
+        CarrellBooking.status == 'booked',
+        CarrellBooking.start_time < end,
+        CarrellBooking.end_time > start
+    )
+    rentals = select(
+        CarrellRental.carrell_id,
+        CarrellRental.rental_date,
+        CarrellRental.scheduled_end_time
+    ).where(
+        CarrellRental.status == 'active',
+        CarrellRental.rental_date < end,
+        CarrellRental.scheduled_end_time > start
+    )
+    if carrell_id is not None:
+        bookings = bookings.where(CarrellBooking.carrell_id == carrell_id)
+        rentals = rentals.where(CarrellRental.carrell_id == carrell_id)
+
+    intervals = bookings.union_all(rentals).subquery()
+    return db.session.execute(
+        select(intervals).order_by(intervals.c.carrell_id, intervals.c.start_time)
+    ).all()
+
+def carrell_is_free(carrell_id, start, end, exclude_booking_id=None, member_id=None):
+    """True if no booking or active rental of the carrell overlaps [start, end).
+
+    `exclude_booking_id` skips the booking being checked; `member_id` skips that
+    member's own bookings, so a walk-in rental can take up a reservation.
+    """
+    bookings = CarrellBooking.query.filter(
+        CarrellBooking.carrell_id == carrell_id,
+        CarrellBooking.status == 'booked',
+        CarrellBooking.start_time < end,
+        CarrellBooking.end_time > start
+    )
+    if exclude_booking_id is not None:
+        bookings = bookings.filter(CarrellBooking.id != exclude_booking_id)
+    if member_id is not None:
+        bookings = bookings.filter(CarrellBooking.member_id != member_id)
+    rentals = CarrellRental.query.filter(
+        CarrellRental.carrell_id == carrell_id,
+        CarrellRental.status == 'active',
+        CarrellRental.rental_date < end,
+        CarrellRental.scheduled_end_time > start
+    )
+    return not db.session.query(or_(bookings.exists(), rentals.exists())).scalar()
+
+def carrell_availability(day=None, now=None):
+    """Compute the free-slot grid of every carrell for the booking week of `day`.
+
+    All overlapping intervals for the week are fetched in one query sorted by
+    carrell, then walked once, clearing the slots each interval covers. Slots
+    that have already started are not free either.
+
+    Returns (days, grid) where grid maps carrell id to one list per day of
+    booleans, True where the slot can be booked.
+    """
+    now = now or datetime.utcnow()
+    days = booking_week(day)
+    slot_minutes = app.config['CARRELL_SLOT_MINUTES']
+    day_slots = [carrell_slot_times(weekday) for weekday in days]
+    slots_per_day = len(day_slots[0])
+
+    slot_seconds = slot_minutes * 60
+    open_week = [[slot >= now for slot in slots] for slots in day_slots]
+    grid = {carrell_id: [list(row) for row in open_week]
+            for (carrell_id,) in db.session.query(Carrell.id).order_by(Carrell.id)}
+
+    week_start = day_slots[0][0]
+    week_end = day_slots[-1][-1] + timedelta(seconds=slot_seconds)
+    intervals = carrell_busy_intervals(week_start, week_end)
+    for carrell_id, rows in itertools.groupby(intervals, key=lambda row: row.carrell_id):
+        week = grid.get(carrell_id)
+        if week is None:
+            continue
+        for _, start, end in rows:
+            # Only the days the interval touches, usually just one
+            first_day = max(0, (start.date() - days[0]).days)
+            last_day = min(len(days) - 1, (end.date() - days[0]).days)
+            for index in range(first_day, last_day + 1):
+                opens = day_slots[index][0]
+                first = max(0, math.floor((start - opens).total_seconds() / slot_seconds))
+                last = min(slots_per_day, math.ceil((end - opens).total_seconds() / slot_seconds))
+                if last > first:
+                    week[index][first:last] = [False] * (last - first)
+    return days, grid
+
+def validate_booking_time(start_time, hours, now=None):
+    """Return an error message if a booking slot breaks the booking rules, else None"""
+    now = now or datetime.utcnow()
+    if hours not in app.config['CARRELL_BOOKING_HOURS']:
+        return 'Invalid booking duration'
+    if start_time.date() not in booking_week(now.date()):
+        return 'Bookings are limited to the current week (Monday-Friday)'
+    if start_time not in carrell_slot_times(start_time.date()):
+        return 'Bookings must start on a slot boundary'
+    if start_time < now:
+        return 'That slot has already started'
+    closes = datetime.combine(start_time.date(), datetime.min.time()) + timedelta(hours=app.config['CARRELL_CLOSE_HOUR'])
+    if start_time + timedelta(hours=hours) > closes:
+        return f"Bookings must end by {app.config['CARRELL_CLOSE_HOUR']}:00"
+    return None
+
+def book_carrell(member_id, carrell_id, start_time, hours):
+    """Reserve a carrell for a member in a single race-free transaction.
+
+    The booking row is written first, which takes the SQLite write lock; the
+    carrell and member rows are then locked FOR UPDATE on other databases.
+    Conflicts and the member's daily limit are checked afterwards inside the
+    same transaction, so concurrent bookings can neither overlap nor exceed
+    the limit. Lock contention is retried with jittered backoff.
+
+    Returns (booking, None) on success or (None, reason) where reason is one of
+    'carrell_not_found', 'member_not_found', 'fines', 'conflict', 'limit' or
+    'busy'.
+    """
+    end_time = start_time + timedelta(hours=hours)
+    day_start = datetime.combine(start_time.date(), datetime.min.time())
+    retries = app.config['BORROW_MAX_RETRIES']
+    for attempt in range(retries):
+        try:
+            booking = CarrellBooking(carrell_id=carrell_id, member_id=member_id,
+                                     start_time=start_time, end_time=end_time)
+            db.session.add(booking)
+            db.session.flush()
+
+            if Carrell.query.filter_by(id=carrell_id).with_for_update().first() is None:
+                db.session.rollback()
+                return None, 'carrell_not_found'
+            member = Member.query.filter_by(id=member_id).with_for_update().first()
+            if member is None:
+                db.session.rollback()
+                return None, 'member_not_found'
+
+            if member.total_fines_due > 0:
+                db.session.rollback()
+                return None, 'fines'
+
+            if not carrell_is_free(carrell_id, start_time, end_time, exclude_booking_id=booking.id):
+                db.session.rollback()
+                return None, 'conflict'
+
+            # Counts the new booking too
+            booked_today = db.session.query(func.count(CarrellBooking.id)).filter(
+                CarrellBooking.member_id == member_id,
+                CarrellBooking.status == 'booked',
+                CarrellBooking.start_time >= day_start,
+                CarrellBooking.start_time < day_start + timedelta(days=1)
+            ).scalar()
+            if booked_today > app.config['CARRELL_DAILY_LIMIT']:
+                db.session.rollback()
+                return None, 'limit'
+
+            db.session.commit()
+            return booking, None
+
+        except OperationalError:
+            db.session.rollback()
+            backoff = app.config['BORROW_RETRY_BACKOFF_SECONDS'] * (2 ** attempt)
+            time.sleep(random.uniform(0, backoff))
+
+    return None, 'busy'
+
+def load_member_stats(members, chunk_size=500):
+    """Preload loan and fine statistics for a list of members.
+
+    Active-loan counts, overdue counts and outstanding fine totals are computed
+    with one grouped query per chunk of members and attached to each instance,
+    so current_loans_count, total_fines_due and overdue_loans_count no longer
+    query the database per member.
+    """
+    members = list(members)
+    now = datetime.utcnow()
+    
+    for start in range(0, len(members), chunk_size):
+        chunk = members[start:start + chunk_size]
+        member_ids = [member.id for member in chunk]
+        
+        loan_stats = db.session.query(
+            Loan.member_id.label('member_id'),
+            func.count(Loan.id).label('current_loans'),
+            func.sum(case((Loan.due_date < now, 1), else_=0)).label('overdue_loans')
+        ).filter(
+            Loan.member_id.in_(member_ids),
+            Loan.return_date == None
+        ).group_by(Loan.member_id).subquery()
+        
+        fine_stats = db.session.query(
+            Fine.member_id.label('member_id'),
+            func.sum(Fine.amount).label('fines_due')
+        ).filter(
+            Fine.member_id.in_(member_ids),
+            Fine.paid_date == None
+        ).group_by(Fine.member_id).subquery()
+        
+        rows = db.session.query(
+            Member.id,
+            func.coalesce(loan_stats.c.current_loans, 0),
+            func.coalesce(loan_stats.c.overdue_loans, 0),
+            func.coalesce(fine_stats.c.fines_due, 0.0)
+        ).outerjoin(
+            loan_stats, loan_stats.c.member_id == Member.id
+        ).outerjoin(
+            fine_stats, fine_stats.c.member_id == Member.id
+        ).filter(Member.id.in_(member_ids)).all()
+        
+        stats_by_id = {
+            member_id: {
+                'current_loans': current_loans,
+                'overdue_loans': overdue_loans,
+                'fines_due': fines_due,
+            }
+            for member_id, current_loans, overdue_loans, fines_due in rows
+        }
+        for member in chunk:
+            member._stats = stats_by_id.get(
+                member.id, {'current_loans': 0, 'overdue_loans': 0, 'fines_due': 0.0}
+            )
+    
+    return members
+
+# Category hierarchy
+def category_path(category_id, parent_path=None):
+    """Materialized path of a category under a parent with `parent_path` (None for a root)"""
+    return f"{parent_path or '/'}{category_id}/"
+
+def category_paths(parents):
+    """Paths for every category of {id: parent_id}.
+
+    A parent chain that loops or points at a missing category is cut there,
+    making the category where it was cut a root.
+    """
+    paths = {}
+    for category_id in parents:
+        chain = []
+        current = category_id
+        while current not in paths:
+            chain.append(current)
+            parent_id = parents[current]
+            if parent_id is None or parent_id not in parents or parent_id in chain:
+                paths[current] = category_path(current)
+                chain.pop()
+                break
+            current = parent_id
+        for child_id in reversed(chain):
+            paths[child_id] = category_path(child_id, paths[parents[child_id]])
+    return paths
+
+def category_subtree_ids(category_id):
+    """Select of the ids of a category and all its descendants, answered by the path index.
+
+    The root's path is looked up by a scalar subquery, so filtering on the
+    subtree stays a single statement. Paths end in '/', whose successor is
+    '0', which bounds the range the same way prefix_range() does. An unknown
+    category selects nothing.
+    """
+    root = aliased(Category)
+    path = select(root.path).where(root.id == category_id).scalar_subquery()
+    successor = func.substr(path, 1, func.length(path) - 1) + literal('0')
+    return select(Category.id).where(Category.path >= path, Category.path < successor)
+
+def move_category(category, parent_id):
+    """Re-parent a category and its subtree in the current transaction.
+
+    Returns an error message instead if the move would make the category its
+    own ancestor. The category and the new parent's ancestors are locked
+    first, so two concurrent moves cannot close a cycle between them.
+    """
+    parent = None
+    if parent_id is not None:
+        parent = db.session.get(Category, parent_id)
+        if parent is None:
+            return 'Parent category not found'
+        locked = [category.id] + parent.ancestor_ids
+        db.session.query(Category).filter(Category.id.in_(locked)).with_for_update().populate_existing().all()
+        if category.id in parent.ancestor_ids:
+            return 'A category cannot be moved under itself or one of its subcategories'
+    
+    old_path = category.path
+    new_path = category_path(category.id, parent.path if parent else None)
+    category.parent_id = parent_id
+    if old_path != new_path:
+        # Rewrite the prefix of every path in the subtree, the category's own included
+        db.session.execute(
+            update(Category).where(prefix_range(Category.path, old_path))
+            .values(path=literal(new_path).concat(func.substr(Category.path, len(old_path) + 1)))
+            .execution_options(synchronize_session='fetch')
+        )
+    return None
+
+def category_tree():
+    """Every category with its children and book counts, from two queries.
+
+    Returns (categories, children, book_counts): children maps a category id
+    (None for the top level) to its child categories, and book_counts maps it
+    to (books filed directly under it, books in its whole subtree).
+    """
+    categories = Category.query.order_by(Category.id).all()
+    direct = dict(db.session.query(Book.category_id, func.count(Book.id)).group_by(Book.category_id))
+    
+    children = {None: []}
+    totals = {}
+    for category in categories:
+        children[category.id] = []
+        totals[category.id] = 0
+    for category in categories:
+        children[category.parent_id if category.parent_id in children else None].append(category)
+        for ancestor_id in category.ancestor_ids:
+            if ancestor_id in totals:
+                totals[ancestor_id] += direct.get(category.id, 0)
+    
+    book_counts = {category.id: (direct.get(category.id, 0), totals[category.id]) for category in categories}
+    return categories, children, book_counts
+
+def existing_index_names(connection):
+    """Names of the indexes present in the database.
+
+    SQLite reflection skips expression indexes, so they are read from
+    sqlite_master there instead.
+    """
+    if connection.dialect.name == 'sqlite':
+        return {name for (name,) in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    inspector = inspect(connection)
+    return {index['name'] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+
+def ensure_indexes(connection=None, names=None):
+    """Create declared indexes that are missing from an existing database, optionally only `names`"""
+    if connection is None:
+        with db.engine.begin() as connection:
+            return ensure_indexes(connection, names)
+    
+    existing = existing_index_names(connection)
+    created = []
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name in existing or (names is not None and index.name not in names):
+                continue
+            index.create(bind=connection)
+            created.append(index.name)
+    return created
+
+# Schema migrations
+# Registered migrations, keyed by version: {'name': str, 'func': callable(connection)}
+MIGRATIONS = {}
+
+def migration(version, name):
+    """Register a function as the schema migration with the given version"""
+    def decorator(func):
+        MIGRATIONS[version] = {'name': name, 'func': func}
+        return func
+    return decorator
+
+def applied_migrations():
+    """Map the version of every applied migration to when it was applied"""
+    return dict(db.session.query(SchemaMigration.version, SchemaMigration.applied_at))
+
+def run_migrations():
+    """Apply pending migrations in version order. Returns the versions applied.
+
+    Each migration and its bookkeeping row commit in one transaction. When
+    several processes start at once, the losers of the race for a version hit
+    the primary key and roll back.
+    """
+    done = applied_migrations()
+    db.session.commit()
+    applied = []
+    for version in sorted(MIGRATIONS):
+        if version in done:
+            continue
+        entry = MIGRATIONS[version]
+        try:
+            with db.engine.begin() as connection:
+                entry['func'](connection)
+                connection.execute(insert(SchemaMigration).values(
+                    version=version, name=entry['name'], applied_at=datetime.utcnow()
+                ))
+            applied.append(version)
+        except IntegrityError:
+            continue
+    return applied
+
+@migration(1, 'fine_loan_id_nullable')
+def allow_fines_without_loan(connection):
+    """Drop the NOT NULL constraint on fine.loan_id in databases created before carrell fines.
+
+    MySQL restates the column with MODIFY; SQLite cannot alter a column in
+    place, so the table is rebuilt from the current model and its rows copied
+    across.
+    """
+    inspector = inspect(connection)
+    existing = inspector.get_columns('fine')
+    if next(column for column in existing if column['name'] == 'loan_id')['nullable']:
+        return
+    
+    if connection.dialect.name in ('mysql', 'mariadb'):
+        connection.execute(text('ALTER TABLE fine MODIFY loan_id INTEGER NULL'))
+        return
+    if connection.dialect.name != 'sqlite':
+        connection.execute(text('ALTER TABLE fine ALTER COLUMN loan_id DROP NOT NULL'))
+        return
+    
+    indexes = [index['name'] for index in inspector.get_indexes('fine')]
+    columns = ', '.join(column['name'] for column in existing)
+    connection.execute(text('ALTER TABLE fine RENAME TO fine_old'))
+    for name in indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    Fine.__table__.create(bind=connection)
+    connection.execute(text(f'INSERT INTO fine ({columns}) SELECT {columns} FROM fine_old'))
+    connection.execute(text('DROP TABLE fine_old'))
+
+@migration(2, 'hot_path_indexes')
+def create_hot_path_indexes(connection):
+    """Create the composite indexes behind the hot loan, fine, notification, rental and member filters"""
+    names = {
+        'ix_loan_member_return', 'ix_loan_status_due', 'ix_loan_book_member_return',
+        'ix_fine_member_paid', 'ix_fine_loan_id', 'ix_fine_status_issued',
+        'ix_notification_member_read', 'ix_notification_sent_scheduled',
+        'ix_carrell_rental_member_status', 'ix_member_user_id',
+    }
+    ensure_indexes(connection, names)
+    # Refresh planner statistics so the new indexes are costed correctly
+    connection.execute(text('ANALYZE'))
+
+@migration(3, 'category_paths')
+def add_category_paths(connection):
+    """Add the materialized category.path, fill it from parent_id and index it"""
+    columns = {column['name'] for column in inspect(connection).get_columns('category')}
+    if 'path' not in columns:
+        connection.execute(text('ALTER TABLE category ADD COLUMN path VARCHAR(255)'))
+    
+    parents = dict(connection.execute(select(Category.id, Category.parent_id)).all())
+    paths = category_paths(parents)
+    if paths:
+        # Chains that looped or pointed at a missing parent were cut into new roots
+        connection.execute(
+            update(Category).where(Category.id == bindparam('category_id'))
+            .values(path=bindparam('new_path'), parent_id=bindparam('new_parent_id')),
+            [{'category_id': id, 'new_path': path,
+              'new_parent_id': parents[id] if path.count('/') > 2 else None} for id, path in paths.items()]
+        )
+    ensure_indexes(connection, {'ix_category_path', 'ix_book_category_title'})
+
+@migration(4, 'notification_claims')
+def add_notification_claim_columns(connection):
+    """Add the claim token, lease and attempt count the notification dispatcher claims rows with"""
+    columns = {column['name'] for column in inspect(connection).get_columns('notification')}
+    if 'claim_token' not in columns:
+        connection.execute(text('ALTER TABLE notification ADD COLUMN claim_token VARCHAR(32)'))
+    if 'claimed_until' not in columns:
+        connection.execute(text(f"ALTER TABLE notification ADD COLUMN claimed_until "
+                                f"{db.DateTime().compile(dialect=connection.dialect)}"))
+    if 'attempts' not in columns:
+        connection.execute(text('ALTER TABLE notification ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0'))
+
+@migration(5, 'fine_rental_id')
+def add_fine_rental_id(connection):
+    """Link carrell key fines to their rental, so a returned key can waive its fine"""
+    columns = {column['name'] for column in inspect(connection).get_columns('fine')}
+    if 'rental_id' not in columns:
+        connection.execute(text('ALTER TABLE fine ADD COLUMN rental_id INTEGER REFERENCES carrell_rental (id)'))
+    ensure_indexes(connection, {'ix_fine_rental_id'})
+
+@migration(6, 'unique_loan_fines')
+def make_loan_fines_unique(connection):
+    """Allow one fine of each reason per loan, replacing the plain loan_id index.
+
+    Runners that overlapped before leases were renewed mid-job could each
+    insert an overdue fine for the same loan. Of each such group the fine that
+    was paid (else the largest) is kept and the pending extras are deleted.
+    """
+    rows = connection.execute(
+        select(Fine.id, Fine.loan_id, Fine.reason, Fine.status).where(
+            tuple_(Fine.loan_id, Fine.reason).in_(
+                select(Fine.loan_id, Fine.reason).where(Fine.loan_id != None)
+                .group_by(Fine.loan_id, Fine.reason).having(func.count(Fine.id) > 1)
+            )
+        ).order_by(Fine.loan_id, Fine.reason, (Fine.status == 'paid').desc(), Fine.amount.desc(), Fine.id)
+    ).all()
+    extras = [row for _, group in itertools.groupby(rows, key=lambda row: (row.loan_id, row.reason))
+              for row in list(group)[1:]]
+    if extras:
+        connection.execute(delete(Fine).where(Fine.id.in_([row.id for row in extras])))
+        pending = sum(1 for row in extras if row.status == 'pending')
+        connection.execute(update(LibraryStat).where(LibraryStat.name == 'pending_fines')
+                           .values(value=LibraryStat.value - pending))
+    
+    if 'ix_fine_loan_id' in existing_index_names(connection):
+        on_table = ' ON fine' if connection.dialect.name in ('mysql', 'mariadb') else ''
+        connection.execute(text(f'DROP INDEX ix_fine_loan_id{on_table}'))
+    ensure_indexes(connection, {'ux_fine_loan_reason'})
+
+# Hot query predicates that must be answered from an index, keyed by name: callable(now) -> Select
+HOT_QUERIES = {
+    'member_open_loans': lambda now: select(func.count(Loan.id)).where(
+        Loan.member_id == 'M000001', Loan.return_date == None),
+    'newly_overdue_loans': lambda now: select(Loan.id).where(
+        Loan.status == 'active', Loan.due_date < now),
+    'member_open_loan_of_book': lambda now: select(Loan.id).where(
+        Loan.book_id == 'B000001', Loan.member_id == 'M000001', Loan.return_date == None),
+    'member_fines_due': lambda now: select(func.sum(Fine.amount)).where(
+        Fine.member_id == 'M000001', Fine.paid_date == None),
+    'loan_fine': lambda now: select(Fine.id).where(Fine.loan_id == 1),
+    'rental_key_fine': lambda now: select(Fine.id).where(Fine.rental_id == 1),
+    'pending_fines': lambda now: select(Fine.id).where(
+        Fine.status == 'pending', Fine.issued_date >= now - timedelta(days=30)),
+    'unread_notifications': lambda now: select(func.count(Notification.id)).where(
+        Notification.member_id == 'M000001', Notification.is_read == False),
+    'due_notifications': lambda now: select(Notification.id).where(
+        *claimable_notifications(now)
+    ).order_by(Notification.scheduled_time),
+    'member_active_carrell_rental': lambda now: select(CarrellRental.id).where(
+        CarrellRental.member_id == 'M000001', CarrellRental.status == 'active'),
+    'expired_carrell_rentals': lambda now: select(CarrellRental.id).where(
+        CarrellRental.status == 'active', CarrellRental.scheduled_end_time <= now
+    ).order_by(CarrellRental.scheduled_end_time),
+    'carrell_booking_conflicts': lambda now: select(CarrellBooking.id).where(
+        CarrellBooking.carrell_id == 'C0001', CarrellBooking.status == 'booked',
+        CarrellBooking.start_time < now + timedelta(hours=2), CarrellBooking.end_time > now),
+    'member_by_user': lambda now: select(Member.id).where(Member.user_id == 1),
+    'books_in_category_subtree': lambda now: select(Book.id).where(
+        Book.category_id.in_(category_subtree_ids(1))),
+}
+
+def explain_query(statement):
+    """Return the plan lines of a statement, with sequential scans disabled on PostgreSQL.
+
+    With seq scans off, PostgreSQL only plans one when no index can answer
+    the query, so small test tables don't hide a missing index.
+    """
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            return [row.detail for row in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SET LOCAL enable_seqscan = off'))
+        return [row[0] for row in connection.execute(text(f'EXPLAIN {sql}'))]
+
+def is_full_scan(line):
+    """True if a plan line reads a whole table rather than an index"""
+    if line.startswith('SCAN '):
+        return 'INDEX' not in line
+    return 'Seq Scan' in line or 'Full scan' in line
+
+def check_hot_queries(now=None):
+    """Explain every hot query. Returns {name: (uses_index, plan_lines)}"""
+    now = now or datetime.utcnow()
+    results = {}
+    for name, build in HOT_QUERIES.items():
+        plan = explain_query(build(now))
+        results[name] = (not any(is_full_scan(line) for line in plan), plan)
+    return results
+
+def encode_cursor(book):
+    """Encode a book's (title, id) sort key as an opaque URL-safe cursor"""
+    raw = json.dumps([book.title, book.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor back into a (title, id) tuple, or None if invalid"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        title, book_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(title), str(book_id)
+    except (ValueError, TypeError):
+        return None
+
+def get_page_size(value):
+    """Clamp a requested page size to the configured limits"""
+    try:
+        per_page = int(value)
+    except (TypeError, ValueError):
+        return app.config['BOOKS_PER_PAGE']
+    return max(1, min(per_page, app.config['MAX_PAGE_SIZE']))
+
+def build_book_query(search_query='', category_filter='', author_filter=''):
+    """Build the filtered catalog query shared by the HTML and JSON views"""
+    query = Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category))
+    
+    if search_query:
+        match = get_search_backend().match_clause(search_query)
+        if match is not None:
+            query = query.filter(match)
+    
+    if category_filter:
+        # A category also lists the books of its subcategories
+        query = query.filter(Book.category_id.in_(category_subtree_ids(category_filter)))
+    
+    if author_filter:
+        query = query.filter(Book.author_id == author_filter)
+    
+    return query
+
+def paginate_books(query, after=None, before=None, per_page=None):
+    """Seek-paginate a book query on (title, id).
+
+    Only per_page + 1 rows are read per request, so the cost of a page does not
+    grow with the size of the catalog. Returns the page of books together with
+    the cursors for the neighbouring pages (None when there is no such page).
+    """
+    per_page = per_page or app.config['BOOKS_PER_PAGE']
+    sort_key = tuple_(Book.title, Book.id)
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before)
+    
+    if before_key and not after_key:
+        # Walk backwards from the cursor, then restore ascending order
+        rows = query.filter(sort_key < before_key).order_by(
+            Book.title.desc(), Book.id.desc()
+        ).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        page = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after_key:
+            query = query.filter(sort_key > after_key)
+        rows = query.order_by(Book.title, Book.id).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        page = rows[:per_page]
+        has_prev = after_key is not None
+    
+    return {
+        'books': page,
+        'per_page': per_page,
+        'next_cursor': encode_cursor(page[-1]) if page and has_next else None,
+        'prev_cursor': encode_cursor(page[0]) if page and has_prev else None,
+    }
+
+def paginate_members(after=None, before=None, per_page=None):
+    """Seek-paginate members on their id, the cursor being the id itself.
+
+    Like paginate_books, a page reads per_page + 1 rows through the primary
+    key, whatever the number of members.
+    """
+    per_page = per_page or app.config['BOOKS_PER_PAGE']
+    query = Member.query
+
+    if before and not after:
+        rows = query.filter(Member.id < before).order_by(Member.id.desc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        page = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after:
+            query = query.filter(Member.id > after)
+        rows = query.order_by(Member.id).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        page = rows[:per_page]
+        has_prev = bool(after)
+
+    return {
+        'members': page,
+        'per_page': per_page,
+        'next_cursor': page[-1].id if page and has_next else None,
+        'prev_cursor': page[0].id if page and has_prev else None,
+    }
+
+def book_to_dict(book):
+    """Serialize a book for the JSON catalog API"""
+    return {
+        'id': book.id,
+        'isbn': book.isbn,
+        'title': book.title,
+        'edition': book.edition,
+        'publication_year': book.publication_year,
+        'language': book.language,
+        'author': book.author.name if book.author else None,
+        'publisher': book.publisher.name if book.publisher else None,
+        'category': book.category.name if book.category else None,
+        'total_copies': book.total_copies,
+        'available_copies': book.available_copies,
+        'availability_status': book.availability_status,
+        'location': book.location,
+    }
+
+def render_book_catalog(form, search_query='', category_filter='', author_filter='',
+                        after=None, before=None, per_page=None):
+    """Render one page of the book catalog with the given add-book form"""
+    return render_template('books.html', **book_catalog_context(
+        form, search_query, category_filter, author_filter, after=after, before=before, per_page=per_page
+    ))
+
+def book_catalog_context(form, search_query='', category_filter='', author_filter='',
+                         after=None, before=None, per_page=None):
+    """Template context of one page of the book catalog"""
+    query = build_book_query(search_query, category_filter, author_filter)
+    pagination = paginate_books(query, after=after, before=before, per_page=per_page)
+    authors, publishers, categories = choice_cache.get_many(['authors', 'publishers', 'categories'])
+    
+    form.author_id.choices = authors
+    form.publisher_id.choices = publishers
+    form.category_id.choices = categories
+    
+    return dict(title='Books', books=pagination['books'],
+                pagination=pagination,
+                categories=categories, authors=authors, publishers=publishers, form=form,
+                search_query=search_query, category_filter=category_filter,
+                author_filter=author_filter, current_year=datetime.now().year)
+
+
+# Full-text catalog search
+def search_terms(search_query):
+    """Split free text into lowercase word tokens safe to embed in a search query"""
+    return re.findall(r'\w+', search_query.lower())
+
+def book_document(book):
+    """Flatten a book and its reference data into the fields that are searched"""
+    return {
+        'book_id': book.id,
+        'title': book.title or '',
+        'description': book.description or '',
+        'isbn': book.isbn or '',
+        'author': book.author.name if book.author else '',
+        'publisher': book.publisher.name if book.publisher else '',
+        'category': book.category.name if book.category else '',
+    }
+
+class SearchBackend:
+    """Base class for catalog search backends.
+
+    Index writes go through db.session so they commit or roll back together
+    with the book change that triggered them.
+    """
+    name = 'base'
+    
+    def setup(self):
+        """Create any tables the backend needs"""
+    
+    def is_empty(self):
+        return False
+    
+    def clear(self):
+        """Drop every indexed document"""
+    
+    def index_books(self, books):
+        """Add or replace the documents for the given books"""
+    
+    def remove_book(self, book_id):
+        """Remove a book's document from the index"""
+    
+    def match_clause(self, search_query):
+        """Return a filter for Book queries, or None to leave the query unfiltered"""
+        raise NotImplementedError
+    
+    def search(self, search_query, limit):
+        """Return up to limit (book_id, score) pairs, best match first"""
+        raise NotImplementedError
+
+class LikeSearchBackend(SearchBackend):
+    """Fallback for databases without a full-text engine: unindexed substring match"""
+    name = 'like'
+    
+    def match_clause(self, search_query):
+        pattern = f'%{search_query}%'
+        return or_(Book.title.ilike(pattern), Book.isbn.ilike(pattern))
+    
+    def search(self, search_query, limit):
+        rows = db.session.query(Book.id).filter(self.match_clause(search_query)).order_by(
+            Book.title, Book.id
+        ).limit(limit).all()
+        return [(row.id, 0.0) for row in rows]
+
+class Fts5SearchBackend(SearchBackend):
+    """SQLite FTS5 index with BM25 ranking and prefix indexes for typeahead.
+
+    FTS5 keys documents by integer rowid while book ids are strings, so
+    book_fts_docid maps each book to the rowid of its document.
+    """
+    name = 'fts5'
+    # bm25() weights for title, description, isbn, author, publisher, category
+    weights = (10.0, 1.0, 5.0, 4.0, 2.0, 2.0)
+    
+    def setup(self):
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5("
+            "title, description, isbn, author, publisher, category, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS book_fts_docid ("
+            "docid INTEGER PRIMARY KEY, book_id VARCHAR(10) NOT NULL UNIQUE)"
+        ))
+        db.session.commit()
+    
+    def is_empty(self):
+        return db.session.execute(text("SELECT 1 FROM book_fts_docid LIMIT 1")).first() is None
+    
+    def clear(self):
+        db.session.execute(text("DELETE FROM book_fts"))
+        db.session.execute(text("DELETE FROM book_fts_docid"))
+    
+    def _docids(self, book_ids):
+        rows = db.session.execute(
+            text("SELECT book_id, docid FROM book_fts_docid WHERE book_id IN :book_ids")
+            .bindparams(bindparam('book_ids', expanding=True)),
+            {'book_ids': list(book_ids)}
+        )
+        return {row.book_id: row.docid for row in rows}
+    
+    def index_books(self, books):
+        documents = [book_document(book) for book in books]
+        if not documents:
+            return
+        book_ids = [doc['book_id'] for doc in documents]
+        
+        existing = self._docids(book_ids)
+        if existing:
+            db.session.execute(
+                text("DELETE FROM book_fts WHERE rowid = :docid"),
+                [{'docid': docid} for docid in existing.values()]
+            )
+        missing = [book_id for book_id in book_ids if book_id not in existing]
+        if missing:
+            db.session.execute(
+                text("INSERT INTO book_fts_docid (book_id) VALUES (:book_id)"),
+                [{'book_id': book_id} for book_id in missing]
+            )
+            existing.update(self._docids(missing))
+        
+        db.session.execute(
+            text("INSERT INTO book_fts (rowid, title, description, isbn, author, publisher, category) "
+                 "VALUES (:docid, :title, :description, :isbn, :author, :publisher, :category)"),
+            [dict(doc, docid=existing[doc['book_id']]) for doc in documents]
+        )
+    
+    def remove_book(self, book_id):
+        docid = self._docids([book_id]).get(book_id)
+        if docid is not None:
+            db.session.execute(text("DELETE FROM book_fts WHERE rowid = :docid"), {'docid': docid})
+            db.session.execute(text("DELETE FROM book_fts_docid WHERE docid = :docid"), {'docid': docid})
+    
+    def fts_query(self, search_query):
+        # Every term must match; the trailing * turns each one into a prefix query
+        return ' '.join(f'"{term}"*' for term in search_terms(search_query))
+    
+    def match_clause(self, search_query):
+        fts_query = self.fts_query(search_query)
+        if not fts_query:
+            return None
+        return text(
+            "book.id IN (SELECT book_fts_docid.book_id FROM book_fts "
+            "JOIN book_fts_docid ON book_fts_docid.docid = book_fts.rowid "
+            "WHERE book_fts MATCH :fts_query)"
+        ).bindparams(fts_query=fts_query)
+    
+    def search(self, search_query, limit):
+        fts_query = self.fts_query(search_query)
+        if not fts_query:
+            return []
+        weights = ', '.join(str(weight) for weight in self.weights)
+        rows = db.session.execute(text(
+            f"SELECT book_fts_docid.book_id, bm25(book_fts, {weights}) AS score FROM book_fts "
+            "JOIN book_fts_docid ON book_fts_docid.docid = book_fts.rowid "
+            "WHERE book_fts MATCH :fts_query ORDER BY score LIMIT :limit"
+        ), {'fts_query': fts_query, 'limit': limit})
+        # bm25() is lower-is-better; flip the sign so higher scores rank first
+        return [(row.book_id, -row.score) for row in rows]
+
+class PostgresSearchBackend(SearchBackend):
+    """PostgreSQL tsvector index with a GIN index and ts_rank ordering"""
+    name = 'postgresql'
+    
+    def setup(self):
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS book_search ("
+            "book_id VARCHAR(10) PRIMARY KEY REFERENCES book (id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_book_search_document ON book_search USING GIN (document)"
+        ))
+        db.session.commit()
+    
+    def is_empty(self):
+        return db.session.execute(text("SELECT 1 FROM book_search LIMIT 1")).first() is None
+    
+    def clear(self):
+        db.session.execute(text("DELETE FROM book_search"))
+    
+    def index_books(self, books):
+        documents = [book_document(book) for book in books]
+        if not documents:
+            return
+        db.session.execute(text(
+            "INSERT INTO book_search (book_id, document) VALUES (:book_id, "
+            "setweight(to_tsvector('simple', :title), 'A') || "
+            "setweight(to_tsvector('simple', :isbn || ' ' || :author), 'B') || "
+            "setweight(to_tsvector('simple', :publisher || ' ' || :category), 'C') || "
+            "setweight(to_tsvector('simple', :description), 'D')) "
+            "ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document"
+        ), documents)
+    
+    def remove_book(self, book_id):
+        db.session.execute(text("DELETE FROM book_search WHERE book_id = :book_id"), {'book_id': book_id})
+    
+    def ts_query(self, search_query):
+        return ' & '.join(f'{term}:*' for term in search_terms(search_query))
+    
+    def match_clause(self, search_query):
+        ts_query = self.ts_query(search_query)
+        if not ts_query:
+            return None
+        return text(
+            "book.id IN (SELECT book_id FROM book_search "
+            "WHERE document @@ to_tsquery('simple', :ts_query))"
+        ).bindparams(ts_query=ts_query)
+    
+    def search(self, search_query, limit):
+        ts_query = self.ts_query(search_query)
+        if not ts_query:
+            return []
+        rows = db.session.execute(text(
+            "SELECT book_id, ts_rank(document, to_tsquery('simple', :ts_query)) AS score "
+            "FROM book_search WHERE document @@ to_tsquery('simple', :ts_query) "
+            "ORDER BY score DESC LIMIT :limit"
+        ), {'ts_query': ts_query, 'limit': limit})
+        return [(row.book_id, row.score) for row in rows]
+
+# Backends keyed by SQLAlchemy dialect name; SEARCH_BACKEND can name one explicitly
+SEARCH_BACKENDS = {
+    'sqlite': Fts5SearchBackend,
+    'postgresql': PostgresSearchBackend,
+    'like': LikeSearchBackend,
+}
+_search_backend = None
+
+def get_search_backend():
+    """Return the configured search backend, creating its tables on first use"""
+    global _search_backend
+    if _search_backend is None:
+        key = app.config.get('SEARCH_BACKEND') or db.engine.dialect.name
+        backend = SEARCH_BACKENDS.get(key, LikeSearchBackend)()
+        try:
+            backend.setup()
+        except OperationalError as e:
+            # e.g. a SQLite build compiled without FTS5
+            db.session.rollback()
+            print(f"Search backend '{backend.name}' unavailable, falling back to LIKE: {str(e)}")
+            backend = LikeSearchBackend()
+        _search_backend = backend
+    return _search_backend
+
+def index_book(book):
+    """Add or refresh a single book in the search index"""
+    # Reload reference data in case the foreign keys were just changed
+    db.session.expire(book, ['author', 'publisher', 'category'])
+    get_search_backend().index_books([book])
+
+def reindex_books(*criteria):
+    """Refresh the indexed documents of every book matching the criteria"""
+    query = Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category))
+    get_search_backend().index_books(query.filter(*criteria).all())
+
+def rebuild_search_index(batch_size=1000):
+    """Rebuild the whole search index, streaming the catalog in batches"""
+    backend = get_search_backend()
+    backend.clear()
+    query = Book.query.options(
+        joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category)
+    ).order_by(Book.id)
+    
+    indexed = 0
+    batch = []
+    for book in query.yield_per(batch_size):
+        batch.append(book)
+        if len(batch) >= batch_size:
+            backend.index_books(batch)
+            indexed += len(batch)
+            batch = []
+    backend.index_books(batch)
+    indexed += len(batch)
+    db.session.commit()
+    return indexed
+
+def init_search_index():
+    """Build the search index on first start if the catalog is not indexed yet"""
+    backend = get_search_backend()
+    if backend.is_empty() and db.session.query(Book.id).first() is not None:
+        count = rebuild_search_index()
+        print(f"Indexed {count} books for search ({backend.name})")
+
+# Typeahead lookups
+def prefix_range(column, prefix):
+    """Index-friendly form of `column LIKE 'prefix%'`: prefix <= column < successor of prefix"""
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+def get_lookup_limit(value):
+    try:
+        limit = int(value or app.config['LOOKUP_RESULT_LIMIT'])
+    except ValueError:
+        limit = app.config['LOOKUP_RESULT_LIMIT']
+    return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+def lookup_members(search_query, limit, active_only=False):
+    """Members whose ID, first or last name or email starts with the query.
+
+    "jane do" matches first name "jane*" and last name "do*". Every branch is
+    a range scan on an index, so cost depends on the matches, not the
+    membership size.
+    """
+    terms = search_query.lower().split()
+    if not terms:
+        return []
+    if len(terms) > 1:
+        match = and_(prefix_range(func.lower(Member.first_name), terms[0]),
+                     prefix_range(func.lower(Member.last_name), terms[-1]))
+    else:
+        match = or_(
+            prefix_range(Member.id, terms[0].upper()),
+            prefix_range(func.lower(Member.first_name), terms[0]),
+            prefix_range(func.lower(Member.last_name), terms[0]),
+            prefix_range(func.lower(Member.email), terms[0]),
+        )
+    
+    query = db.session.query(
+        Member.id, Member.first_name, Member.last_name, Member.email, Member.membership_status
+    ).filter(match)
+    if active_only:
+        query = query.filter(Member.membership_status == 'active')
+    
+    return [{
+        'id': row.id,
+        'name': f"{row.first_name} {row.last_name}",
+        'email': row.email,
+        'membership_status': row.membership_status,
+        'label': f"{row.id} - {row.first_name} {row.last_name} ({row.email})",
+    } for row in query.order_by(Member.last_name, Member.first_name, Member.id).limit(limit)]
+
+def lookup_books(search_query, limit, available_only=False):
+    """Books matching an ID or ISBN prefix, then ranked title search.
+
+    A query that looks like an ID or ISBN is matched on those prefixes first;
+    title hits fill the remaining suggestions, so titles such as "1984" are
+    still found.
+    """
+    compact = re.sub(r'[\s-]', '', search_query).upper()
+    if not compact:
+        return []
+    
+    query = db.session.query(Book.id, Book.title, Book.isbn, Book.available_copies)
+    if available_only:
+        query = query.filter(Book.available_copies > 0)
+    
+    rows = []
+    if re.fullmatch(r'B\d+|\d[\dX]+', compact):
+        rows = query.filter(or_(prefix_range(Book.id, compact), prefix_range(Book.isbn, compact))).order_by(
+            Book.id
+        ).limit(limit).all()
+    
+    if len(rows) < limit:
+        # Over-fetch when unavailable titles or prefix matches will be dropped from the ranked hits
+        fetch = limit * 4 if available_only else limit + len(rows)
+        seen = {row.id for row in rows}
+        hits = [book_id for book_id, _ in get_search_backend().search(search_query, fetch) if book_id not in seen]
+        rows_by_id = {row.id: row for row in query.filter(Book.id.in_(hits))} if hits else {}
+        rows += [rows_by_id[book_id] for book_id in hits if book_id in rows_by_id][:limit - len(rows)]
+    
+    return [{
+        'id': row.id,
+        'title': row.title,
+        'isbn': row.isbn,
+        'available_copies': row.available_copies,
+        'label': f"{row.id} - {row.title} ({row.isbn})",
+    } for row in rows]
+
+# Bulk catalog import
+# Alternative column names accepted in import files
+CATALOG_FIELD_ALIASES = {
+    'author_name': 'author',
+    'publisher_name': 'publisher',
+    'category_name': 'category',
+    'year': 'publication_year',
+    'copies': 'total_copies',
+    'shelf': 'location',
+}
+
+# MARC (tag, subfield) -> import field; the first occurrence wins
+MARC_FIELDS = {
+    ('020', 'a'): 'isbn',
+    ('041', 'a'): 'language',
+    ('100', 'a'): 'author',
+    ('110', 'a'): 'author',
+    ('245', 'a'): 'title',
+    ('250', 'a'): 'edition',
+    ('260', 'b'): 'publisher',
+    ('260', 'c'): 'publication_year',
+    ('264', 'b'): 'publisher',
+    ('264', 'c'): 'publication_year',
+    ('300', 'a'): 'pages',
+    ('520', 'a'): 'description',
+    ('650', 'a'): 'category',
+    ('852', 'h'): 'location',
+}
+
+def read_csv_records(stream):
+    """Yield one dict per CSV row, using the header line as field names"""
+    yield from csv.DictReader(stream)
+
+def read_jsonl_records(stream):
+    """Yield one dict per non-blank JSON Lines record"""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {'_error': 'invalid JSON record'}
+
+def read_marc_records(stream):
+    """Yield one dict per record of a MARC mnemonic (.mrk) text file.
+
+    Each field is a line such as `=245  10$aTitle /$cAuthor`; records are
+    separated by blank lines.
+    """
+    record = {}
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            if record:
+                yield record
+            record = {}
+            continue
+        if not line.startswith('=') or len(line) < 6:
+            continue
+        tag = line[1:4]
+        for subfield in line[6:].split('$')[1:]:
+            field = MARC_FIELDS.get((tag, subfield[:1]))
+            if field and field not in record:
+                record[field] = subfield[1:].strip(' /:;,=')
+    if record:
+        yield record
+
+CATALOG_READERS = {
+    'csv': read_csv_records,
+    'jsonl': read_jsonl_records,
+    'marc': read_marc_records,
+}
+
+CATALOG_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.mrk': 'marc'}
+
+def catalog_format(path):
+    """Guess the import format from the file extension"""
+    fmt = CATALOG_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f'Cannot tell the format of "{path}"; use one of: {", ".join(CATALOG_READERS)}')
+    return fmt
+
+def parse_number(value, pattern=r'\d+'):
+    """First run of digits in a value such as "c2001." or "320 p.", or None"""
+    match = re.search(pattern, str(value or ''))
+    return int(match.group()) if match else None
+
+def normalize_catalog_record(record):
+    """Map an import record onto Book columns. Returns (row, error)."""
+    if '_error' in record:
+        return None, record['_error']
+    
+    fields = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        value = value.strip() if isinstance(value, str) else value
+        if value not in (None, ''):
+            fields[CATALOG_FIELD_ALIASES.get(key, key)] = value
+    
+    isbn = re.sub(r'[^0-9X]', '', str(fields.get('isbn', '')).split(' ')[0].upper())
+    for name, value in (('isbn', isbn), ('title', fields.get('title')), ('author', fields.get('author')),
+                        ('publisher', fields.get('publisher')), ('category', fields.get('category'))):
+        if not value:
+            return None, f'missing {name}'
+    
+    copies = max(parse_number(fields.get('total_copies')) or 1, 1)
+    return {
+        'isbn': isbn[:20],
+        'title': str(fields['title'])[:300],
+        'edition': str(fields['edition'])[:50] if 'edition' in fields else None,
+        'publication_year': parse_number(fields.get('publication_year'), r'\d{4}'),
+        'pages': parse_number(fields.get('pages')),
+        'language': str(fields.get('language', 'English'))[:50],
+        'description': fields.get('description'),
+        'location': str(fields['location'])[:100] if 'location' in fields else None,
+        'total_copies': copies,
+        'available_copies': copies,
+        'author': str(fields['author'])[:200],
+        'publisher': str(fields['publisher'])[:200],
+        'category': str(fields['category'])[:100],
+    }, None
+
+class CatalogLookup:
+    """In-memory name -> id cache of authors, publishers and categories.
+
+    Names are matched case-insensitively; unknown names are inserted in the
+    current transaction and cached.
+    """
+    
+    def __init__(self):
+        self.ids = {}
+        self.created = {Author: 0, Publisher: 0, Category: 0}
+        for model in self.created:
+            self.ids[model] = {name.strip().lower(): id for id, name in db.session.query(model.id, model.name)}
+    
+    def resolve(self, model, name):
+        key = name.strip().lower()
+        if key not in self.ids[model]:
+            result = db.session.execute(insert(model).values(name=name.strip()))
+            self.ids[model][key] = result.inserted_primary_key[0]
+            self.created[model] += 1
+            if model is Category:
+                # Imported categories start at the top level
+                category_id = self.ids[model][key]
+                db.session.execute(update(Category).where(Category.id == category_id)
+                                   .values(path=category_path(category_id)))
+        return self.ids[model][key]
+
+def import_catalog_batch(records, lookup, checkpoint):
+    """Insert one batch of import records and advance the checkpoint in the same commit.
+
+    Returns (imported, errors).
+    """
+    rows, errors, seen = [], [], set()
+    for record in records:
+        row, error = normalize_catalog_record(record)
+        if error:
+            errors.append(error)
+        elif row['isbn'] in seen:
+            errors.append(f"duplicate ISBN {row['isbn']}")
+        else:
+            seen.add(row['isbn'])
+            rows.append(row)
+    
+    existing = {isbn for (isbn,) in db.session.query(Book.isbn).filter(Book.isbn.in_(seen))} if seen else set()
+    rows = [row for row in rows if row['isbn'] not in existing]
+    errors.extend(f'ISBN {isbn} already in catalog' for isbn in existing)
+    
+    if rows:
+        # Reserve the IDs before this transaction writes anything
+        first_id = reserve_id_block('book', len(rows))
+        created_before = dict(lookup.created)
+        for offset, row in enumerate(rows):
+            row['id'] = format_id('book', first_id + offset)
+            row['author_id'] = lookup.resolve(Author, row.pop('author'))
+            row['publisher_id'] = lookup.resolve(Publisher, row.pop('publisher'))
+            row['category_id'] = lookup.resolve(Category, row.pop('category'))
+        
+        db.session.execute(insert(Book), rows)
+        reindex_books(Book.id.in_([row['id'] for row in rows]))
+        adjust_stats(
+            total_books=len(rows),
+            total_authors=lookup.created[Author] - created_before[Author],
+            total_publishers=lookup.created[Publisher] - created_before[Publisher],
+        )
+        invalidate_tags('authors', 'publishers', 'categories')
+        invalidate_tags('books')
+    
+    checkpoint.rows_done += len(records)
+    checkpoint.imported += len(rows)
+    checkpoint.skipped += len(records) - len(rows)
+    checkpoint.updated_at = datetime.utcnow()
+    db.session.commit()
+    return len(rows), errors
+
+def import_catalog(path, fmt=None, batch_size=None, restart=False, max_errors=20):
+    """Stream a catalog file into the database in batches.
+
+    Records are read incrementally, so file size does not matter. Progress is
+    checkpointed with every batch; running the same file again resumes after
+    the last committed batch unless `restart` is set or it already completed.
+    Returns a summary with counts and throughput.
+    """
+    reader = CATALOG_READERS[fmt or catalog_format(path)]
+    batch_size = batch_size or app.config['CATALOG_IMPORT_BATCH_SIZE']
+    source = os.path.abspath(path)
+    
+    checkpoint = db.session.get(ImportCheckpoint, source)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=source)
+        db.session.add(checkpoint)
+    if restart or checkpoint.completed_at or checkpoint.rows_done is None:
+        checkpoint.rows_done = checkpoint.imported = checkpoint.skipped = 0
+        checkpoint.completed_at = None
+    db.session.commit()
+    resumed_from = checkpoint.rows_done
+    
+    lookup = CatalogLookup()
+    started = time.time()
+    rows_read = imported = errors_shown = 0
+    with open(path, newline='', encoding='utf-8-sig') as stream:
+        records = itertools.islice(reader(stream), resumed_from, None)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            
+            batch_imported, errors = import_catalog_batch(batch, lookup, checkpoint)
+            rows_read += len(batch)
+            imported += batch_imported
+            for error in errors[:max(max_errors - errors_shown, 0)]:
+                print(f"  skipped: {error}")
+            errors_shown += len(errors)
+            
+            elapsed = time.time() - started
+            print(f"{resumed_from + rows_read} rows, {checkpoint.imported} imported, "
+                  f"{checkpoint.skipped} skipped, {rows_read / elapsed if elapsed else 0:.0f} rows/s")
+    
+    checkpoint.completed_at = datetime.utcnow()
+    db.session.commit()
+    
+    elapsed = time.time() - started
+    return {
+        'resumed_from': resumed_from,
+        'rows_read': rows_read,
+        'imported': imported,
+        'skipped': rows_read - imported,
+        'authors_created': lookup.created[Author],
+        'publishers_created': lookup.created[Publisher],
+        'categories_created': lookup.created[Category],
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(rows_read / elapsed) if elapsed else 0,
+    }
+
+# Streaming exports
+def books_export_query():
+    return db.session.query(
+        Book.id, Book.isbn, Book.title, Author.name.label('author'), Publisher.name.label('publisher'),
+        Category.name.label('category'), Book.edition, Book.publication_year, Book.pages, Book.language,
+        Book.description, Book.total_copies, Book.available_copies, Book.location, Book.created_at
+    ).join(Author, Book.author_id == Author.id).join(
+        Publisher, Book.publisher_id == Publisher.id
+    ).join(Category, Book.category_id == Category.id).order_by(Book.id)
+
+def members_export_query():
+    return db.session.query(
+        Member.id, Member.first_name, Member.last_name, Member.email, Member.phone, Member.address,
+        Member.membership_type, Member.membership_status, Member.max_books, Member.created_at
+    ).order_by(Member.id)
+
+def loans_export_query():
+    return db.session.query(
+        Loan.id, Loan.book_id, Book.title, Loan.member_id, Loan.loan_date, Loan.due_date,
+        Loan.return_date, Loan.status, Loan.renewed_count
+    ).join(Book, Loan.book_id == Book.id).order_by(Loan.id)
+
+def fines_export_query():
+    return db.session.query(
+        Fine.id, Fine.loan_id, Fine.member_id, Fine.amount, Fine.reason, Fine.status,
+        Fine.issued_date, Fine.paid_date
+    ).order_by(Fine.id)
+
+# Export name -> (query factory, column filtered by the date range or None)
+EXPORTS = {
+    'books': (books_export_query, None),
+    'members': (members_export_query, None),
+    'loans': (loans_export_query, Loan.loan_date),
+    'fines': (fines_export_query, Fine.issued_date),
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+def export_rows(name, start=None, end=None):
+    """Yield the column names, then every row of an export with start <= date < end.
+
+    Rows are fetched yield_per batches at a time (a server-side cursor where
+    the driver supports one), so memory use does not grow with the table.
+    """
+    query_factory, date_column = EXPORTS[name]
+    query = query_factory()
+    if start:
+        query = query.filter(date_column >= start)
+    if end:
+        query = query.filter(date_column < end)
+    
+    yield [column['name'] for column in query.column_descriptions]
+    yield from query.yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def export_value(value):
+    """JSON/CSV friendly form of a column value"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def export_chunks(name, fmt='csv', start=None, end=None, compress=False):
+    """Encode an export as a stream of byte chunks, optionally gzip compressed"""
+    chunk_rows = app.config['EXPORT_BATCH_SIZE']
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    
+    def flush():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+    
+    rows = export_rows(name, start, end)
+    header = next(rows)
+    if writer:
+        writer.writerow(header)
+    
+    for count, row in enumerate(rows, 1):
+        values = [export_value(value) for value in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(header, values))) + '\n')
+        
+        if count % chunk_rows == 0:
+            chunk = flush()
+            if chunk:
+                yield chunk
+    
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def export_filename(name, fmt, start=None, end=None, compress=False):
+    """Download file name, e.g. loans_2024-01-01_2024-02-01.csv.gz"""
+    parts = [name] + [d.strftime('%Y-%m-%d') for d in (start, end) if d]
+    return '_'.join(parts) + f'.{fmt}' + ('.gz' if compress else '')
+
+# PDF reports
+def overdue_report_rows(start, end, now):
+    query = db.session.query(
+        Loan.id, Loan.member_id, Member.first_name, Member.last_name, Book.title, Loan.due_date, Fine.amount
+    ).join(Member, Loan.member_id == Member.id).join(Book, Loan.book_id == Book.id).outerjoin(
+        Fine, and_(Fine.loan_id == Loan.id, Fine.status == 'pending')
+    ).filter(Loan.return_date == None, Loan.due_date < now).order_by(Loan.due_date, Loan.id)
+    for row in query.yield_per(app.config['EXPORT_BATCH_SIZE']):
+        yield [row.id, row.member_id, f'{row.first_name} {row.last_name}', row.title,
+               row.due_date.strftime('%Y-%m-%d'), (now - row.due_date).days, f'${row.amount or 0:.2f}']
+
+def overdue_report_summary(start, end, now):
+    count, oldest = db.session.query(func.count(Loan.id), func.min(Loan.due_date)).filter(
+        Loan.return_date == None, Loan.due_date < now
+    ).one()
+    fines = db.session.query(func.sum(Fine.amount)).join(Loan, Fine.loan_id == Loan.id).filter(
+        Loan.return_date == None, Loan.due_date < now, Fine.status == 'pending'
+    ).scalar() or 0
+    return [('Overdue loans', count), ('Oldest due date', oldest.strftime('%Y-%m-%d') if oldest else '-'),
+            ('Accrued fines', f'${fines:.2f}')]
+
+def fines_report_rows(start, end, now):
+    query = db.session.query(
+        Fine.id, Fine.member_id, Member.first_name, Member.last_name, Fine.reason, Fine.issued_date, Fine.amount
+    ).join(Member, Fine.member_id == Member.id).filter(Fine.status == 'pending').order_by(Fine.member_id, Fine.id)
+    for row in query.yield_per(app.config['EXPORT_BATCH_SIZE']):
+        yield [row.id, row.member_id, f'{row.first_name} {row.last_name}', row.reason,
+               row.issued_date.strftime('%Y-%m-%d'), f'${row.amount:.2f}']
+
+def fines_report_summary(start, end, now):
+    count, members, total = db.session.query(
+        func.count(Fine.id), func.count(func.distinct(Fine.member_id)), func.sum(Fine.amount)
+    ).filter(Fine.status == 'pending').one()
+    return [('Outstanding fines', count), ('Members owing', members), ('Total outstanding', f'${total or 0:.2f}')]
+
+def carrell_report_rows(start, end, now):
+    query = db.session.query(
+        CarrellRental.id, Carrell.name, CarrellRental.member_id, CarrellRental.rental_date,
+        CarrellRental.scheduled_end_time, CarrellRental.actual_end_time, CarrellRental.status, CarrellRental.key_returned
+    ).join(Carrell, CarrellRental.carrell_id == Carrell.id).filter(
+        CarrellRental.rental_date >= start, CarrellRental.rental_date < end
+    ).order_by(CarrellRental.rental_date, CarrellRental.id)
+    for row in query.yield_per(app.config['EXPORT_BATCH_SIZE']):
+        ended = row.actual_end_time or row.scheduled_end_time
+        yield [row.id, row.name, row.member_id, row.rental_date.strftime('%Y-%m-%d %H:%M'),
+               f'{(ended - row.rental_date).total_seconds() / 3600:.1f}', row.status,
+               'Yes' if row.key_returned else 'No']
+
+def carrell_report_summary(start, end, now):
+    rentals, members, keys_out = db.session.query(
+        func.count(CarrellRental.id), func.count(func.distinct(CarrellRental.member_id)),
+        func.sum(case((CarrellRental.key_returned == False, 1), else_=0))
+    ).filter(CarrellRental.rental_date >= start, CarrellRental.rental_date < end).one()
+    return [('Rentals', rentals), ('Members', members), ('Keys not returned', keys_out or 0)]
+
+def circulation_report_rows(start, end, now):
+    query = db.session.query(
+        Loan.id, Loan.loan_date, Loan.member_id, Book.title, Loan.due_date, Loan.return_date, Loan.status
+    ).join(Book, Loan.book_id == Book.id).filter(
+        Loan.loan_date >= start, Loan.loan_date < end
+    ).order_by(Loan.loan_date, Loan.id)
+    for row in query.yield_per(app.config['EXPORT_BATCH_SIZE']):
+        yield [row.id, row.loan_date.strftime('%Y-%m-%d'), row.member_id, row.title,
+               row.due_date.strftime('%Y-%m-%d'),
+               row.return_date.strftime('%Y-%m-%d') if row.return_date else '-', row.status]
+
+def circulation_report_summary(start, end, now):
+    issued, returned, members = db.session.query(
+        func.count(Loan.id), func.count(Loan.return_date), func.count(func.distinct(Loan.member_id))
+    ).filter(Loan.loan_date >= start, Loan.loan_date < end).one()
+    return [('Loans issued', issued), ('Returned', returned), ('Still out', issued - returned),
+            ('Borrowers', members)]
+
+# Report name -> definition. Dated reports cover [start, end); the others are snapshots.
+REPORTS = {
+    'overdue': {
+        'title': 'Overdue Loans',
+        'dated': False,
+        'columns': ['Loan', 'Member', 'Name', 'Title', 'Due', 'Days', 'Fine'],
+        'widths': [0.7, 1.0, 2.0, 3.4, 1.0, 0.6, 0.8],
+        'rows': overdue_report_rows,
+        'summary': overdue_report_summary,
+    },
+    'fines': {
+        'title': 'Outstanding Fines',
+        'dated': False,
+        'columns': ['Fine', 'Member', 'Name', 'Reason', 'Issued', 'Amount'],
+        'widths': [0.8, 1.0, 2.4, 3.0, 1.2, 1.0],
+        'rows': fines_report_rows,
+        'summary': fines_report_summary,
+    },
+    'carrells': {
+        'title': 'Carrell Usage',
+        'dated': True,
+        'columns': ['Rental', 'Carrell', 'Member', 'Started', 'Hours', 'Status', 'Key returned'],
+        'widths': [0.8, 2.2, 1.0, 1.6, 0.8, 1.2, 1.2],
+        'rows': carrell_report_rows,
+        'summary': carrell_report_summary,
+    },
+    'circulation': {
+        'title': 'Circulation',
+        'dated': True,
+        'columns': ['Loan', 'Date', 'Member', 'Title', 'Due', 'Returned', 'Status'],
+        'widths': [0.7, 1.0, 1.0, 3.6, 1.0, 1.0, 0.9],
+        'rows': circulation_report_rows,
+        'summary': circulation_report_summary,
+    },
+}
+
+class FlowableStream(list):
+    """Flowable list for doc.build() that is refilled from a generator as it drains.
+
+    ReportLab consumes flowables from the front of the list until len() is 0,
+    so only the flowable being laid out (and any pieces split from it) is in
+    memory, however many rows the report has.
+    """
+    
+    def __init__(self, flowables):
+        super().__init__()
+        self.source = iter(flowables)
+    
+    def __len__(self):
+        if not super().__len__():
+            self.extend(itertools.islice(self.source, 1))
+        return super().__len__()
+
+def report_table(columns, rows, widths):
+    table = Table([columns] + rows, colWidths=[width * inch for width in widths], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#343a40')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f2f2f2')]),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+    return table
+
+def report_flowables(report, start, end, now):
+    """Yield the title, summary and one table per REPORT_CHUNK_ROWS rows"""
+    styles = getSampleStyleSheet()
+    yield Paragraph(report['title'], styles['Title'])
+    if report['dated']:
+        period = f"{start:%Y-%m-%d} to {end - timedelta(days=1):%Y-%m-%d}"
+    else:
+        period = f"As of {now:%Y-%m-%d %H:%M} UTC"
+    yield Paragraph(period, styles['Normal'])
+    yield Spacer(1, 0.15 * inch)
+    
+    summary = Table([[label, str(value)] for label, value in report['summary'](start, end, now)],
+                    colWidths=[2 * inch, 1.5 * inch], hAlign='LEFT')
+    summary.setStyle(TableStyle([('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'), ('FONTSIZE', (0, 0), (-1, -1), 9)]))
+    yield summary
+    yield Spacer(1, 0.25 * inch)
+    
+    chunk_rows = app.config['REPORT_CHUNK_ROWS']
+    # Cells are clipped to roughly fit their column at 8pt
+    limits = [max(int(width * 16), 4) for width in report['widths']]
+    chunk, total = [], 0
+    for row in report['rows'](start, end, now):
+        chunk.append([str(value)[:limit] for value, limit in zip(row, limits)])
+        if len(chunk) >= chunk_rows:
+            yield report_table(report['columns'], chunk, report['widths'])
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        yield report_table(report['columns'], chunk, report['widths'])
+        total += len(chunk)
+    if not total:
+        yield Paragraph('No records.', styles['Normal'])
+
+def report_page_footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, 0.5 * inch, f"Page {doc.page}")
+    canvas.restoreState()
+
+def render_report(name, params, path):
+    """Render a report to path; written to a temporary file and renamed into place"""
+    report = REPORTS[name]
+    now = datetime.utcnow()
+    start = datetime.strptime(params['start'], '%Y-%m-%d') if params.get('start') else None
+    end = datetime.strptime(params['end'], '%Y-%m-%d') + timedelta(days=1) if params.get('end') else None
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
     try:
-        # In a real system, you would:
-        # 1. Send email
-        # 2. Send SMS
-        # 3. Send push notification
-        
-        # For now, we'll just mark it as sent and print to console
-        notification.sent_time = datetime.utcnow()
-        db.session.commit()
-        
-        print(f"Notification sent to {notification.member.full_name}: {notification.title}")
-        return True
-        
-    except Exception as e:
-        print(f"Error sending notification: {str(e)}")
-        return False
+        doc = SimpleDocTemplate(temp_path, pagesize=landscape(letter), title=report['title'],
+                                leftMargin=0.5 * inch, rightMargin=0.5 * inch)
+        doc.build(FlowableStream(report_flowables(report, start, end, now)),
+                  onFirstPage=report_page_footer, onLaterPages=report_page_footer)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-def check_pending_notifications():
-    """Check and send pending notifications (to be called periodically)"""
+def report_params(name, args):
+    """Validated cache parameters for a report request; dated reports default to the last REPORT_DEFAULT_DAYS days"""
+    if not REPORTS[name]['dated']:
+        return {}
+    today = datetime.utcnow().date()
+    end = datetime.strptime(args['end'], '%Y-%m-%d').date() if args.get('end') else today
+    start = datetime.strptime(args['start'], '%Y-%m-%d').date() if args.get('start') else \
+        end - timedelta(days=app.config['REPORT_DEFAULT_DAYS'] - 1)
+    if start > end:
+        raise ValueError('The start date must not be after the end date')
+    return {'start': start.isoformat(), 'end': end.isoformat()}
+
+def report_cache_path(name, params):
+    key = hashlib.sha1(json.dumps([name, params], sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(app.config['REPORT_CACHE_DIR'], f'{name}-{key}.pdf')
+
+def report_is_fresh(path):
     try:
-        now = datetime.utcnow()
-        pending_notifications = Notification.query.filter(
-            Notification.scheduled_time <= now,
-            Notification.sent_time == None
-        ).all()
-        
-        for notification in pending_notifications:
-            send_notification(notification)
+        return time.time() - os.path.getmtime(path) < app.config['REPORT_CACHE_SECONDS']
+    except OSError:
+        return False
+
+class ReportRenderer:
+    """Renders reports on a small worker pool, at most one job per cached file"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.executor = None
+    
+    def request(self, name, params):
+        """Return ('ready', path), ('pending', None) or ('failed', message), starting a render if needed"""
+        path = report_cache_path(name, params)
+        with self.lock:
+            job = self.jobs.get(path)
+            if job is not None and job.done():
+                del self.jobs[path]
+                if job.exception() is not None:
+                    return 'failed', str(job.exception())
+                job = None
+            if report_is_fresh(path):
+                return 'ready', path
             
-        return len(pending_notifications)
-        
-    except Exception as e:
-        print(f"Error checking pending notifications: {str(e)}")
-        return 0
+            if job is None:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=app.config['REPORT_WORKERS'],
+                                                       thread_name_prefix='report')
+                self.jobs[path] = self.executor.submit(self.render, name, params, path)
+        return 'pending', None
+    
+    def render(self, name, params, path):
+        with app.app_context():
+            render_report(name, params, path)
 
-def update_overdue_loans():
-    """Update status of overdue loans and create fines"""
-    overdue_loans = Loan.query.filter(
-        Loan.return_date == None,
-        Loan.due_date < datetime.utcnow(),
-        Loan.status == 'active'
-    ).all()
-    
-    for loan in overdue_loans:
-        loan.status = 'overdue'
-        
-        # Check if fine already exists
-        existing_fine = Fine.query.filter_by(loan_id=loan.id).first()
-        if not existing_fine:
-            fine_amount = calculate_fine(loan)
-            if fine_amount > 0:
-                new_fine = Fine(
-                    loan_id=loan.id,
-                    member_id=loan.member_id,
-                    amount=fine_amount,
-                    reason='overdue'
-                )
-                db.session.add(new_fine)
-    
-    db.session.commit()
+report_renderer = ReportRenderer()
 
-def get_loan_period(member):
-    """Get loan period based on membership type"""
-    if member.membership_type == 'premium':
-        return 28  # 4 weeks
-    return 14  # 2 weeks
+search_cli = AppGroup('search', help='Catalog search index commands.')
+
+@search_cli.command('rebuild')
+def rebuild_search_index_command():
+    """Rebuild the catalog search index from scratch"""
+    started = time.time()
+    count = rebuild_search_index()
+    print(f"Indexed {count} books in {time.time() - started:.2f}s ({get_search_backend().name})")
+
+app.cli.add_command(search_cli)
 
 # Routes
 @app.route('/')
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    update_overdue_loans()
-    
     # Add this line to get current datetime
     current_time = datetime.utcnow()
     
@@ -567,6 +3903,8 @@ def dashboard():
         ).filter_by(user_id=current_user.id).first()
         
         if member:
+            load_member_stats([member])
+            
             # Use pre-calculated fields instead of properties
             active_loans = [loan for loan in member.loans if loan.return_date is None]
             recent_loans = sorted(member.loans, key=lambda x: x.loan_date, reverse=True)[:5]
@@ -584,18 +3922,8 @@ def dashboard():
             return redirect(url_for('profile'))
     
     elif current_user.role == 'librarian':
-        # Optimized queries with single aggregate calls
-        total_books = db.session.query(func.count(Book.id)).scalar()
-        total_members = db.session.query(func.count(Member.id)).scalar()
-        active_loans = db.session.query(func.count(Loan.id)).filter(
-            Loan.return_date == None
-        ).scalar()
-        overdue_loans = db.session.query(func.count(Loan.id)).filter(
-            Loan.status == 'overdue'
-        ).scalar()
-        pending_fines = db.session.query(func.count(Fine.id)).filter(
-            Fine.status == 'pending'
-        ).scalar()
+        # Counters come from the cached stats table; recent loans is the only query
+        stats = library_stats.get()
         
         # Limited recent loans with eager loading
         recent_loans = Loan.query.options(
@@ -605,19 +3933,16 @@ def dashboard():
         
         return render_template('dashboard.html',
                              title='Librarian Dashboard',
-                             total_books=total_books,
-                             total_members=total_members,
-                             active_loans=active_loans,
-                             overdue_loans=overdue_loans,
-                             pending_fines=pending_fines,
+                             total_books=stats['total_books'],
+                             total_members=stats['total_members'],
+                             active_loans=stats['active_loans'],
+                             overdue_loans=stats['overdue_loans'],
+                             pending_fines=stats['pending_fines'],
                              recent_loans=recent_loans,
                              now=current_time)  # Add this line
     
-    # Admin dashboard - optimized queries
-    total_books = db.session.query(func.count(Book.id)).scalar()
-    total_members = db.session.query(func.count(Member.id)).scalar()
-    total_authors = db.session.query(func.count(Author.id)).scalar()
-    total_publishers = db.session.query(func.count(Publisher.id)).scalar()
+    # Admin dashboard - counters from the cached stats table
+    stats = library_stats.get()
     
     recent_activities = Loan.query.options(
         joinedload(Loan.book),
@@ -626,10 +3951,10 @@ def dashboard():
     
     return render_template('dashboard.html',
                          title='Admin Dashboard',
-                         total_books=total_books,
-                         total_members=total_members,
-                         total_authors=total_authors,
-                         total_publishers=total_publishers,
+                         total_books=stats['total_books'],
+                         total_members=stats['total_members'],
+                         total_authors=stats['total_authors'],
+                         total_publishers=stats['total_publishers'],
                          recent_activities=recent_activities,
                          now=current_time)  # Add this line
 
@@ -637,10 +3962,11 @@ def dashboard():
 @login_required
 def profile():
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         form = MemberRegistrationForm()
         
-        # Remove password field for profile updates
+        # Remove the account fields for profile updates
+        del form.username
         del form.password
         
         if request.method == 'GET' and member:
@@ -663,8 +3989,7 @@ def profile():
                     member.membership_type = form.membership_type.data
                 else:
                     # Create new member
-                    member_count = Member.query.count()
-                    new_id = f'M{member_count + 1:06d}'
+                    new_id = next_id('member')
                     
                     new_member = Member(
                         id=new_id,
@@ -677,6 +4002,7 @@ def profile():
                         user_id=current_user.id
                     )
                     db.session.add(new_member)
+                    adjust_stats(total_members=1)
                 
                 db.session.commit()
                 flash('Profile updated successfully!', 'success')
@@ -685,6 +4011,8 @@ def profile():
                 db.session.rollback()
                 flash(f'Error updating profile: {str(e)}', 'error')
         
+        if member:
+            load_member_stats([member])
         return render_template('profile.html', title='Member Profile', form=form, member=member)
     
     # Admin and librarian don't need profiles
@@ -711,14 +4039,15 @@ def register():
             flash('Username already exists', 'error')
         else:
             try:
+                # Reserve the member ID before this transaction starts writing
+                new_id = next_id('member')
+                
                 hashed_password = generate_password_hash(form.password.data)
                 new_user = User(username=form.username.data, password_hash=hashed_password, role='member')
                 db.session.add(new_user)
                 db.session.flush()  # Get user ID
                 
                 # Create member record
-                member_count = Member.query.count()
-                new_id = f'M{member_count + 1:06d}'
                 
                 new_member = Member(
                     id=new_id,
@@ -731,6 +4060,7 @@ def register():
                     user_id=new_user.id
                 )
                 db.session.add(new_member)
+                adjust_stats(total_members=1)
                 db.session.commit()
                 
                 flash('Registration successful! Please login.', 'success')
@@ -748,48 +4078,201 @@ def logout():
 
 @app.route('/members')
 @login_required
+@replica_read
 def members():
     if current_user.role not in ['admin', 'librarian']:
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    members = Member.query.all()
+    pagination = paginate_members(after=request.args.get('after'), before=request.args.get('before'),
+                                  per_page=get_page_size(request.args.get('per_page')))
+    members = load_member_stats(pagination['members'])
     form = MemberRegistrationForm()
-    return render_template('members.html', title='Members', members=members, form=form)
+    return render_template('members.html', title='Members', members=members, pagination=pagination, form=form)
 
 @app.route('/books')
 @login_required
+@replica_read
 def books():
     search_query = request.args.get('search', '')
     category_filter = request.args.get('category', '')
     author_filter = request.args.get('author', '')
+    pages = dict(after=request.args.get('after'), before=request.args.get('before'),
+                 per_page=get_page_size(request.args.get('per_page')))
+    # Members act on availability (the Borrow button), which borrowing does not
+    # expire from the cache, so only staff get the cached catalog
+    if search_query or category_filter or author_filter or current_user.role not in ['admin', 'librarian']:
+        return render_book_catalog(BookForm(), search_query, category_filter, author_filter, **pages)
+    
+    # The unfiltered catalog is the same for every staff user with a role
+    return render_cached_page('books.html', ['books', 'authors', 'publishers', 'categories'],
+                              lambda: book_catalog_context(BookForm(), **pages))
+
+@app.route('/api/books')
+@login_required
+@replica_read
+def books_api():
+    """JSON variant of the catalog, paginated with the same cursors as /books"""
+    query = build_book_query(
+        request.args.get('search', ''),
+        request.args.get('category', ''),
+        request.args.get('author', ''),
+    )
+    pagination = paginate_books(
+        query,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=get_page_size(request.args.get('per_page')),
+    )
     
-    query = Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category))
+    return jsonify({
+        'success': True,
+        'books': [book_to_dict(book) for book in pagination['books']],
+        'per_page': pagination['per_page'],
+        'next_cursor': pagination['next_cursor'],
+        'prev_cursor': pagination['prev_cursor'],
+    })
+
+@app.route('/export/<name>')
+@login_required
+def export_data(name):
+    if current_user.role not in ['admin', 'librarian']:
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
     
-    if search_query:
-        query = query.filter(Book.title.ilike(f'%{search_query}%'))
+    fmt = request.args.get('format', 'csv')
+    if name not in EXPORTS or fmt not in EXPORT_FORMATS:
+        flash('Unknown export', 'error')
+        return redirect(url_for('dashboard'))
     
-    if category_filter:
-        query = query.filter(Book.category_id == category_filter)
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') if request.args.get('end') else None
+    except ValueError:
+        flash('Export dates must be given as YYYY-MM-DD', 'error')
+        return redirect(url_for(name))
+    if (start or end) and EXPORTS[name][1] is None:
+        flash(f'The {name} export has no date range', 'error')
+        return redirect(url_for(name))
+    
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = export_filename(name, fmt, start, end, compress)
+    # The end date is inclusive
+    end = end + timedelta(days=1) if end else None
+    
+    return Response(
+        stream_with_context(export_chunks(name, fmt, start, end, compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/reports')
+@login_required
+def reports():
+    if current_user.role not in ['admin', 'librarian']:
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
     
-    if author_filter:
-        query = query.filter(Book.author_id == author_filter)
+    defaults = report_params('circulation', {})
+    return render_template('reports.html', reports=REPORTS, default_start=defaults['start'], default_end=defaults['end'])
+
+@app.route('/api/reports/<name>')
+@login_required
+def report_status(name):
+    if current_user.role not in ['admin', 'librarian']:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    if name not in REPORTS:
+        return jsonify({'success': False, 'message': 'Unknown report'})
     
-    books = query.all()
-    categories = Category.query.all()
-    authors = Author.query.all()
+    try:
+        params = report_params(name, request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
     
-    form = BookForm()
-    form.author_id.choices = [(a.id, a.name) for a in authors]
-    form.publisher_id.choices = [(p.id, p.name) for p in Publisher.query.all()]
-    form.category_id.choices = [(c.id, c.name) for c in categories]
+    status, detail = report_renderer.request(name, params)
+    if status == 'failed':
+        return jsonify({'success': False, 'message': f'Error generating report: {detail}'})
+    return jsonify({'success': True, 'status': status, 'url': url_for('download_report', name=name, **params)})
+
+@app.route('/reports/<name>.pdf')
+@login_required
+def download_report(name):
+    if current_user.role not in ['admin', 'librarian']:
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+    if name not in REPORTS:
+        flash('Unknown report', 'error')
+        return redirect(url_for('reports'))
+    
+    try:
+        params = report_params(name, request.args)
+    except ValueError as e:
+        flash(f'Invalid report dates: {str(e)}', 'error')
+        return redirect(url_for('reports'))
+    
+    status, detail = report_renderer.request(name, params)
+    if status == 'ready':
+        filename = '_'.join([name] + list(params.values())) + '.pdf'
+        return send_file(detail, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    if status == 'failed':
+        flash(f'Error generating report: {detail}', 'error')
+    else:
+        flash('The report is being generated. Please try again in a moment.', 'info')
+    return redirect(url_for('reports'))
+
+@app.route('/api/books/search')
+@login_required
+@replica_read
+def search_books_api():
+    """Ranked full-text search over title, description, ISBN, author, publisher and category"""
+    search_query = request.args.get('q', '').strip()
+    if not search_query:
+        return jsonify({'success': True, 'books': []})
+    
+    try:
+        limit = int(request.args.get('limit', app.config['SEARCH_RESULT_LIMIT']))
+    except ValueError:
+        limit = app.config['SEARCH_RESULT_LIMIT']
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    
+    hits = get_search_backend().search(search_query, limit)
+    books_by_id = {
+        book.id: book for book in Book.query.options(
+            joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category)
+        ).filter(Book.id.in_([book_id for book_id, _ in hits])).all()
+    } if hits else {}
+    
+    results = []
+    for book_id, score in hits:
+        book = books_by_id.get(book_id)
+        if book:
+            results.append(dict(book_to_dict(book), score=round(score, 4)))
+    
+    return jsonify({'success': True, 'books': results})
+
+@app.route('/api/members/lookup')
+@login_required
+@replica_read
+def lookup_members_api():
+    """Typeahead suggestions for member ID inputs"""
+    if current_user.role not in ['admin', 'librarian']:
+        return jsonify({'success': False, 'message': 'Access denied'})
     
-    current_year = datetime.now().year  # Add this line
+    results = lookup_members(request.args.get('q', '').strip(), get_lookup_limit(request.args.get('limit')),
+                             active_only=request.args.get('active') in ('1', 'true'))
+    return jsonify({'success': True, 'results': results})
+
+@app.route('/api/books/lookup')
+@login_required
+@replica_read
+def lookup_books_api():
+    """Typeahead suggestions for book ID inputs"""
+    if current_user.role not in ['admin', 'librarian']:
+        return jsonify({'success': False, 'message': 'Access denied'})
     
-    return render_template('books.html', title='Books', books=books, 
-                         categories=categories, authors=authors, form=form,
-                         search_query=search_query, category_filter=category_filter, 
-                         author_filter=author_filter, current_year=current_year)  # Add current_year here
+    results = lookup_books(request.args.get('q', '').strip(), get_lookup_limit(request.args.get('limit')),
+                           available_only=request.args.get('available') in ('1', 'true'))
+    return jsonify({'success': True, 'results': results})
 
 @app.route('/edit_book', methods=['POST'])
 @login_required
@@ -833,6 +4316,10 @@ def edit_book():
         book.available_copies = book.total_copies - (book.total_copies - book.available_copies)
         book.location = request.form.get('location')
         
+        db.session.flush()
+        index_book(book)
+        invalidate_tags('books')
+        
         db.session.commit()
         return jsonify({'success': True, 'message': 'Book updated successfully'})
         
@@ -858,7 +4345,10 @@ def delete_book():
         if active_loans > 0:
             return jsonify({'success': False, 'message': f'Cannot delete book with {active_loans} active loan(s)'})
         
+        get_search_backend().remove_book(book.id)
         db.session.delete(book)
+        adjust_stats(total_books=-1)
+        invalidate_tags('books')
         db.session.commit()
         return jsonify({'success': True, 'message': 'Book deleted successfully'})
         
@@ -868,13 +4358,14 @@ def delete_book():
 
 @app.route('/loans')
 @login_required
+@replica_read
 def loans():
     form = LoanForm()
     loans = Loan.query.options(joinedload(Loan.book), joinedload(Loan.member)).all()
 
     member = None
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
 
     return render_template(
         'loans.html',
@@ -886,6 +4377,7 @@ def loans():
 
 @app.route('/loan_details')
 @login_required
+@replica_read
 def loan_details():
     if current_user.role != 'member':
         flash('Access denied', 'error')
@@ -895,7 +4387,7 @@ def loan_details():
     member_id = request.args.get('member_id')
     
     # Verify the member owns these loans
-    member = Member.query.filter_by(user_id=current_user.id).first()
+    member = g.member
     if not member or member.id != member_id:
         flash('Access denied', 'error')
         return redirect(url_for('loans'))
@@ -926,7 +4418,7 @@ def get_loan_id():
     member_id = request.args.get('member_id')
     
     # Verify the member owns this loan
-    member = Member.query.filter_by(user_id=current_user.id).first()
+    member = g.member
     if not member or member.id != member_id:
         return jsonify({'success': False, 'message': 'Access denied'})
     
@@ -944,9 +4436,10 @@ def get_loan_id():
 
 @app.route('/fines')
 @login_required
+@replica_read
 def fines():
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         if member:
             fines = Fine.query.filter_by(member_id=member.id).options(
                 joinedload(Fine.loan).joinedload(Loan.book)
@@ -968,39 +4461,44 @@ def fines():
 
 @app.route('/authors')
 @login_required
+@replica_read
 def authors():
     if current_user.role not in ['admin', 'librarian']:
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    authors = Author.query.all()
-    form = AuthorForm()
-    current_date = date.today().isoformat()  # Add this line
-    
-    return render_template('authors.html', title='Authors', authors=authors, form=form, current_date=current_date)
+    return render_cached_page('authors.html', ['authors', 'books'], lambda: dict(
+        title='Authors', authors=Author.query.all(), form=AuthorForm(), current_date=date.today().isoformat()
+    ))
 
 @app.route('/publishers')
 @login_required
+@replica_read
 def publishers():
     if current_user.role not in ['admin', 'librarian']:
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    publishers = Publisher.query.all()
-    form = PublisherForm()
-    return render_template('publishers.html', title='Publishers', publishers=publishers, form=form)
+    return render_cached_page('publishers.html', ['publishers', 'books'], lambda: dict(
+        title='Publishers', publishers=Publisher.query.all(), form=PublisherForm()
+    ))
+
+def categories_context():
+    categories, children, book_counts = category_tree()
+    form = CategoryForm()
+    form.parent_id.choices = [('', 'No Parent')] + [(c.id, c.name) for c in categories]
+    return dict(title='Categories', categories=categories, children=children, book_counts=book_counts,
+                categories_by_id={c.id: c for c in categories}, form=form)
 
 @app.route('/categories')
 @login_required
+@replica_read
 def categories():
     if current_user.role not in ['admin', 'librarian']:
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    categories = Category.query.all()
-    form = CategoryForm()
-    form.parent_id.choices = [('', 'No Parent')] + [(c.id, c.name) for c in categories]
-    return render_template('categories.html', title='Categories', categories=categories, form=form)
+    return render_cached_page('categories.html', ['categories', 'books'], categories_context)
 
 # API Routes for AJAX operations
 @app.route('/api/borrow_book', methods=['POST'])
@@ -1009,46 +4507,28 @@ def borrow_book():
     if current_user.role != 'member':
         return jsonify({'success': False, 'message': 'Access denied'})
     
-    member = Member.query.filter_by(user_id=current_user.id).first()
+    member = g.member
     book_id = request.json.get('book_id')
-    book = Book.query.get(book_id)
     
-    if not book:
-        return jsonify({'success': False, 'message': 'Book not found'})
+    try:
+        # Due date is based on membership type
+        loan, reason = checkout_book(member.id, book_id)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error borrowing book: {str(e)}'})
     
-    # Check if book is available
-    if not book.is_available:
+    if reason == 'book_not_found':
+        return jsonify({'success': False, 'message': 'Book not found'})
+    if reason == 'unavailable':
         return jsonify({'success': False, 'message': 'Book is not available'})
-    
-    # Check member's current loans
-    if member.current_loans_count >= member.max_books:
+    if reason == 'limit':
         return jsonify({'success': False, 'message': f'You have reached your limit of {member.max_books} books'})
-    
-    # Check if member has pending fines
-    if member.total_fines_due > 0:
+    if reason == 'fines':
         return jsonify({'success': False, 'message': 'You have pending fines. Please clear them first.'})
+    if reason:
+        return jsonify({'success': False, 'message': 'The library is busy. Please try again.'})
     
-    try:
-        # Calculate due date based on membership type
-        loan_period = get_loan_period(member)
-        due_date = datetime.utcnow() + timedelta(days=loan_period)
-        
-        # Create loan
-        new_loan = Loan(
-            book_id=book_id,
-            member_id=member.id,
-            due_date=due_date
-        )
-        db.session.add(new_loan)
-        
-        # Update book availability
-        book.available_copies -= 1
-        
-        db.session.commit()
-        return jsonify({'success': True, 'message': 'Book borrowed successfully'})
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'message': f'Error borrowing book: {str(e)}'})
+    return jsonify({'success': True, 'message': 'Book borrowed successfully'})
 
 @app.route('/api/return_book', methods=['POST'])
 @login_required
@@ -1066,18 +4546,32 @@ def return_book():
         return jsonify({'success': False, 'message': 'Book already returned'})
     
     try:
-        # Update loan
-        loan.return_date = datetime.utcnow()
-        loan.status = 'returned'
+        # Final fine amount, calculated while the loan is still open
+        final_fine = calculate_fine(loan)
+        
+        # Close the loan only if nobody else returned it concurrently
+        was_overdue = loan.status == 'overdue'
+        closed = db.session.execute(
+            update(Loan).where(Loan.id == loan.id, Loan.return_date.is_(None))
+            .values(return_date=datetime.utcnow(), status='returned')
+            .execution_options(synchronize_session='fetch')
+        ).rowcount
+        if not closed:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Book already returned'})
+        adjust_stats(active_loans=-1, overdue_loans=-1 if was_overdue else 0)
         
-        # Update book availability
-        book = Book.query.get(loan.book_id)
-        book.available_copies += 1
+        # Update book availability without a read-modify-write race
+        db.session.execute(
+            update(Book).where(Book.id == loan.book_id)
+            .values(available_copies=Book.available_copies + 1)
+            .execution_options(synchronize_session=False)
+        )
         
         # Update fine if exists
         fine = Fine.query.filter_by(loan_id=loan_id).first()
         if fine and fine.status == 'pending':
-            fine.amount = calculate_fine(loan)  # Recalculate final amount
+            fine.amount = final_fine  # Recalculate final amount
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Book returned successfully'})
@@ -1097,7 +4591,7 @@ def renew_loan():
     if not loan:
         return jsonify({'success': False, 'message': 'Loan not found'})
     
-    if loan.member.user_id != current_user.id:
+    if g.member is None or loan.member_id != g.member.id:
         return jsonify({'success': False, 'message': 'Access denied'})
     
     if loan.return_date:
@@ -1121,8 +4615,7 @@ def renew_loan():
     
     try:
         # Calculate new due date (extend by original loan period)
-        member = Member.query.filter_by(user_id=current_user.id).first()
-        loan_period = get_loan_period(member)
+        loan_period = get_loan_period(g.member)
         loan.due_date = loan.due_date + timedelta(days=loan_period)
         loan.renewed_count += 1
         
@@ -1143,7 +4636,7 @@ def pay_fine():
     
     # Check permissions
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         if fine.member_id != member.id:
             return jsonify({'success': False, 'message': 'Access denied'})
     
@@ -1153,6 +4646,7 @@ def pay_fine():
     try:
         # In a real system, you'd integrate with a payment gateway
         # For now, we'll just mark it as paid
+        adjust_stats(pending_fines=-1 if fine.status == 'pending' else 0)
         fine.status = 'paid'
         fine.paid_date = datetime.utcnow()
         
@@ -1173,7 +4667,7 @@ def carrells():
         return redirect(url_for('dashboard'))
     
     carrells_list = Carrell.query.all()
-    active_rentals = CarrellRental.query.filter_by(status='active').options(
+    active_rentals = CarrellRental.query.filter(CarrellRental.status.in_(['active', 'overdue'])).options(
         joinedload(CarrellRental.member), 
         joinedload(CarrellRental.carrell)
     ).all()
@@ -1182,11 +4676,7 @@ def carrells():
     rental_form = CarrellRentalForm()
     
     # Update choices
-    available_carrells = Carrell.query.filter_by(is_available=True).all()
-    active_members = Member.query.filter_by(membership_status='active').all()
-    
-    rental_form.carrell_id.choices = [(c.id, f"{c.name} - {c.location}") for c in available_carrells]
-    rental_form.member_id.choices = [(m.id, f"{m.id} - {m.full_name}") for m in active_members]
+    rental_form.carrell_id.choices = choice_cache.get('available_carrells')
     
     return render_template('carrells.html', 
                          title='Carrell Management',
@@ -1206,8 +4696,7 @@ def add_carrell():
     if form.validate_on_submit():
         try:
             # Generate carrell ID
-            carrell_count = Carrell.query.count()
-            new_id = f'C{carrell_count + 1:04d}'
+            new_id = next_id('carrell')
             
             new_carrell = Carrell(
                 id=new_id,
@@ -1216,6 +4705,7 @@ def add_carrell():
                 capacity=form.capacity.data
             )
             db.session.add(new_carrell)
+            invalidate_tags('available_carrells')
             db.session.commit()
             
             flash('Carrell added successfully', 'success')
@@ -1229,10 +4719,11 @@ def add_carrell():
 
 @app.route('/notifications')
 @login_required
+@replica_read
 def notifications():
     """Display user notifications"""
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         if not member:
             flash('Member profile not found', 'error')
             return redirect(url_for('dashboard'))
@@ -1252,18 +4743,56 @@ def notifications():
 @app.route('/api/notifications/count')
 @login_required
 def notification_count():
-    """Get unread notification count for current user"""
+    """Get unread notification count for current user (polling fallback for the stream)"""
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         if member:
-            count = Notification.query.filter_by(
-                member_id=member.id,
-                is_read=False
-            ).count()
-            return jsonify({'count': count})
+            return jsonify({'count': unread_counts.get(member.id)})
     
     return jsonify({'count': 0})
 
+notification_stream_slots = threading.BoundedSemaphore(app.config['NOTIFICATION_STREAM_LIMIT'])
+
+@app.route('/api/notifications/stream')
+@login_required
+def notification_stream():
+    """Server-Sent Events stream of the current member's unread count.
+
+    Each open stream holds a worker thread, so a process serves at most
+    NOTIFICATION_STREAM_LIMIT of them; beyond that the client gets a 503 and
+    falls back to polling /api/notifications/count.
+    """
+    member = None
+    if current_user.role == 'member':
+        member = g.member
+    if not member:
+        return Response(status=204)
+    member_id = member.id
+    if not notification_stream_slots.acquire(blocking=False):
+        return Response(status=503, headers={'Retry-After': '60'})
+    
+    def generate():
+        deadline = time.time() + app.config['NOTIFICATION_STREAM_MAX_SECONDS']
+        last_count = None
+        yield 'retry: 5000\n\n'
+        while time.time() < deadline:
+            version = unread_counts.version(member_id)
+            count = unread_counts.get(member_id)
+            # Do not hold a connection while idle
+            db.session.close()
+            if count != last_count:
+                yield f"event: unread\ndata: {json.dumps({'count': count})}\n\n"
+                last_count = count
+            else:
+                yield ': keepalive\n\n'
+            unread_counts.wait(member_id, version, app.config['NOTIFICATION_STREAM_POLL_SECONDS'])
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response however the stream ends, even before its first chunk
+    response.call_on_close(notification_stream_slots.release)
+    return response
+
 @app.route('/api/notifications/mark_read', methods=['POST'])
 @login_required
 def mark_notification_read():
@@ -1271,42 +4800,211 @@ def mark_notification_read():
     notification_id = request.json.get('notification_id')
     
     if current_user.role == 'member':
-        member = Member.query.filter_by(user_id=current_user.id).first()
+        member = g.member
         if member:
-            notification = Notification.query.filter_by(
-                id=notification_id,
-                member_id=member.id
-            ).first()
-            
-            if notification:
-                notification.is_read = True
+            # Only the request that flips is_read decrements the counter
+            marked = db.session.execute(
+                update(Notification).where(
+                    Notification.id == notification_id,
+                    Notification.member_id == member.id,
+                    Notification.is_read == False
+                ).values(is_read=True).execution_options(synchronize_session=False)
+            ).rowcount
+            if marked:
+                adjust_unread_counts({member.id: -marked})
                 db.session.commit()
                 return jsonify({'success': True})
+            
+            db.session.rollback()
+            if db.session.query(exists().where(
+                Notification.id == notification_id, Notification.member_id == member.id
+            )).scalar():
+                return jsonify({'success': True})
     
     return jsonify({'success': False})
 
-def background_notification_checker():
-    """Background thread to check for pending notifications"""
-    while True:
-        try:
-            count = check_pending_notifications()
-            if count > 0:
-                print(f"Sent {count} notifications")
-            time.sleep(60)  # Check every minute
-        except Exception as e:
-            print(f"Error in background notification checker: {str(e)}")
-            time.sleep(60)
-
-# Start the background thread when the app starts
+# Serving processes start the job runner from their entry point (wsgi.py,
+# python app.py); importing the app, e.g. for a CLI command, never does
 def start_background_tasks():
-    """Start background tasks"""
+    """Start a leader-elected job runner thread in this process"""
+    if not app.config['RUN_BACKGROUND_JOBS']:
+        return
     if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        thread = threading.Thread(target=background_notification_checker, daemon=True)
+        runner = JobRunner()
+        thread = threading.Thread(target=runner.run, daemon=True)
         thread.start()
 
+jobs_cli = AppGroup('jobs', help='Periodic job commands.')
+
+@jobs_cli.command('run-once')
+@click.argument('names', nargs=-1)
+def run_jobs_once_command(names):
+    """Run the named jobs now, or every job that is due when none are named"""
+    if names:
+        for name in names:
+            if name not in PERIODIC_JOBS:
+                raise click.BadParameter(f"Unknown job '{name}'. Known jobs: {', '.join(PERIODIC_JOBS)}")
+        results = {name: run_job(name) for name in names}
+    else:
+        results = run_due_jobs()
+    for name, result in results.items():
+        print(f"Job {name}: {result}")
+
+@jobs_cli.command('run')
+def run_jobs_command():
+    """Run the job runner in the foreground until SIGINT/SIGTERM"""
+    runner = JobRunner()
+    signal.signal(signal.SIGINT, runner.stop)
+    signal.signal(signal.SIGTERM, runner.stop)
+    print(f"Job runner {runner.holder} started; jobs: {', '.join(PERIODIC_JOBS)}")
+    runner.run()
+    print(f"Job runner {runner.holder} stopped")
+
+app.cli.add_command(jobs_cli)
+
+fines_cli = AppGroup('fines', help='Fine management commands.')
+
+@fines_cli.command('accrue')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+@click.option('--nightly', is_flag=True, help='Accrue as of midnight UTC so same-day reruns are no-ops.')
+@click.option('--chunk-size', type=int, default=None, help='Loan ids handled per statement.')
+def accrue_fines_command(dry_run, nightly, chunk_size):
+    """Accrue overdue fines for every open overdue loan"""
+    started = time.time()
+    result = accrue_overdue_fines(nightly=nightly, dry_run=dry_run, chunk_size=chunk_size)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    print(f"elapsed: {time.time() - started:.2f}s")
+
+app.cli.add_command(fines_cli)
+
+catalog_cli = AppGroup('catalog', help='Catalog maintenance commands.')
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(CATALOG_READERS)), default=None,
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', type=int, default=None, help='Records inserted per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first record.')
+def import_catalog_command(path, fmt, batch_size, restart):
+    """Import books from a CSV, JSON Lines or MARC mnemonic (.mrk) file"""
+    try:
+        result = import_catalog(path, fmt=fmt, batch_size=batch_size, restart=restart)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+app.cli.add_command(catalog_cli)
+
+schema_cli = AppGroup('schema', help='Schema migration commands.')
+
+@schema_cli.command('upgrade')
+def upgrade_schema_command():
+    """Apply pending schema migrations"""
+    applied = run_migrations()
+    for version in applied:
+        print(f"Applied {version}: {MIGRATIONS[version]['name']}")
+    if not applied:
+        print("Schema is up to date")
+
+@schema_cli.command('status')
+def schema_status_command():
+    """List schema migrations and when they were applied"""
+    done = applied_migrations()
+    for version in sorted(MIGRATIONS):
+        applied_at = done.get(version)
+        state = applied_at.strftime('%Y-%m-%d %H:%M') if applied_at else 'pending'
+        print(f"{version:>4}  {MIGRATIONS[version]['name']:<30} {state}")
+
+@schema_cli.command('check-indexes')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query.')
+def check_indexes_command(verbose):
+    """Fail if any hot query is planned as a full table scan"""
+    results = check_hot_queries()
+    failures = [name for name, (uses_index, _) in results.items() if not uses_index]
+    for name, (uses_index, plan) in results.items():
+        print(f"{'ok  ' if uses_index else 'SCAN'}  {name}")
+        if verbose or not uses_index:
+            for line in plan:
+                print(f"        {line}")
+    if failures:
+        raise click.ClickException(f"{len(failures)} hot queries do a full table scan: {', '.join(failures)}")
+
+app.cli.add_command(schema_cli)
+
+replicas_cli = AppGroup('replicas', help='Read replica commands.')
+
+@replicas_cli.command('status')
+def replica_status_command():
+    """Show each replica's lag behind the primary"""
+    if not replica_keys():
+        print("No replicas configured (set DATABASE_REPLICA_URLS)")
+    for key in replica_keys():
+        lag = measure_replica_lag(key)
+        state = 'unavailable' if lag is None else f'{lag:.0f}s behind'
+        if lag is not None and lag > app.config['REPLICA_MAX_LAG_SECONDS']:
+            state += ' (skipped)'
+        print(f"{key:<10} {db.engines[key].url.render_as_string(hide_password=True)}  {state}")
+
+@replicas_cli.command('sync')
+def sync_replicas_command():
+    """Copy the primary into every SQLite replica (local testing without real replication)"""
+    if db.engine.url.get_backend_name() != 'sqlite':
+        raise click.ClickException('sync only copies SQLite databases; use the server\'s own replication')
+    write_replication_heartbeat()
+    db.session.commit()
+    source = sqlite3.connect(db.engine.url.database)
+    try:
+        for key in replica_keys():
+            engine = db.engines[key]
+            if engine.url.get_backend_name() != 'sqlite':
+                print(f"Skipping {key}: not a SQLite database")
+                continue
+            engine.dispose()
+            target = sqlite3.connect(engine.url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+            print(f"Copied primary to {key} ({engine.url.database})")
+    finally:
+        source.close()
+
+app.cli.add_command(replicas_cli)
+
+@app.cli.command('export')
+@click.argument('name', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', help='Output format.')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day to include (loans and fines only).')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last day to include (loans and fines only).')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None,
+              help='Write to this file instead of standard output.')
+def export_command(name, fmt, start, end, compress, output):
+    """Stream books, members, loans or fines as CSV or JSON Lines"""
+    if (start or end) and EXPORTS[name][1] is None:
+        raise click.UsageError(f'The {name} export has no date range.')
+    end = end + timedelta(days=1) if end else None
+    
+    stream = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        for chunk in export_chunks(name, fmt, start, end, compress):
+            stream.write(chunk)
+    finally:
+        stream.flush()
+        if output:
+            stream.close()
+
 # Call this after app initialization
 with app.app_context():
     db.create_all()
+    run_migrations()
+    ensure_indexes()
+    init_search_index()
+    init_reference_versions()
     
     # Create default admin user if not exists
     if not User.query.filter_by(username='admin').first():
@@ -1325,9 +5023,6 @@ with app.app_context():
         )
         db.session.add(librarian_user)
         db.session.commit()
-    
-    # Start background tasks
-    start_background_tasks()
 
 @app.route('/api/check_notifications')
 @login_required
@@ -1353,11 +5048,7 @@ def create_carrell_rental():
     form = CarrellRentalForm()
     
     # Update choices dynamically
-    available_carrells = Carrell.query.filter_by(is_available=True).all()
-    active_members = Member.query.filter_by(membership_status='active').all()
-    
-    form.carrell_id.choices = [(c.id, f"{c.name} - {c.location}") for c in available_carrells]
-    form.member_id.choices = [(m.id, f"{m.id} - {m.full_name}") for m in active_members]
+    form.carrell_id.choices = choice_cache.get('available_carrells')
     
     if form.validate_on_submit():
         carrell_id = form.carrell_id.data
@@ -1375,11 +5066,15 @@ def create_carrell_rental():
             flash('Carrell is not available', 'error')
             return redirect(url_for('carrells'))
         
+        # Calculate end time
+        start_time = datetime.utcnow()
+        end_time = start_time + timedelta(hours=duration_hours)
+        
+        if not carrell_is_free(carrell_id, start_time, end_time, member_id=member_id):
+            flash('Carrell is booked by another member during that time', 'error')
+            return redirect(url_for('carrells'))
+        
         try:
-            # Calculate end time
-            start_time = datetime.utcnow()
-            end_time = start_time + timedelta(hours=duration_hours)
-            
             # Create rental
             new_rental = CarrellRental(
                 carrell_id=carrell_id,
@@ -1396,6 +5091,7 @@ def create_carrell_rental():
             # Schedule notifications
             schedule_carrell_notifications(new_rental)
             
+            invalidate_tags('available_carrells')
             db.session.commit()
             flash('Carrell rental created successfully', 'success')
         except Exception as e:
@@ -1418,6 +5114,11 @@ def end_carrell_rental():
         rental = CarrellRental.query.get(rental_id)
         if not rental:
             return jsonify({'success': False, 'message': 'Rental not found'})
+        if rental.status == 'completed':
+            return jsonify({'success': False, 'message': 'Rental already ended'})
+        
+        # The expiry sweeper already released the carrell and fined an overdue rental
+        was_overdue = rental.status == 'overdue'
         
         # Update rental
         rental.actual_end_time = datetime.utcnow()
@@ -1427,19 +5128,33 @@ def end_carrell_rental():
         
         # Update carrell availability
         carrell = Carrell.query.get(rental.carrell_id)
-        carrell.is_available = True
-        carrell.current_rental_id = None
+        if carrell.current_rental_id == rental.id:
+            carrell.is_available = True
+            carrell.current_rental_id = None
         
         # Check for key return fine
-        if not key_returned:
+        if not key_returned and not was_overdue:
             key_fine = Fine(
+                rental_id=rental.id,
                 member_id=rental.member_id,
-                amount=10.00,  # $10 fine for not returning key
+                amount=app.config['CARRELL_KEY_FINE'],
                 reason='key_not_returned',
                 issued_date=datetime.utcnow()
             )
             db.session.add(key_fine)
+            adjust_stats(pending_fines=1)
+        elif key_returned and was_overdue:
+            # The key came back late, not lost: waive the sweeper's key fine.
+            # paid_date closes it, so it leaves the member's unpaid total.
+            waived = db.session.execute(
+                update(Fine).where(
+                    Fine.rental_id == rental.id, Fine.reason == 'key_not_returned', Fine.status == 'pending'
+                ).values(status='waived', paid_date=rental.key_return_time)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            adjust_stats(pending_fines=-waived)
         
+        invalidate_tags('available_carrells')
         db.session.commit()
         return jsonify({'success': True, 'message': 'Carrell rental ended successfully'})
         
@@ -1479,6 +5194,7 @@ def add_noise_fine():
             issued_date=datetime.utcnow()
         )
         db.session.add(noise_fine)
+        adjust_stats(pending_fines=1)
         db.session.commit()
         
         return jsonify({'success': True, 'message': f'Noise fine of ${amount:.2f} added successfully'})
@@ -1487,6 +5203,142 @@ def add_noise_fine():
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Error adding noise fine: {str(e)}'})
 
+@app.route('/student_carrells')
+@login_required
+def student_carrells():
+    if current_user.role != 'member':
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+    
+    member = g.member
+    now = datetime.utcnow()
+    days, grid = carrell_availability(now.date(), now=now)
+    
+    try:
+        day = datetime.strptime(request.args.get('day', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = now.date()
+    if day not in days:
+        day = now.date() if now.date() in days else days[0]
+    day_index = days.index(day)
+    
+    carrells_list = Carrell.query.order_by(Carrell.id).all()
+    bookings = CarrellBooking.query.filter(
+        CarrellBooking.member_id == member.id,
+        CarrellBooking.status == 'booked',
+        CarrellBooking.end_time > now
+    ).options(joinedload(CarrellBooking.carrell)).order_by(CarrellBooking.start_time).all()
+    
+    form = CarrellBookingForm()
+    form.hours.choices = [(hours, f'{hours} Hours') for hours in app.config['CARRELL_BOOKING_HOURS']]
+    
+    return render_template('student_carrells.html',
+                         title='Book a Carrell',
+                         days=days,
+                         day=day,
+                         slots=carrell_slot_times(day),
+                         carrells=carrells_list,
+                         free=[(carrell, grid[carrell.id][day_index]) for carrell in carrells_list],
+                         bookings=bookings,
+                         cancel_cutoff=now + timedelta(minutes=app.config['CARRELL_CANCEL_CUTOFF_MINUTES']),
+                         has_fines=member.total_fines_due > 0,
+                         form=form)
+
+@app.route('/book_carrell', methods=['POST'])
+@login_required
+def book_carrell_route():
+    if current_user.role != 'member':
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+    
+    member = g.member
+    form = CarrellBookingForm()
+    form.hours.choices = [(hours, f'{hours} Hours') for hours in app.config['CARRELL_BOOKING_HOURS']]
+    
+    if not form.validate_on_submit():
+        flash('Invalid booking request', 'error')
+        return redirect(url_for('student_carrells'))
+    
+    start_time = form.start_time.data
+    error = validate_booking_time(start_time, form.hours.data)
+    if error:
+        flash(error, 'error')
+        return redirect(url_for('student_carrells', day=start_time.date().isoformat()))
+    
+    try:
+        booking, reason = book_carrell(member.id, form.carrell_id.data, start_time, form.hours.data)
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error booking carrell: {str(e)}', 'error')
+        return redirect(url_for('student_carrells', day=start_time.date().isoformat()))
+    
+    if reason == 'carrell_not_found':
+        flash('Carrell not found', 'error')
+    elif reason == 'fines':
+        flash('You have pending fines. Please clear them before booking a carrell.', 'error')
+    elif reason == 'conflict':
+        flash('That carrell is already booked during this time', 'error')
+    elif reason == 'limit':
+        flash(f"You can book at most {app.config['CARRELL_DAILY_LIMIT']} carrells per day", 'error')
+    elif reason:
+        flash('The library is busy. Please try again.', 'error')
+    else:
+        flash(f'{booking.carrell.name} booked for {start_time.strftime("%A %H:%M")}', 'success')
+    
+    return redirect(url_for('student_carrells', day=start_time.date().isoformat()))
+
+@app.route('/cancel_booking', methods=['POST'])
+@login_required
+def cancel_booking():
+    booking_id = request.json.get('booking_id')
+    booking = db.session.get(CarrellBooking, booking_id)
+    if not booking:
+        return jsonify({'success': False, 'message': 'Booking not found'})
+    
+    conditions = [CarrellBooking.id == booking.id, CarrellBooking.status == 'booked']
+    if current_user.role == 'member':
+        member = g.member
+        if booking.member_id != member.id:
+            return jsonify({'success': False, 'message': 'Access denied'})
+        cutoff = datetime.utcnow() + timedelta(minutes=app.config['CARRELL_CANCEL_CUTOFF_MINUTES'])
+        conditions.append(CarrellBooking.start_time > cutoff)
+    elif current_user.role not in ['admin', 'librarian']:
+        return jsonify({'success': False, 'message': 'Access denied'})
+    
+    try:
+        cancelled = db.session.execute(
+            update(CarrellBooking).where(*conditions).values(status='cancelled')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error cancelling booking: {str(e)}'})
+    
+    if not cancelled:
+        if booking.status != 'booked':
+            return jsonify({'success': False, 'message': 'Booking is already cancelled'})
+        minutes = app.config['CARRELL_CANCEL_CUTOFF_MINUTES']
+        return jsonify({'success': False, 'message': f'Bookings can only be cancelled up to {minutes} minutes before they start'})
+    return jsonify({'success': True, 'message': 'Booking cancelled'})
+
+@app.route('/api/carrells/availability')
+@login_required
+@replica_read
+def carrell_availability_api():
+    try:
+        day = datetime.strptime(request.args.get('week', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = None
+    
+    days, grid = carrell_availability(day)
+    return jsonify({
+        'success': True,
+        'days': [weekday.isoformat() for weekday in days],
+        'slots': [slot.strftime('%H:%M') for slot in carrell_slot_times(days[0])],
+        'carrells': grid
+    })
+
 # Administrative Routes
 @app.route('/add_member', methods=['POST'])
 @login_required
@@ -1499,8 +5351,7 @@ def add_member():
     if form.validate_on_submit():
         try:
             # Generate member ID
-            member_count = Member.query.count()
-            new_id = f'M{member_count + 1:06d}'
+            new_id = next_id('member')
             
             # Create user account
             user = User(
@@ -1523,6 +5374,7 @@ def add_member():
                 user_id=user.id
             )
             db.session.add(new_member)
+            adjust_stats(total_members=1)
             db.session.commit()
             
             flash(f'Member added successfully.', 'success')
@@ -1587,6 +5439,10 @@ def edit_publisher():
         publisher.address = request.form.get('address')
         publisher.website = request.form.get('website')
         
+        db.session.flush()
+        reindex_books(Book.publisher_id == publisher.id)
+        
+        invalidate_tags('publishers')
         db.session.commit()
         return jsonify({'success': True, 'message': 'Publisher updated successfully'})
         
@@ -1611,10 +5467,17 @@ def edit_category():
         category.name = request.form.get('name')
         category.description = request.form.get('description')
         
-        # Handle parent_id
+        # Handle parent_id, moving the whole subtree
         parent_id = request.form.get('parent_id')
-        category.parent_id = int(parent_id) if parent_id else None
+        error = move_category(category, int(parent_id) if parent_id else None)
+        if error:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': error})
         
+        db.session.flush()
+        reindex_books(Book.category_id == category.id)
+        
+        invalidate_tags('categories')
         db.session.commit()
         return jsonify({'success': True, 'message': 'Category updated successfully'})
         
@@ -1630,13 +5493,9 @@ def add_book():
         return redirect(url_for('dashboard'))
     
     form = BookForm()
-    authors = Author.query.all()
-    publishers = Publisher.query.all()
-    categories = Category.query.all()
-    
-    form.author_id.choices = [(a.id, a.name) for a in authors]
-    form.publisher_id.choices = [(p.id, p.name) for p in publishers]
-    form.category_id.choices = [(c.id, c.name) for c in categories]
+    form.author_id.choices, form.publisher_id.choices, form.category_id.choices = choice_cache.get_many(
+        ['authors', 'publishers', 'categories']
+    )
     
     if form.validate_on_submit():
         try:
@@ -1645,20 +5504,10 @@ def add_book():
             if existing_book:
                 flash(f'A book with ISBN "{form.isbn.data}" already exists. Please use a different ISBN.', 'error')
                 # Re-render the template with form data preserved
-                return render_template('books.html', 
-                                    title='Books', 
-                                    books=Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category)).all(),
-                                    categories=categories, 
-                                    authors=authors, 
-                                    form=form,
-                                    search_query='', 
-                                    category_filter='', 
-                                    author_filter='', 
-                                    current_year=datetime.now().year)
+                return render_book_catalog(form)
             
             # Generate book ID
-            book_count = Book.query.count()
-            new_id = f'B{book_count + 1:06d}'
+            new_id = next_id('book')
             
             new_book = Book(
                 id=new_id,
@@ -1677,6 +5526,10 @@ def add_book():
                 category_id=form.category_id.data
             )
             db.session.add(new_book)
+            db.session.flush()
+            index_book(new_book)
+            adjust_stats(total_books=1)
+            invalidate_tags('books')
             db.session.commit()
             
             flash('Book added successfully', 'success')
@@ -1691,34 +5544,15 @@ def add_book():
                 flash(f'Error adding book: {str(e)}', 'error')
             
             # Re-render the template with form data preserved
-            return render_template('books.html', 
-                                title='Books', 
-                                books=Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category)).all(),
-                                categories=categories, 
-                                authors=authors, 
-                                form=form,
-                                search_query='', 
-                                category_filter='', 
-                                author_filter='', 
-                                current_year=datetime.now().year)
+            return render_book_catalog(form)
     else:
         for field, errors in form.errors.items():
             for error in errors:
                 flash(f'{getattr(form, field).label.text}: {error}', 'error')
     
-    # If form validation fails, redirect back to books page but we need to preserve form data
-    # This is handled by the form object itself which retains the submitted data
-    books_list = Book.query.options(joinedload(Book.author), joinedload(Book.publisher), joinedload(Book.category)).all()
-    return render_template('books.html', 
-                         title='Books', 
-                         books=books_list,
-                         categories=categories, 
-                         authors=authors, 
-                         form=form,
-                         search_query='', 
-                         category_filter='', 
-                         author_filter='', 
-                         current_year=datetime.now().year)
+    # If form validation fails, re-render the first catalog page
+    # The form object itself retains the submitted data
+    return render_book_catalog(form)
 
 @app.route('/add_author', methods=['POST'])
 @login_required
@@ -1737,6 +5571,8 @@ def add_author():
                 nationality=form.nationality.data
             )
             db.session.add(new_author)
+            adjust_stats(total_authors=1)
+            invalidate_tags('authors')
             db.session.commit()
             
             flash('Author added successfully', 'success')
@@ -1768,6 +5604,8 @@ def add_publisher():
                 website=form.website.data
             )
             db.session.add(new_publisher)
+            adjust_stats(total_publishers=1)
+            invalidate_tags('publishers')
             db.session.commit()
             
             flash('Publisher added successfully', 'success')
@@ -1789,8 +5627,7 @@ def add_category():
         return redirect(url_for('dashboard'))
     
     form = CategoryForm()
-    categories = Category.query.all()
-    form.parent_id.choices = [('', 'No Parent')] + [(str(c.id), c.name) for c in categories]
+    form.parent_id.choices = [('', 'No Parent')] + [(str(c.id), c.name) for c in choice_cache.get('categories')]
     
     if form.validate_on_submit():
         try:
@@ -1804,6 +5641,10 @@ def add_category():
                 parent_id=parent_id
             )
             db.session.add(new_category)
+            db.session.flush()  # Get category ID for its path
+            parent = db.session.get(Category, parent_id) if parent_id else None
+            new_category.path = category_path(new_category.id, parent.path if parent else None)
+            invalidate_tags('categories')
             db.session.commit()
             
             flash('Category added successfully', 'success')
@@ -1845,6 +5686,10 @@ def edit_author():
         else:
             author.birth_date = None
         
+        db.session.flush()
+        reindex_books(Book.author_id == author.id)
+        
+        invalidate_tags('authors')
         db.session.commit()
         return jsonify({'success': True, 'message': 'Author updated successfully'})
         
@@ -1863,57 +5708,31 @@ def create_loan():
     
     form = LoanForm()
     
-    # Update choices dynamically
-    available_books = Book.query.filter(Book.available_copies > 0).all()
-    active_members = Member.query.filter(Member.membership_status == 'active').all()
-    
-    form.book_id.choices = [(b.id, f"{b.id} - {b.title}") for b in available_books]
-    form.member_id.choices = [(m.id, f"{m.id} - {m.full_name}") for m in active_members]
-    
     if form.validate_on_submit():
         book_id = form.book_id.data
         member_id = form.member_id.data
         due_date = form.due_date.data
         
-        book = Book.query.get(book_id)
-        member = Member.query.get(member_id)
-        
-        if not book or not member:
-            flash('Book or member not found', 'error')
+        try:
+            loan, reason = checkout_book(member_id, book_id, due_date=due_date)
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error creating loan: {str(e)}', 'error')
             return redirect(url_for('loans'))
         
-        # Check if book is available
-        if not book.is_available:
+        if reason in ('book_not_found', 'member_not_found'):
+            flash('Book or member not found', 'error')
+        elif reason == 'unavailable':
             flash('Book is not available', 'error')
-            return redirect(url_for('loans'))
-        
-        # Check member's current loans
-        if member.current_loans_count >= member.max_books:
+        elif reason == 'limit':
+            member = db.session.get(Member, member_id)
             flash(f'Member has reached their limit of {member.max_books} books', 'error')
-            return redirect(url_for('loans'))
-        
-        # Check if member has pending fines
-        if member.total_fines_due > 0:
+        elif reason == 'fines':
             flash('Member has pending fines. Please clear them first.', 'error')
-            return redirect(url_for('loans'))
-        
-        try:
-            # Create loan
-            new_loan = Loan(
-                book_id=book_id,
-                member_id=member_id,
-                due_date=due_date
-            )
-            db.session.add(new_loan)
-            
-            # Update book availability
-            book.available_copies -= 1
-            
-            db.session.commit()
+        elif reason:
+            flash('The library is busy. Please try again.', 'error')
+        else:
             flash('Loan created successfully', 'success')
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error creating loan: {str(e)}', 'error')
     else:
         for field, errors in form.errors.items():
             for error in errors:
@@ -1922,4 +5741,7 @@ def create_loan():
     return redirect(url_for('loans'))
 
 if __name__ == '__main__':
+    # The reloader imports the app in a child process; only that one serves and runs jobs
+    app.debug = True
+    start_background_tasks()
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,550 @@
+"""Benchmark harness for the library routes.
+
+Seeds a deterministic synthetic library into its own database and replays
+route scenarios against it, either through the Flask test client or over
+HTTP with concurrent clients. Latency percentiles, queries per request and
+peak RSS are written to a JSON baseline, and later runs fail when they
+regress beyond a threshold.
+
+    python benchmark.py seed --scale 10k
+    python benchmark.py run --scale 10k --save bench/baseline-10k.json
+    python benchmark.py run --scale 10k --baseline bench/baseline-10k.json
+    python benchmark.py run --scale 100k --mode http --threads 8
+    python benchmark.py scaling --scale 10k --scale 100k --scenario members
+"""
+from datetime import datetime, timedelta
+from collections import namedtuple
+import http.cookiejar
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import click
+from sqlalchemy import event, func, insert, literal, select
+
+# Rows of books, members and loans generated at each scale
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+SEED = 2025
+BATCH_SIZE = 10_000
+BENCH_MEMBERS = 64  # members that scenarios log in as
+BENCH_PASSWORD = 'bench-password'
+STAFF_LOGIN = ('admin', 'admin123')
+
+WORDS = ['river', 'night', 'garden', 'empire', 'silent', 'winter', 'glass', 'storm', 'secret',
+         'golden', 'shadow', 'ocean', 'iron', 'paper', 'lost', 'city', 'fire', 'island', 'moon', 'road']
+FIRST_NAMES = ['Ada', 'Ben', 'Chen', 'Dara', 'Eli', 'Fatima', 'Goran', 'Hana', 'Ivan', 'Jade',
+               'Kofi', 'Lena', 'Mateo', 'Nia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tariq']
+LAST_NAMES = ['Adams', 'Berg', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+              'Khan', 'Lopez', 'Mensah', 'Novak', 'Okafor', 'Park', 'Quist', 'Rossi', 'Singh', 'Tanaka']
+
+# A scenario drives one route: who runs it and how to build each request
+Scenario = namedtuple('Scenario', ['role', 'method', 'path', 'body'])
+
+SCENARIOS = {
+    'books': Scenario('staff', 'GET', lambda rng, scale: '/books', None),
+    'books_search': Scenario('staff', 'GET', lambda rng, scale: f'/books?search={rng.choice(WORDS)}', None),
+    'books_category': Scenario('staff', 'GET', lambda rng, scale: f'/books?category={rng.randint(1, category_count(scale))}', None),
+    'loans': Scenario('staff', 'GET', lambda rng, scale: '/loans', None),
+    'members': Scenario('staff', 'GET', lambda rng, scale: f'/members?after={member_id(rng.randint(1, SCALES[scale]))}', None),
+    'dashboard_staff': Scenario('staff', 'GET', lambda rng, scale: '/dashboard', None),
+    'dashboard_member': Scenario('member', 'GET', lambda rng, scale: '/dashboard', None),
+    'borrow_book': Scenario('member', 'POST', lambda rng, scale: '/api/borrow_book',
+                            lambda rng, scale: {'book_id': book_id(rng.randint(1, SCALES[scale]))}),
+}
+
+def database_path(scale, suffix=''):
+    """File of a scale's benchmark database, kept apart from library.db"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', f'bench-{scale}{suffix}.db')
+
+def copy_database(source, target):
+    """Copy a SQLite database through the backup API, so pages still in its WAL come along"""
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+
+def load_app(path):
+    """Import the application bound to the SQLite database at `path`"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['RUN_BACKGROUND_JOBS'] = 'false'
+    import app as library
+    return library
+
+def category_count(scale):
+    return max(10, SCALES[scale] // 1000)
+
+def book_id(n):
+    return f'B{n:06d}'
+
+def member_id(n):
+    return f'M{n:06d}'
+
+def batched(rows, size=BATCH_SIZE):
+    """Yield lists of up to `size` rows from an iterator"""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+# Synthetic data
+def generate_library(library, scale, now):
+    """Insert a deterministic library of the given scale. Same scale, same rows."""
+    db = library.db
+    rng = random.Random(SEED)
+    count = SCALES[scale]
+    authors = max(10, count // 20)
+    publishers = max(10, count // 200)
+    categories = category_count(scale)
+
+    def insert_rows(model, rows):
+        for batch in batched(rows):
+            db.session.execute(insert(model), batch)
+            db.session.commit()
+
+    insert_rows(library.Author, ({'id': n, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {n}',
+                                 'nationality': 'Unknown'} for n in range(1, authors + 1)))
+    insert_rows(library.Publisher, ({'id': n, 'name': f'{rng.choice(WORDS).title()} Press {n}'}
+                                   for n in range(1, publishers + 1)))
+    # Every tenth category nests under one of the first ten
+    def category_row(n):
+        name = f'{rng.choice(WORDS).title()} Studies {n}'
+        parent_id = rng.randint(1, 10) if n > 10 and n % 10 == 0 else None
+        return {'id': n, 'name': name, 'parent_id': parent_id,
+                'path': library.category_path(n, library.category_path(parent_id) if parent_id else None)}
+
+    insert_rows(library.Category, (category_row(n) for n in range(1, categories + 1)))
+
+    # Loans go in before books so each book's available copies can match its open loans
+    total_copies = [rng.randint(1, 4) for _ in range(count)]
+    open_loans = [0] * count
+
+    def loans():
+        for n in range(1, count + 1):
+            book = rng.randrange(count)
+            loan_date = now - timedelta(days=rng.randint(1, 365))
+            due_date = loan_date + timedelta(days=14)
+            if rng.random() < 0.7 or open_loans[book] >= total_copies[book]:
+                status, return_date = 'returned', loan_date + timedelta(days=rng.randint(1, 20))
+            else:
+                open_loans[book] += 1
+                status, return_date = ('overdue' if due_date < now else 'active'), None
+            yield {'id': n, 'book_id': book_id(book + 1), 'member_id': member_id(rng.randint(1, count)),
+                   'loan_date': loan_date, 'due_date': due_date, 'return_date': return_date,
+                   'status': status, 'renewed_count': 0, 'max_renewals': 2, 'created_at': loan_date}
+
+    insert_rows(library.Loan, loans())
+    Loan, Fine = library.Loan, library.Fine
+    db.session.execute(insert(Fine).from_select(
+        ['loan_id', 'member_id', 'amount', 'reason', 'issued_date', 'status', 'created_at'],
+        select(Loan.id, Loan.member_id, literal(5.0), literal('overdue'), literal(now, db.DateTime),
+               literal('pending'), literal(now, db.DateTime)).where(Loan.status == 'overdue')
+    ))
+    db.session.commit()
+
+    insert_rows(library.Book, ({
+        'id': book_id(n), 'isbn': f'978{n:010d}',
+        'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title() + f' {n}',
+        'language': 'English', 'publication_year': rng.randint(1900, 2025), 'pages': rng.randint(80, 900),
+        'author_id': rng.randint(1, authors), 'publisher_id': rng.randint(1, publishers),
+        'category_id': rng.randint(1, categories),
+        'total_copies': total_copies[n - 1], 'available_copies': total_copies[n - 1] - open_loans[n - 1],
+        'location': f'Shelf {rng.randint(1, 500)}', 'created_at': now, 'updated_at': now,
+    } for n in range(1, count + 1)))
+
+    # One password hash for every generated account keeps seeding fast
+    password_hash = library.generate_password_hash(BENCH_PASSWORD)
+    members = count + BENCH_MEMBERS
+    first_user = db.session.query(func.coalesce(func.max(library.User.id), 0)).scalar() + 1
+    insert_rows(library.User, ({'id': first_user + n - 1, 'username': f'bench{n}', 'password_hash': password_hash,
+                               'role': 'member', 'created_at': now} for n in range(1, members + 1)))
+    insert_rows(library.Member, ({
+        'id': member_id(n), 'first_name': rng.choice(FIRST_NAMES), 'last_name': f'{rng.choice(LAST_NAMES)}{n}',
+        'email': f'bench{n}@example.org', 'phone': f'555-{n:07d}', 'address': f'{n} Benchmark Road',
+        'membership_type': 'premium' if n % 5 == 0 else 'standard', 'membership_status': 'active',
+        # Scenario members borrow on every request, so their limit never binds
+        'max_books': 3 if n <= count else 10 ** 6,
+        'user_id': first_user + n - 1, 'created_at': now,
+    } for n in range(1, members + 1)))
+
+    library.rebuild_library_stats()
+    library.rebuild_search_index()
+    db.session.commit()
+    return {'books': count, 'members': members, 'loans': count, 'authors': authors,
+            'publishers': publishers, 'categories': categories}
+
+# Measurement
+class QueryCounter:
+    """Counts SQL statements issued while each request is handled"""
+
+    def __init__(self, library):
+        self.library = library
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counts = []
+        with library.app.app_context():
+            event.listen(library.db.engine, 'before_cursor_execute', self.on_execute)
+        library.app.before_request(self.start)
+        library.app.after_request(self.finish)
+
+    def on_execute(self, *args):
+        if getattr(self.local, 'active', False):
+            self.local.queries += 1
+
+    def start(self):
+        self.local.active = True
+        self.local.queries = 0
+
+    def finish(self, response):
+        self.local.active = False
+        response.headers['X-Query-Count'] = str(self.local.queries)
+        return response
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    """Latency percentiles (ms) and mean queries for one scenario's samples"""
+    latencies = [sample[0] * 1000 for sample in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if not sample[2]),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p90_ms': round(percentile(latencies, 0.90), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': round(sum(sample[1] for sample in samples) / len(samples), 2),
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (server included in both modes)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+# Drivers
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+class ClientDriver:
+    """Issues requests through the Flask test client"""
+
+    def __init__(self, library):
+        self.client = library.app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.headers.get('X-Query-Count'), response.get_data()
+
+    def form(self, path, data):
+        response = self.client.post(path, data=data)
+        return response.status_code
+
+class HttpDriver:
+    """Issues requests over HTTP with its own cookie jar"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.headers.get('X-Query-Count'), response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('X-Query-Count'), e.read()
+
+    def form(self, path, data):
+        request = urllib.request.Request(self.base_url + path, data=urllib.parse.urlencode(data).encode('utf-8'))
+        with self.opener.open(request) as response:
+            return response.status
+
+def login(driver, username, password):
+    """Log a driver in through the real login form, CSRF token included"""
+    status, _, page = driver.request('GET', '/login')
+    match = CSRF_PATTERN.search(page.decode('utf-8'))
+    data = {'username': username, 'password': password}
+    if match:
+        data['csrf_token'] = match.group(1)
+    driver.form('/login', data)
+    status, _, _ = driver.request('GET', '/dashboard')
+    if status != 200:
+        raise click.ClickException(f'Could not log in as {username}')
+    return driver
+
+def is_success(status, body):
+    if status >= 400:
+        return False
+    if body[:1] == b'{':
+        return json.loads(body).get('success', True)
+    return True
+
+def run_scenario(scenario, scale, drivers, requests, threads, seed):
+    """Replay one scenario, split across `threads` workers. Returns per-request samples."""
+    samples = []
+    lock = threading.Lock()
+
+    def worker(index, driver):
+        rng = random.Random(seed * 1000 + index)
+        mine = []
+        for _ in range(index, requests, threads):
+            path = scenario.path(rng, scale)
+            body = scenario.body(rng, scale) if scenario.body else None
+            started = time.perf_counter()
+            status, queries, content = driver.request(scenario.method, path, body)
+            elapsed = time.perf_counter() - started
+            mine.append((elapsed, int(queries or 0), is_success(status, content)))
+        with lock:
+            samples.extend(mine)
+
+    workers = [threading.Thread(target=worker, args=(index, drivers[index])) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return samples
+
+def compare(result, baseline, threshold, slack_ms):
+    """List regressions of `result` against `baseline`"""
+    regressions = []
+    for name, current in result['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        # p99 of a few hundred requests is too noisy to gate on; it is reported only
+        for metric in ('p50_ms', 'p90_ms'):
+            limit = before[metric] * (1 + threshold) + slack_ms
+            if current[metric] > limit:
+                regressions.append(f'{name}: {metric} {current[metric]} > {limit:.2f} (baseline {before[metric]})')
+        if current['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {current['queries']} > {before['queries']}")
+        if current['errors'] > before['errors']:
+            regressions.append(f"{name}: errors {current['errors']} > {before['errors']}")
+    limit = baseline['peak_rss_mb'] * (1 + threshold)
+    if result['peak_rss_mb'] > limit:
+        regressions.append(f"peak_rss_mb {result['peak_rss_mb']} > {limit:.1f} (baseline {baseline['peak_rss_mb']})")
+    return regressions
+
+@click.group()
+def cli():
+    """Seed benchmark data and run route benchmarks"""
+
+@cli.command()
+@click.option('--scale', type=click.Choice(sorted(SCALES)), default='10k', show_default=True)
+@click.option('--force', is_flag=True, help='Replace an existing benchmark database.')
+def seed(scale, force):
+    """Generate the synthetic library for a scale"""
+    path = database_path(scale)
+    if os.path.exists(path):
+        if not force:
+            raise click.ClickException(f'{path} already exists; use --force to rebuild it')
+        os.remove(path)
+    library = load_app(path)
+    started = time.time()
+    with library.app.app_context():
+        counts = generate_library(library, scale, datetime(2025, 6, 2, 12, 0))
+    for key, value in counts.items():
+        print(f'{key}: {value}')
+    print(f'elapsed: {time.time() - started:.1f}s')
+
+@cli.command()
+@click.option('--scale', type=click.Choice(sorted(SCALES)), default='10k', show_default=True)
+@click.option('--mode', type=click.Choice(['client', 'http']), default='client', show_default=True,
+              help='Flask test client, or HTTP against a threaded local server.')
+@click.option('--scenario', 'names', multiple=True, type=click.Choice(sorted(SCENARIOS)),
+              help='Scenarios to run (default: all).')
+@click.option('--requests', type=int, default=200, show_default=True, help='Measured requests per scenario.')
+@click.option('--warmup', type=int, default=10, show_default=True, help='Unmeasured requests per scenario.')
+@click.option('--threads', type=int, default=1, show_default=True, help='Concurrent clients.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write the results as a baseline.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Fail on regressions against this baseline.')
+@click.option('--threshold', type=float, default=0.25, show_default=True, help='Allowed relative slowdown.')
+@click.option('--slack-ms', type=float, default=2.0, show_default=True, help='Allowed absolute slowdown.')
+def run(scale, mode, names, requests, warmup, threads, save, baseline, threshold, slack_ms):
+    """Run scenarios and report latency, queries per request and peak RSS"""
+    seeded = database_path(scale)
+    if not os.path.exists(seeded):
+        raise click.ClickException(f'No benchmark data; run: python benchmark.py seed --scale {scale}')
+    # Scenarios write (borrow_book), so every run starts from a fresh copy of the seeded data
+    working = database_path(scale, '-run')
+    copy_database(seeded, working)
+    library = load_app(working)
+    QueryCounter(library)
+
+    server = None
+    if mode == 'http':
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', 0, library.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        new_driver = lambda: HttpDriver(base_url)
+    else:
+        new_driver = lambda: ClientDriver(library)
+
+    staff = [login(new_driver(), *STAFF_LOGIN) for _ in range(threads)]
+    members = [login(new_driver(), f'bench{SCALES[scale] + 1 + index % BENCH_MEMBERS}', BENCH_PASSWORD)
+               for index in range(threads)]
+
+    result = {'scale': scale, 'mode': mode, 'threads': threads, 'requests': requests,
+              'recorded_at': datetime.utcnow().isoformat(timespec='seconds'), 'scenarios': {}}
+    for index, name in enumerate(names or SCENARIOS):
+        scenario = SCENARIOS[name]
+        drivers = staff if scenario.role == 'staff' else members
+        run_scenario(scenario, scale, drivers, warmup, threads, seed=SEED + 7919 * index + 1)
+        samples = run_scenario(scenario, scale, drivers, requests, threads, seed=SEED + 7919 * index)
+        result['scenarios'][name] = summarize(samples)
+        stats = result['scenarios'][name]
+        print(f"{name:<18} p50 {stats['p50_ms']:>8.2f}ms  p90 {stats['p90_ms']:>8.2f}ms  "
+              f"p99 {stats['p99_ms']:>8.2f}ms  queries {stats['queries']:>6.2f}  errors {stats['errors']}")
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(f"peak RSS: {result['peak_rss_mb']} MB")
+
+    if server is not None:
+        server.shutdown()
+
+    if save:
+        os.makedirs(os.path.dirname(os.path.abspath(save)), exist_ok=True)
+        with open(save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f'Baseline written to {save}')
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), threshold, slack_ms)
+        if regressions:
+            for line in regressions:
+                print(f'REGRESSION {line}')
+            raise click.ClickException(f'{len(regressions)} regressions against {baseline}')
+        print(f'No regressions against {baseline}')
+
+@cli.command()
+@click.option('--scale', 'scales', multiple=True, type=click.Choice(sorted(SCALES)), default=('10k', '100k'),
+              show_default=True, help='Seeded scales to compare (at least two).')
+@click.option('--scenario', 'names', multiple=True, type=click.Choice(sorted(SCENARIOS)), default=('members',),
+              show_default=True, help='Scenarios whose queries per request must not grow.')
+@click.option('--requests', type=int, default=50, show_default=True, help='Measured requests per scenario.')
+def scaling(scales, names, requests):
+    """Fail when queries per request differ between seeded scales.
+
+    Each scale runs in its own process, since the app binds its database at
+    import. A scenario whose query count grows with the data has an N+1.
+    """
+    if len(set(scales)) < 2:
+        raise click.UsageError('Give at least two different --scale values.')
+    queries = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            output = os.path.join(directory, f'{scale}.json')
+            command = [sys.executable, os.path.abspath(__file__), 'run', '--scale', scale,
+                       '--requests', str(requests), '--save', output]
+            for name in names:
+                command += ['--scenario', name]
+            subprocess.run(command, check=True)
+            with open(output, encoding='utf-8') as f:
+                queries[scale] = {name: stats['queries'] for name, stats in json.load(f)['scenarios'].items()}
+
+    mismatches = [name for name in names if len({queries[scale][name] for scale in scales}) > 1]
+    for name in names:
+        counts = ', '.join(f'{scale}: {queries[scale][name]}' for scale in scales)
+        print(f"{name:<18} queries per request  {counts}{'  MISMATCH' if name in mismatches else ''}")
+    if mismatches:
+        raise click.ClickException(f"Queries per request grow with the data: {', '.join(mismatches)}")
+
+def throughput_worker(library, scale, kind, index, deadline, results):
+    """Run reads or borrow transactions until `deadline`, then report (kind, done, failed)"""
+    rng = random.Random(SEED + index)
+    done = failed = 0
+    with library.app.app_context():
+        # Connections inherited through fork must not be shared with the parent
+        library.db.engine.dispose(close=False)
+        session = library.db.session
+        while time.time() < deadline:
+            try:
+                if kind == 'read':
+                    book = session.get(library.Book, book_id(rng.randint(1, SCALES[scale])))
+                    member = session.get(library.Member, member_id(rng.randint(1, SCALES[scale])))
+                    ok = book is not None and member.total_fines_due >= 0
+                    session.rollback()
+                else:
+                    member = member_id(SCALES[scale] + 1 + index % BENCH_MEMBERS)
+                    loan, reason = library.checkout_book(member, book_id(rng.randint(1, SCALES[scale])))
+                    ok = reason in (None, 'unavailable')
+            except library.OperationalError:
+                session.rollback()
+                ok = False
+            done += ok
+            failed += not ok
+    results.put((kind, done, failed))
+
+@cli.command()
+@click.option('--scale', type=click.Choice(sorted(SCALES)), default='10k', show_default=True)
+@click.option('--readers', type=int, default=8, show_default=True, help='Reader processes.')
+@click.option('--writers', type=int, default=2, show_default=True, help='Borrowing processes.')
+@click.option('--seconds', type=float, default=10.0, show_default=True)
+def throughput(scale, readers, writers, seconds):
+    """Measure concurrent read and borrow throughput against the database.
+
+    Workers are separate processes, like web server workers. Compare engine
+    settings by running under different environments, e.g.
+    SQLITE_JOURNAL_MODE=delete SQLITE_SYNCHRONOUS=full against the defaults.
+    """
+    import multiprocessing
+
+    seeded = database_path(scale)
+    if not os.path.exists(seeded):
+        raise click.ClickException(f'No benchmark data; run: python benchmark.py seed --scale {scale}')
+    working = database_path(scale, '-run')
+    copy_database(seeded, working)
+    library = load_app(working)
+    with library.app.app_context():
+        journal_mode = library.db.session.execute(library.text('PRAGMA journal_mode')).scalar()
+        library.db.session.remove()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    deadline = time.time() + 1 + seconds
+    kinds = ['read'] * readers + ['write'] * writers
+    workers = [context.Process(target=throughput_worker, args=(library, scale, kind, index, deadline, results))
+               for index, kind in enumerate(kinds)]
+    for worker in workers:
+        worker.start()
+    counts = {'read': [0, 0], 'write': [0, 0]}
+    for _ in workers:
+        kind, done, failed = results.get()
+        counts[kind][0] += done
+        counts[kind][1] += failed
+    for worker in workers:
+        worker.join()
+
+    print(f"journal_mode: {journal_mode}, synchronous: {library.app.config['SQLITE_SYNCHRONOUS']}")
+    print(f"reads/s:  {counts['read'][0] / seconds:>10.1f}  ({counts['read'][1]} failed)")
+    print(f"writes/s: {counts['write'][0] / seconds:>10.1f}  ({counts['write'][1]} failed)")
+
+if __name__ == '__main__':
+    cli()
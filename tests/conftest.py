@@ -0,0 +1,66 @@
+"""Shared fixtures: the application bound to a throwaway SQLite database"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+DATABASE_DIR = tempfile.mkdtemp(prefix='library-tests-')
+DATABASE_PATH = os.path.join(DATABASE_DIR, 'library.db')
+
+# The app reads these at import, so they are set before any test imports it
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE_PATH}'
+os.environ['RUN_BACKGROUND_JOBS'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_numbers = itertools.count(1)
+
+@pytest.fixture(scope='session')
+def library():
+    import app as library
+    library.app.config['WTF_CSRF_ENABLED'] = False
+    return library
+
+@pytest.fixture
+def app_context(library):
+    with library.app.app_context():
+        yield
+        library.db.session.remove()
+
+def unique(prefix):
+    """A value no other test has used, e.g. unique('T') -> 'T000007'"""
+    return f'{prefix}{next(_numbers):06d}'
+
+def create_members(library, count, max_books=3):
+    """Insert `count` active members (with their users) and return their ids"""
+    db = library.db
+    ids = []
+    for _ in range(count):
+        username = unique('user')
+        user = library.User(username=username, password_hash='x', role='member')
+        db.session.add(user)
+        db.session.flush()
+        member_id = unique('T')
+        db.session.add(library.Member(id=member_id, first_name='Test', last_name=username,
+                                      email=f'{username}@example.org', phone='555-0100',
+                                      address='1 Test Road', max_books=max_books, user_id=user.id))
+        ids.append(member_id)
+    db.session.commit()
+    return ids
+
+def create_book(library, copies):
+    """Insert a book with `copies` available copies and return its id"""
+    db = library.db
+    author = library.Author(name='Test Author')
+    publisher = library.Publisher(name='Test Press')
+    category = library.Category(name=unique('Category '))
+    db.session.add_all([author, publisher, category])
+    db.session.flush()
+    category.path = library.category_path(category.id)
+    book_id = unique('X')
+    db.session.add(library.Book(id=book_id, isbn=unique('978'), title=f'Test Book {book_id}',
+                                author_id=author.id, publisher_id=publisher.id, category_id=category.id,
+                                total_copies=copies, available_copies=copies))
+    db.session.commit()
+    return book_id
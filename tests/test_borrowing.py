@@ -0,0 +1,44 @@
+"""checkout_book under concurrent borrowers"""
+import threading
+
+from conftest import create_book, create_members
+
+THREADS = 16
+COPIES = 3
+
+def test_concurrent_checkouts_never_oversell(library, app_context):
+    db = library.db
+    book_id = create_book(library, COPIES)
+    member_ids = create_members(library, THREADS)
+    start = threading.Barrier(THREADS)
+    results = []
+    observed = []
+    lock = threading.Lock()
+
+    def borrow(member_id):
+        with library.app.app_context():
+            start.wait()
+            loan, reason = library.checkout_book(member_id, book_id)
+            available = db.session.get(library.Book, book_id).available_copies
+            db.session.remove()
+        with lock:
+            results.append((loan is not None, reason))
+            observed.append(available)
+
+    threads = [threading.Thread(target=borrow, args=(member_id,)) for member_id in member_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    loans = library.Loan.query.filter_by(book_id=book_id, return_date=None).count()
+    book = db.session.get(library.Book, book_id)
+    assert sum(ok for ok, _ in results) == COPIES
+    assert loans == COPIES
+    assert book.available_copies == 0
+    assert min(observed) >= 0
+    assert {reason for ok, reason in results if not ok} == {'unavailable'}
+
+def test_checkout_of_a_missing_book(library, app_context):
+    member_id, = create_members(library, 1)
+    assert library.checkout_book(member_id, 'X999999') == (None, 'book_not_found')
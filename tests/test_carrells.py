@@ -0,0 +1,45 @@
+"""Carrell rental expiry and key fines"""
+from datetime import datetime, timedelta
+
+from conftest import create_members, unique
+
+def start_overdue_rental(library, member_id, now):
+    db = library.db
+    carrell = library.Carrell(id=unique('Q'), name='Test Carrell', location='Floor 1', is_available=False)
+    rental = library.CarrellRental(carrell_id=carrell.id, member_id=member_id, rental_date=now - timedelta(hours=3),
+                                   scheduled_end_time=now - timedelta(minutes=1))
+    db.session.add_all([carrell, rental])
+    db.session.flush()
+    carrell.current_rental_id = rental.id
+    db.session.commit()
+    return rental.id
+
+def end_rental(library, rental_id, key_returned):
+    client = library.app.test_client()
+    client.post('/login', data={'username': 'librarian', 'password': 'librarian123'})
+    return client.post('/end_carrell_rental', json={'rental_id': rental_id, 'key_returned': key_returned}).get_json()
+
+def test_a_late_key_return_waives_the_sweeper_fine(library, app_context):
+    member_id, = create_members(library, 1)
+    now = datetime.utcnow()
+    rental_id = start_overdue_rental(library, member_id, now)
+
+    library.expire_carrell_rentals(now)
+    fine = library.Fine.query.filter_by(rental_id=rental_id).one()
+    assert (fine.reason, fine.status) == ('key_not_returned', 'pending')
+    assert library.db.session.get(library.Member, member_id).total_fines_due == library.app.config['CARRELL_KEY_FINE']
+
+    assert end_rental(library, rental_id, key_returned=True)['success']
+    library.db.session.refresh(fine)
+    assert fine.status == 'waived'
+    assert library.db.session.get(library.Member, member_id).total_fines_due == 0
+
+def test_a_lost_key_keeps_its_single_fine(library, app_context):
+    member_id, = create_members(library, 1)
+    now = datetime.utcnow()
+    rental_id = start_overdue_rental(library, member_id, now)
+
+    library.expire_carrell_rentals(now)
+    assert end_rental(library, rental_id, key_returned=False)['success']
+    fines = library.Fine.query.filter_by(member_id=member_id).all()
+    assert [(fine.rental_id, fine.status) for fine in fines] == [(rental_id, 'pending')]
@@ -0,0 +1,25 @@
+"""Category subtrees through materialized paths"""
+from sqlalchemy import event
+
+from conftest import create_book
+
+def test_subtree_filter_is_one_statement(library, app_context):
+    db = library.db
+    books = {name: create_book(library, 1) for name in ('root', 'child', 'grandchild', 'sibling')}
+    categories = {name: db.session.get(library.Book, book_id).category for name, book_id in books.items()}
+    for name, parent in (('child', 'root'), ('grandchild', 'child')):
+        assert library.move_category(categories[name], categories[parent].id) is None
+    db.session.commit()
+    root_id = str(categories['root'].id)
+
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        found = {book.id for book in library.build_book_query(category_filter=root_id)}
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert found == {books['root'], books['child'], books['grandchild']}
+    assert len(statements) == 1
+    assert library.build_book_query(category_filter='999999').all() == []
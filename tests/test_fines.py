@@ -0,0 +1,30 @@
+"""Set-based fine accrual"""
+from datetime import datetime
+
+from conftest import create_book, create_members
+
+def test_nightly_accrual_never_lowers_a_fine(library, app_context):
+    db = library.db
+    member_id, = create_members(library, 1)
+    book_id = create_book(library, 1)
+    loan = library.Loan(book_id=book_id, member_id=member_id, loan_date=datetime(2025, 5, 16, 6, 0),
+                        due_date=datetime(2025, 5, 30, 6, 0))
+    db.session.add(loan)
+    db.session.commit()
+    only_this_loan = [library.Loan.id == loan.id]
+
+    # Three whole days by noon, but only two as of midnight
+    now = datetime(2025, 6, 2, 12, 0)
+    library.accrue_overdue_fines(now, criteria=only_this_loan)
+    fine = library.Fine.query.filter_by(loan_id=loan.id).one()
+    assert fine.amount == 3.0
+
+    report = library.accrue_overdue_fines(now, criteria=only_this_loan, nightly=True, dry_run=True)
+    assert report['fines_to_update'] == 0
+    library.accrue_overdue_fines(now, criteria=only_this_loan, nightly=True)
+    db.session.refresh(fine)
+    assert fine.amount == 3.0
+
+    library.accrue_overdue_fines(datetime(2025, 6, 4, 0, 0), criteria=only_this_loan, nightly=True)
+    db.session.refresh(fine)
+    assert fine.amount == 4.0
@@ -0,0 +1,37 @@
+"""next_id across processes sharing one database"""
+import multiprocessing
+
+PROCESSES = 6
+IDS_PER_PROCESS = 150
+
+def draw_ids(library, count, results):
+    with library.app.app_context():
+        # Connections inherited through fork must not be shared with the parent
+        library.db.engine.dispose(close=False)
+        ids = [library.next_id('member') for _ in range(count)]
+        library.db.session.remove()
+    results.put(ids)
+
+def test_forked_processes_never_draw_the_same_id(library, app_context):
+    # The parent holds a partly used block when it forks; children must not reuse it
+    parent_ids = [library.next_id('member')]
+    value, end = library.id_allocator.blocks['member']
+    assert value < end
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=draw_ids, args=(library, IDS_PER_PROCESS, results))
+               for _ in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    child_ids = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    parent_ids += [library.next_id('member') for _ in range(IDS_PER_PROCESS)]
+    drawn = parent_ids + [member_id for ids in child_ids for member_id in ids]
+    assert len(drawn) == (PROCESSES + 1) * IDS_PER_PROCESS + 1
+    assert len(set(drawn)) == len(drawn)
+    inherited = {library.format_id('member', n) for n in range(value, end)}
+    assert not inherited & {member_id for ids in child_ids for member_id in ids}
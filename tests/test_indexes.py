@@ -0,0 +1,10 @@
+"""Every hot query is answered from an index"""
+
+def test_hot_queries_use_an_index(library, app_context):
+    results = library.check_hot_queries()
+    failing = {name: plan for name, (uses_index, plan) in results.items() if not uses_index}
+    for name, plan in failing.items():
+        print(f'{name}:')
+        for line in plan:
+            print(f'    {line}')
+    assert all(uses_index for uses_index, _ in results.values()), f'Full scans in: {", ".join(failing)}'
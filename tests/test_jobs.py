@@ -0,0 +1,57 @@
+"""Job leases stop a runner that was taken over; one overdue fine per loan"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+from sqlalchemy.exc import IntegrityError
+
+from conftest import create_book, create_members, unique
+
+def create_overdue_loan(library, member_id, book_id):
+    loan = library.Loan(book_id=book_id, member_id=member_id, loan_date=datetime(2025, 5, 16, 6, 0),
+                        due_date=datetime(2025, 5, 30, 6, 0))
+    library.db.session.add(loan)
+    library.db.session.commit()
+    return loan.id
+
+def take_over(library, name, holder):
+    """Expire the lease and hand it to `holder`, as a runner that outlived the TTL would see"""
+    library.db.session.get(library.JobLease, name).expires_at = datetime.utcnow() - timedelta(seconds=1)
+    library.db.session.commit()
+    assert library.acquire_lease(name, holder, 60)
+
+def test_a_runner_whose_lease_was_taken_stops_before_the_next_chunk(library, app_context):
+    member_id, = create_members(library, 1)
+    loan_id = create_overdue_loan(library, member_id, create_book(library, 1))
+    name = unique('lease')
+    assert library.acquire_lease(name, 'first', 60)
+    g.job_lease = (name, 'first')
+    library.renew_job_lease()
+
+    take_over(library, name, 'second')
+    with pytest.raises(library.LeaseLost):
+        library.accrue_overdue_fines(datetime(2025, 6, 2), criteria=[library.Loan.id == loan_id])
+    assert library.Fine.query.filter_by(loan_id=loan_id).count() == 0
+
+def test_run_job_lets_a_lost_lease_through_without_recording_an_error(library, app_context):
+    name = unique('lease')
+    assert library.acquire_lease(name, 'first', 60)
+    g.job_lease = (name, 'first')
+    take_over(library, name, 'second')
+
+    with pytest.raises(library.LeaseLost):
+        library.run_job('carrell_expiry')
+    state = library.db.session.get(library.JobState, 'carrell_expiry')
+    assert state is None or not (state.last_error or '').startswith('Lease')
+
+def test_a_loan_has_at_most_one_overdue_fine(library, app_context):
+    db = library.db
+    member_id, = create_members(library, 1)
+    loan_id = create_overdue_loan(library, member_id, create_book(library, 1))
+    library.accrue_overdue_fines(datetime(2025, 6, 2), criteria=[library.Loan.id == loan_id])
+
+    db.session.add(library.Fine(loan_id=loan_id, member_id=member_id, amount=3.0, reason='overdue'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    assert library.Fine.query.filter_by(loan_id=loan_id).count() == 1
@@ -0,0 +1,14 @@
+"""Book typeahead lookups"""
+from conftest import create_book
+
+def test_numeric_titles_are_found(library, app_context):
+    book_id = create_book(library, 1)
+    book = library.db.session.get(library.Book, book_id)
+    book.title = 'Nineteen Eighty-Four 1984'
+    library.db.session.flush()
+    library.reindex_books(library.Book.id == book_id)
+    library.db.session.commit()
+
+    assert book_id in [result['id'] for result in library.lookup_books('1984', 10)]
+    # ISBN prefixes still come first
+    assert library.lookup_books(book.isbn, 10)[0]['id'] == book_id
@@ -0,0 +1,35 @@
+"""The /members listing issues a constant number of queries"""
+from sqlalchemy import event
+
+from conftest import create_members
+
+def count_queries(library, client, path):
+    counted = []
+    listener = lambda *args: counted.append(1)
+    event.listen(library.db.engine, 'before_cursor_execute', listener)
+    try:
+        assert client.get(path).status_code == 200
+    finally:
+        event.remove(library.db.engine, 'before_cursor_execute', listener)
+    return len(counted)
+
+def test_members_queries_do_not_grow_with_page_size(library, app_context):
+    client = library.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    create_members(library, 40)
+    client.get('/members')
+
+    small = count_queries(library, client, '/members?per_page=5')
+    large = count_queries(library, client, '/members?per_page=40')
+    assert small == large
+
+def test_members_pages_do_not_overlap(library, app_context):
+    create_members(library, 12)
+
+    first = library.paginate_members(per_page=5)
+    second = library.paginate_members(after=first['next_cursor'], per_page=5)
+    back = library.paginate_members(before=second['prev_cursor'], per_page=5)
+    assert len(first['members']) == 5
+    assert first['prev_cursor'] is None
+    assert {m.id for m in first['members']}.isdisjoint(m.id for m in second['members'])
+    assert [m.id for m in back['members']] == [m.id for m in first['members']]
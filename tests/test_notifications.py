@@ -0,0 +1,115 @@
+"""Claim-and-send notification dispatch"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from conftest import create_members
+
+class RecordingTransport:
+    """Delivers every notification except those whose title is in `failing`"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send(self, message):
+        if message['title'] in self.failing:
+            raise ConnectionError('transport down')
+        self.sent.append(message['title'])
+
+def schedule(library, member_id, titles, now):
+    db = library.db
+    notifications = [library.Notification(member_id=member_id, title=title, message=title,
+                                          notification_type='test', scheduled_time=now - timedelta(minutes=index + 1))
+                     for index, title in enumerate(titles)]
+    db.session.add_all(notifications)
+    db.session.commit()
+    return [notification.id for notification in notifications]
+
+def test_failed_deliveries_are_skipped_for_the_rest_of_the_run(library, app_context):
+    member_id, = create_members(library, 1)
+    now = datetime.utcnow()
+    ids = schedule(library, member_id, ['first', 'second', 'third', 'fourth'], now)
+    only_these = library.Notification.id.in_(ids)
+    library.Notification.query.filter(~only_these, library.Notification.sent_time == None).update(
+        {'sent_time': now}, synchronize_session=False)
+    library.db.session.commit()
+
+    # 'fourth' is the oldest and fails; later batches must move on to the rest
+    transport = RecordingTransport(failing={'fourth'})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        reports = [library.dispatch_notification_batch(transport, executor, now, batch_size=1) for _ in range(5)]
+
+    assert [report['claimed'] for report in reports] == [1, 1, 1, 1, 0]
+    assert sorted(transport.sent) == ['first', 'second', 'third']
+    failed = library.Notification.query.filter_by(title='fourth', member_id=member_id).one()
+    assert failed.sent_time is None
+    assert failed.attempts == 1
+    assert failed.claimed_until > now
+    assert library.Notification.query.filter(only_these, library.Notification.sent_time != None).count() == 3
+
+def test_a_crashed_claim_is_retried_after_its_lease(library, app_context):
+    member_id, = create_members(library, 1)
+    now = datetime.utcnow()
+    notification_id, = schedule(library, member_id, ['orphaned'], now)
+
+    # A dispatcher claims the row and dies before delivering it
+    token, claimed = library.claim_due_notifications(now, 1000)
+    assert notification_id in [notification.id for notification in claimed]
+    assert library.db.session.get(library.Notification, notification_id).sent_time is None
+    assert notification_id not in [n.id for n in library.claim_due_notifications(now, 1000)[1]]
+
+    later = now + timedelta(seconds=library.app.config['NOTIFICATION_LEASE_SECONDS'] + 1)
+    token, claimed = library.claim_due_notifications(later, 1000)
+    assert notification_id in [notification.id for notification in claimed]
+
+def test_streams_beyond_the_limit_are_refused(library, app_context, monkeypatch):
+    monkeypatch.setattr(library, 'notification_stream_slots', threading.BoundedSemaphore(1))
+    member_id, = create_members(library, 1)
+    user_id = library.db.session.get(library.Member, member_id).user_id
+    client = library.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    first = client.get('/api/notifications/stream', buffered=False)
+    assert first.status_code == 200
+    assert next(first.response).startswith(b'retry:')
+    assert client.get('/api/notifications/stream').status_code == 503
+
+    first.close()
+    # A stream closed before its first chunk still gives its slot back
+    second = client.get('/api/notifications/stream', buffered=False)
+    assert second.status_code == 200
+    second.close()
+    third = client.get('/api/notifications/stream', buffered=False)
+    assert third.status_code == 200
+    third.close()
+
+def test_concurrent_mark_read_decrements_once(library, app_context):
+    member_id, = create_members(library, 1)
+    now = datetime.utcnow()
+    notification_id, = schedule(library, member_id, ['unread'], now)
+    library.rebuild_unread_counters()
+    library.db.session.commit()
+    user_id = library.db.session.get(library.Member, member_id).user_id
+    before = library.load_unread_count(member_id)
+    start = threading.Barrier(4)
+    statuses = []
+
+    def mark_read():
+        client = library.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        start.wait()
+        statuses.append(client.post('/api/notifications/mark_read',
+                                    json={'notification_id': notification_id}).get_json()['success'])
+
+    threads = [threading.Thread(target=mark_read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [True] * 4
+    library.db.session.expire_all()
+    assert library.load_unread_count(member_id) == before - 1
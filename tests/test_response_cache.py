@@ -0,0 +1,19 @@
+"""Response cache of the book catalog"""
+from conftest import create_members
+
+def test_only_staff_get_the_cached_catalog(library):
+    # Requests run outside a test app context, so g is not shared between the two users
+    with library.app.app_context():
+        member_id, = create_members(library, 1)
+        user_id = library.db.session.get(library.Member, member_id).user_id
+
+    staff = library.app.test_client()
+    staff.post('/login', data={'username': 'librarian', 'password': 'librarian123'})
+    assert 'ETag' in staff.get('/books').headers
+
+    member = library.app.test_client()
+    with member.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    response = member.get('/books')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
@@ -0,0 +1,7 @@
+"""WSGI entry point: the app, with the periodic job runner started in each worker"""
+from app import app, start_background_tasks
+
+start_background_tasks()
+
+if __name__ == "__main__":
+    app.run()